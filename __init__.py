@@ -88,6 +88,7 @@ class AnimateObject(bpy.types.Operator):
     def execute(self, context):
         bootstrap.check_modules_existence()
         from src import get_trajectory_from_path
+        from src.dataset_cache import DatasetCache
         scene = context.scene
         # get current frame per seconds value
         fps = scene.render.fps
@@ -95,7 +96,7 @@ class AnimateObject(bpy.types.Operator):
         # get current selected object in scene
         obj = scene.objects.active
         # TODO check object is not None
-        positions, times, angular_positions = get_trajectory_from_path(scene.datasetPath)
+        positions, times, angular_positions = get_trajectory_from_path(scene.datasetPath, DatasetCache())
         # set animation lenght
         bpy.context.scene.frame_end = times[-1] * fps
         # create animation data
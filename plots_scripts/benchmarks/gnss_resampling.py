@@ -0,0 +1,69 @@
+"""
+Benchmark vectorized gnss resampling of unmodified fullinertial input against per timestamp interpolation
+
+This file is part of inertial_to_blender project,
+a Blender simulation generator from inertial sensor data on cars.
+
+Copyright (C) 2018  Federico Bertani
+Author: Federico Bertani
+Credits: Federico Bertani, Stefano Sinigardi, Alessandro Fabbri, Nico Curti
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import sys
+import time
+
+import numpy as np
+from scipy.interpolate import interp1d
+
+sys.path.append('tests')
+from FullInertialFileGenerator import FullInertialFileGenerator
+from src.input_manager import get_vectors, InputType
+
+
+def loop_get_vectors(df):
+    """ Previous implementation of get_vectors for unmodified fullinertial input """
+    clean_gnss_data = df.dropna(subset=['lat'])
+    gnss_data = clean_gnss_data[['lat', 'lon', 'alt', 'heading', 'speed']].values
+    gnss_data_timestamp = clean_gnss_data['timestamp'].values
+    coord_func = interp1d(x=gnss_data_timestamp, y=gnss_data.T, kind='quadratic',
+                          fill_value='extrapolate', assume_sorted=True)
+    df = df.dropna(subset=['ax'])
+    accelerations = df[['ax', 'ay', 'az']].values.T
+    angular_velocities = df[['gx', 'gy', 'gz']].values.T
+    times = df['timestamp'].values.T
+    coordinatesX, coordinatesY, altitudes, heading, gps_speed = zip(*[coord_func(time) for time in times])
+    coordinates = np.array([x for x in zip(coordinatesX, coordinatesY)]).T
+    altitudes = np.array(altitudes).T
+    heading = np.array(heading).T
+    gps_speed = np.array(gps_speed).T
+    heading = 270 - heading
+    return times, coordinates, altitudes, gps_speed, heading, accelerations, angular_velocities
+
+
+if __name__ == '__main__':
+    # 100 Hz inertial records
+    for max_time in [60, 600, 3600]:
+        df = FullInertialFileGenerator(max_time=max_time).get_dataframe(unmodified=True)
+        start_time = time.time()
+        expected = loop_get_vectors(df)
+        loop_time = time.time() - start_time
+        start_time = time.time()
+        vectors = get_vectors(df, InputType.UNMOD_FULLINERTIAL)
+        vectorized_time = time.time() - start_time
+        max_error = max(abs(expected_vector - vector).max() for expected_vector, vector in zip(expected, vectors))
+        print("{} s of data: loop {:.3f} s, vectorized {:.3f} s, speedup {:.1f}x, max difference {}".format(
+            max_time, loop_time, vectorized_time, loop_time / vectorized_time, max_error))
@@ -0,0 +1,85 @@
+"""
+Benchmark scaling of blocked parallel quaternion chaining with the number of threads
+
+Sequential chain is compared with the blocked scan of rotations.chain_quaternions
+on numba backend from 1 thread to all available ones, and on numpy backend.
+With numba older than 0.49 only NUMBA_NUM_THREADS threads are measured, set it before running.
+Number of samples can be passed as first argument, default is 10 millions (about 28 hours at 100 Hz).
+
+This file is part of inertial_to_blender project,
+a Blender simulation generator from inertial sensor data on cars.
+
+Copyright (C) 2018  Federico Bertani
+Author: Federico Bertani
+Credits: Federico Bertani, Stefano Sinigardi, Alessandro Fabbri, Nico Curti
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import sys
+import time
+
+import numpy as np
+import quaternion
+
+from src.backends import numba
+from src.rotations import chain_quaternions
+
+
+def get_chain_time(quaternions, backend, block_size=None):
+    """ Return seconds to chain quaternions and result """
+    start_time = time.time()
+    chain = chain_quaternions(quaternions, backend, block_size)
+    return time.time() - start_time, chain
+
+
+if __name__ == '__main__':
+    samples = int(sys.argv[1]) if len(sys.argv) > 1 else 10 ** 7
+    random = np.random.RandomState(0)
+    # small rotations like the ones of 100 Hz angular velocities integration
+    quaternions = quaternion.from_rotation_vector(random.normal(0, 0.01, (samples, 3)))
+    numpy_time, expected = get_chain_time(quaternions, 'numpy')
+    print("{} samples, numpy sequential: {:.3f} s".format(samples, numpy_time))
+    # square root of samples minimizes python iterations of numpy blocked scan
+    block_size = int(np.sqrt(samples)) + 1
+    blocked_time, chain = get_chain_time(quaternions, 'numpy', block_size)
+    print("numpy blocked: {:.3f} s, speedup {:.1f}x, max difference {:.1e}".format(
+        blocked_time, numpy_time / blocked_time,
+        abs(quaternion.as_float_array(chain) - quaternion.as_float_array(expected)).max()))
+    if numba is None:
+        print("numba is not installed, skipping parallel scan")
+        sys.exit()
+    # compile kernels
+    chain_quaternions(quaternions[:100], 'numba')
+    chain_quaternions(quaternions[:100], 'numba', 10)
+    sequential_time, _ = get_chain_time(quaternions, 'numba')
+    print("numba sequential: {:.3f} s".format(sequential_time))
+    max_threads = numba.config.NUMBA_NUM_THREADS
+    # some blocks for each thread to balance load
+    block_size = max(samples // (8 * max_threads), 1)
+    if hasattr(numba, 'set_num_threads'):
+        threads_counts = range(1, max_threads + 1)
+    else:
+        # numba older than 0.49 can't change threads at runtime, they are fixed by NUMBA_NUM_THREADS at import
+        print("numba {} can't set threads at runtime, measuring only {} threads, "
+              "set NUMBA_NUM_THREADS to measure others".format(numba.__version__, max_threads))
+        threads_counts = [max_threads]
+    for threads in threads_counts:
+        if hasattr(numba, 'set_num_threads'):
+            numba.set_num_threads(threads)
+        blocked_time, chain = get_chain_time(quaternions, 'numba', block_size)
+        print("numba blocked, {} threads: {:.3f} s, speedup {:.2f}x, max difference {:.1e}".format(
+            threads, blocked_time, sequential_time / blocked_time,
+            abs(quaternion.as_float_array(chain) - quaternion.as_float_array(expected)).max()))
@@ -0,0 +1,72 @@
+"""
+Benchmark closed form Simpson integration against per column linear system solution
+
+Differences grow with timestamps because the previous implementation solves for parabola coefficients
+in absolute time, losing precision to cancellation. Closed form is shift invariant.
+
+This file is part of inertial_to_blender project,
+a Blender simulation generator from inertial sensor data on cars.
+
+Copyright (C) 2018  Federico Bertani
+Author: Federico Bertani
+Credits: Federico Bertani, Stefano Sinigardi, Alessandro Fabbri, Nico Curti
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import time
+
+import numpy as np
+
+from src.integrate import simps_integrate_delta
+
+
+def loop_simps_integrate_delta(times, vectors):
+    """ Previous implementation of simps_integrate_delta """
+    rows = vectors.shape[0]
+    columns = vectors.shape[1]
+    deltas = np.zeros((rows, columns))
+    for j in range(0, columns - 2):
+        x = times[j:j + 3]
+        vector_locals = vectors[:, j:j + 3]
+        for i, y in enumerate(vector_locals):
+            matrix = np.array([
+                [x[0] ** 2, x[0], 1],
+                [x[1] ** 2, x[1], 1],
+                [x[2] ** 2, x[2], 1],
+            ])
+            A, B, C = np.linalg.solve(matrix, y)
+            deltas[i, j + 1] = A / 3 * (x[1] ** 3 - x[0] ** 3) + B / 2 * (x[1] ** 2 - x[0] ** 2) + C * (x[1] - x[0])
+            if j == columns - 3:
+                deltas[i, j + 2] = A / 3 * (x[2] ** 3 - x[1] ** 3) + B / 2 * (x[2] ** 2 - x[1] ** 2) + C * (x[2] - x[1])
+    return deltas
+
+
+if __name__ == '__main__':
+    random = np.random.RandomState(0)
+    # 100 Hz samples with jitter, timestamps normalized as in get_trajectory_from_path
+    for max_time in [10, 60, 600]:
+        times = np.cumsum(random.uniform(0.008, 0.012, max_time * 100))
+        times -= times[0]
+        vectors = random.normal(0, 1, (3, times.shape[0]))
+        start_time = time.time()
+        expected = loop_simps_integrate_delta(times, vectors)
+        loop_time = time.time() - start_time
+        start_time = time.time()
+        deltas = simps_integrate_delta(times, vectors)
+        vectorized_time = time.time() - start_time
+        print("{} s of data: loop {:.3f} s, vectorized {:.4f} s, speedup {:.0f}x, max relative difference {:.1e}".format(
+            max_time, loop_time, vectorized_time, loop_time / vectorized_time,
+            abs(expected - deltas).max() / abs(expected).max()))
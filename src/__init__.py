@@ -29,67 +29,87 @@ import numpy as np
 from src.clean_data_utils import converts_measurement_units, reduce_disturbance, \
     clear_gyro_drift, correct_z_orientation, normalize_timestamp, \
     sign_inversion_is_necessary, get_stationary_times, correct_xy_orientation
-from src.gnss_utils import get_positions, get_velocities, get_initial_angular_position, get_first_motion_time
-from src.input_manager import parse_input, InputType
+from src.gnss_utils import get_positions, get_velocities, get_initial_angular_position, get_first_motion_time, \
+    get_velocities_from_rates
+from src.input_manager import parse_input, parse_recording, InputType
 from src.integrate import cumulative_integrate
-from src.rotations import rotate_accelerations, align_to_world
+from src.preprocessing import preprocess_inertial
+from src.rotations import rotate_accelerations, align_to_world, get_world_alignment_angle
 
-def get_trajectory_from_path(path):
+def get_trajectory_from_path(path, cache=None, fused_preprocessing=False):
     """
     parse input file from path, clean data and integrate positions
 
     :param path: string input file
+    :param cache: optional DatasetCache to avoid parsing again the same input file
+    :param fused_preprocessing: bool if True clean inertial data with preprocessing.preprocess_inertial
     :return: 3 numpy array: 3xn position, 1xn times, 4xn angular position as quaternions
     """
 
     window_size = 20
 
     # currently default format is unmodified fullinertial but other formats are / will be supported
-    times, coordinates, altitudes, gps_speed, heading, accelerations, angular_velocities = parse_input(path, [
-        InputType.UNMOD_FULLINERTIAL])
+    recording = parse_recording(path, [InputType.UNMOD_FULLINERTIAL], cache=cache)
+    gps_speed = recording.gps_speed
+    heading = recording.heading
 
-    converts_measurement_units(accelerations, angular_velocities, gps_speed, coordinates, heading)
+    if fused_preprocessing:
+        # inertial units are converted by the fused preprocessing
+        converts_measurement_units(None, None, gps_speed, recording.coordinates, heading, recording.coordinate_rates)
+    else:
+        converts_measurement_units(recording.accelerations, recording.angular_velocities, gps_speed,
+                                   recording.coordinates, heading, recording.coordinate_rates)
 
     # get positions from GNSS data
-    gnss_positions, headings_2 = get_positions(coordinates, altitudes)
-
-    # reduce accelerations disturbance
-    times, accelerations = reduce_disturbance(times, accelerations, window_size)
-    # reduce angular velocities disturbance
-    _, angular_velocities = reduce_disturbance(times, angular_velocities, window_size)
-    # truncate other array to match length of acc, thetas, times array
-    gnss_positions = gnss_positions[:, round(window_size / 2):-round(window_size / 2)]
-
-    # with "final" times now get velocities and
-    real_velocities = get_velocities(times, gnss_positions)
-    # scalar speed from GNSS position (better than from dataset because avoids Kalmar filter)
-    real_speeds = np.linalg.norm(real_velocities, axis=0)
+    gnss_positions, headings_2 = get_positions(recording.coordinates, recording.altitudes)
 
     # get time windows where vehicle is stationary
     stationary_times = get_stationary_times(gps_speed)
 
-    # clear gyroscope drift
-    angular_velocities = clear_gyro_drift(angular_velocities, stationary_times)
-    # set times start to 0
-    normalize_timestamp(times)
+    if fused_preprocessing:
+        # reduce disturbance, clear gyroscope drift, set times start to 0, correct z-axis alignment and remove g
+        times, accelerations, angular_velocities = preprocess_inertial(recording.times, recording.inertial,
+                                                                       stationary_times, window_size)
+    else:
+        # reduce accelerations and angular velocities disturbance together
+        times, inertial = reduce_disturbance(recording.times, recording.inertial, window_size)
+        accelerations = inertial[:3]
+        angular_velocities = inertial[3:]
+        # clear gyroscope drift
+        angular_velocities = clear_gyro_drift(angular_velocities, stationary_times)
+        # set times start to 0
+        normalize_timestamp(times)
+        # correct z-axis alignment
+        accelerations, angular_velocities = correct_z_orientation(accelerations, angular_velocities,
+                                                                  stationary_times)
+        # remove g
+        accelerations[2] -= accelerations[2, stationary_times[0][0]:stationary_times[0][-1]].mean()
 
-    # correct z-axis alignment
-    accelerations, angular_velocities = correct_z_orientation(accelerations, angular_velocities, stationary_times)
-
-    # remove g
-    accelerations[2] -= accelerations[2, stationary_times[0][0]:stationary_times[0][-1]].mean()
+    # truncate other array to match length of acc, thetas, times array
+    gnss_range = slice(round(window_size / 2), -round(window_size / 2))
+    gnss_positions = gnss_positions[:, gnss_range]
+
+    if recording.coordinate_rates is not None:
+        # velocities from derivative of gnss interpolating spline
+        real_velocities = get_velocities_from_rates(recording.coordinates[:, gnss_range],
+                                                    recording.coordinate_rates[:, gnss_range])
+    else:
+        # with "final" times now get velocities and
+        real_velocities = get_velocities(times, gnss_positions)
+    # scalar speed from GNSS position (better than from dataset because avoids Kalmar filter)
+    real_speeds = np.linalg.norm(real_velocities, axis=0)
 
     # correct alignment in xy plane
-    #accelerations = correct_xy_orientation(accelerations, angular_velocities)
+    accelerations = correct_xy_orientation(accelerations, angular_velocities)
 
     motion_time = get_first_motion_time(stationary_times,gnss_positions)
     initial_angular_position = get_initial_angular_position(gnss_positions,motion_time)
 
-    # convert to laboratory frame of reference
-    accelerations, angular_positions = rotate_accelerations(times, accelerations, angular_velocities, heading, initial_angular_position)
-
-    # rotate to align y to north, x to east
-    accelerations = align_to_world(gnss_positions, accelerations, motion_time)
+    # convert to laboratory frame of reference and rotate to align y to north, x to east
+    world_alignment_angle = get_world_alignment_angle(gnss_positions, motion_time)
+    accelerations, angular_positions = rotate_accelerations(times, accelerations, angular_velocities, heading,
+                                                            initial_angular_position,
+                                                            world_alignment_angle=world_alignment_angle)
     # angular position doesn't need to be aligned to world if starting angular position is already aligned and following
     # angular positions are calculated from that
 
@@ -0,0 +1,145 @@
+"""
+Selection of the backend of numerical kernels.
+
+Hot loops of integrate, gnss_utils and preprocessing modules have a NumPy implementation
+and, when numba is installed, a compiled one. The default backend is selected at import time:
+numba if available, else NumPy. It can be forced with the INERTIAL_TO_BLENDER_BACKEND environment variable,
+at runtime with set_backend() or use_backend(), or for a single call with the backend argument of functions.
+
+This file is part of inertial_to_blender project,
+a Blender simulation generator from inertial sensor data on cars.
+
+Copyright (C) 2018  Federico Bertani
+Author: Federico Bertani
+Credits: Federico Bertani, Stefano Sinigardi, Alessandro Fabbri, Nico Curti
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import os
+from contextlib import contextmanager
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# loop of parallel kernels, iterations run on multiple threads when compiled with parallel=True
+prange = range if numba is None else numba.prange
+
+# environment variable forcing the default backend
+backend_variable = 'INERTIAL_TO_BLENDER_BACKEND'
+backends = ('numba', 'numpy')
+# backends usable in this environment
+available_backends = ('numpy',) if numba is None else backends
+
+
+def check_backend(backend):
+    """
+    Check backend is known and available
+
+    :param backend: string backend name
+    :return: string backend name
+    :raises:
+        Exception if backend is unknown or numba is not available
+    """
+    if backend not in backends:
+        raise Exception("Unknown backend {}".format(backend))
+    if backend == 'numba' and numba is None:
+        raise Exception("numba is not installed")
+    return backend
+
+
+def get_default_backend():
+    """
+    Get backend from environment variable, numba when available if it's not set
+
+    :return: string backend name
+    :raises:
+        Exception if environment variable backend is unknown or not available
+    """
+    backend = os.environ.get(backend_variable)
+    if not backend:
+        return available_backends[0]
+    return check_backend(backend.lower())
+
+
+selected_backend = get_default_backend()
+
+
+def get_backend(backend=None):
+    """
+    Get backend to use in a call
+
+    :param backend: string backend name or None to use the selected one
+    :return: string backend name
+    :raises:
+        Exception if backend is unknown or not available
+    """
+    return selected_backend if backend is None else check_backend(backend)
+
+
+def set_backend(backend):
+    """
+    Set backend used when functions backend argument is None
+
+    :param backend: string backend name
+    :return: string previously selected backend name
+    :raises:
+        Exception if backend is unknown or not available
+    """
+    global selected_backend
+    previous_backend = selected_backend
+    selected_backend = check_backend(backend)
+    return previous_backend
+
+
+@contextmanager
+def use_backend(backend):
+    """
+    Context manager selecting a backend inside the with block
+
+    :param backend: string backend name
+    """
+    previous_backend = set_backend(backend)
+    try:
+        yield
+    finally:
+        set_backend(previous_backend)
+
+
+def compile_kernel(kernel, parallel=False):
+    """
+    Compile a kernel with numba, results are cached on disk
+
+    :param kernel: function using only numba supported features
+    :param parallel: bool if True prange loops of kernel run on multiple threads
+    :return: compiled function or None if numba is not installed
+    """
+    if numba is None:
+        return None
+    return numba.njit(cache=True, parallel=parallel)(kernel)
+
+
+def compile_function(function):
+    """
+    Decorator compiling a function called by kernels, it stays callable from Python
+
+    :param function: function using only numba supported features
+    :return: compiled function or function itself if numba is not installed
+    """
+    if numba is None:
+        return function
+    return numba.njit(cache=True)(function)
@@ -0,0 +1,178 @@
+"""
+Batch ingestion of many recording files on multiple processes.
+
+Each worker parses a file and saves the result as a .npy file,
+the caller gets memory maps of them so big arrays are never pickled between processes.
+
+This file is part of inertial_to_blender project,
+a Blender simulation generator from inertial sensor data on cars.
+
+Copyright (C) 2018  Federico Bertani
+Author: Federico Bertani
+Credits: Federico Bertani, Stefano Sinigardi, Alessandro Fabbri, Nico Curti
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+from src.sensor_recording import SensorRecording
+
+# bytes read at once when prefetching files without posix_fadvise
+prefetch_block_size = 1024 ** 2
+
+
+def prefetch_file(filepath):
+    """
+    Ask the operating system to load file content in page cache
+
+    :param filepath: string
+    """
+    try:
+        if hasattr(os, 'posix_fadvise'):
+            fd = os.open(filepath, os.O_RDONLY)
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            finally:
+                os.close(fd)
+        else:
+            with open(filepath, mode='rb') as file:
+                while file.read(prefetch_block_size):
+                    pass
+    except OSError:
+        # prefetch is only an optimization, errors are raised when the file is parsed
+        pass
+
+
+def ingest_file(filepath, output_path, trajectory=False, cache_directory=None):
+    """
+    Parse a file and save result to output_path
+
+    Runs in worker processes.
+
+    :param filepath: string input file
+    :param output_path: string output .npy file
+    :param trajectory: bool if True save trajectory as 8xn array of times, positions and angular positions
+        instead of the parsed recording
+    :param cache_directory: optional string directory of DatasetCache
+    :return: string output_path
+    """
+    cache = None
+    if cache_directory is not None:
+        from src.dataset_cache import DatasetCache
+        cache = DatasetCache(cache_directory)
+    if trajectory:
+        from src import get_trajectory_from_path
+        positions, times, angular_positions = get_trajectory_from_path(filepath, cache)
+        result = np.vstack((times, positions, angular_positions))
+    else:
+        from src.input_manager import parse_recording
+        result = parse_recording(filepath, cache=cache).block
+    np.save(output_path, result)
+    return output_path
+
+
+def print_progress(done, total, filepath, error=None):
+    """
+    Default progress callback of ingest_files
+
+    :param done: int number of processed files
+    :param total: int number of files
+    :param filepath: string last processed file
+    :param error: optional exception raised processing the file
+    """
+    if error is None:
+        print("[{}/{}] {}".format(done, total, filepath))
+    else:
+        print("[{}/{}] {} failed: {}".format(done, total, filepath, error), file=sys.stderr)
+
+
+def ingest_files(filepaths, output_directory, workers=None, trajectory=False, cache_directory=None,
+                 progress=print_progress):
+    """
+    Parse many files on a process pool
+
+    Only workers files are processed at once. While they are processed the next file is prefetched.
+
+    :param filepaths: list of string input files
+    :param output_directory: string directory where results are saved as .npy files
+    :param workers: optional int number of worker processes, default number of CPUs
+    :param trajectory: bool if True get trajectories instead of parsed recordings, see ingest_file()
+    :param cache_directory: optional string directory of DatasetCache used by workers
+    :param progress: callable ``f(done, total, filepath, error)`` called when a file is processed, can be None
+    :return: list with, for each input file, a read-only memory mapped SensorRecording
+        (8xn numpy array if trajectory is True) or None if the file processing failed
+    """
+    os.makedirs(output_directory, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    total = len(filepaths)
+    output_paths = []
+    for index, filepath in enumerate(filepaths):
+        # prefix with index because different directories can have files with the same name
+        file_name = "{:04d}_{}.npy".format(index, os.path.basename(filepath))
+        output_paths.append(os.path.join(output_directory, file_name))
+    results = [None] * total
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor, ThreadPoolExecutor(max_workers=1) as prefetcher:
+        pending = {}
+        next_index = 0
+
+        def submit_next():
+            nonlocal next_index
+            future = executor.submit(ingest_file, filepaths[next_index], output_paths[next_index], trajectory,
+                                     cache_directory)
+            pending[future] = next_index
+            next_index += 1
+            if next_index < total:
+                # load next file from disk while current ones are processed
+                prefetcher.submit(prefetch_file, filepaths[next_index])
+
+        while next_index < min(workers, total):
+            submit_next()
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                index = pending.pop(future)
+                error = future.exception()
+                if error is None:
+                    result = np.load(future.result(), mmap_mode='r')
+                    results[index] = result if trajectory else SensorRecording(result)
+                done += 1
+                if progress is not None:
+                    progress(done, total, filepaths[index], error)
+                if next_index < total:
+                    submit_next()
+    return results
+
+
+def find_input_files(paths):
+    """
+    Expand directories to the files they contain
+
+    :param paths: list of string files or directories
+    :return: list of string files, directories content is sorted by name
+    """
+    filepaths = []
+    for path in paths:
+        if os.path.isdir(path):
+            filepaths.extend(sorted(os.path.join(path, file_name) for file_name in os.listdir(path)
+                                    if os.path.isfile(os.path.join(path, file_name))))
+        else:
+            filepaths.append(path)
+    return filepaths
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+"""
+CLI program to parse many datasets, or create their trajectories, on multiple processes
+
+This file is part of inertial_to_blender project,
+a Blender simulation generator from inertial sensor data on cars.
+
+Copyright (C) 2018  Federico Bertani
+Author: Federico Bertani
+Credits: Federico Bertani, Stefano Sinigardi, Alessandro Fabbri, Nico Curti
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+if __name__ == '__main__':
+    import sys, os
+    # fix import path
+    sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    from src.batch import ingest_files, find_input_files
+    import argparse
+
+    # parse program parameters
+    parser = argparse.ArgumentParser(description='Parse many Inertia[+GNSS] datasets in parallel')
+    parser.add_argument('inputs', type=str, nargs='+', help='Input files or directories')
+    parser.add_argument('output', type=str, help='Output directory of .npy files')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes, default CPU count')
+    parser.add_argument('--trajectory', action='store_true',
+                        help='Save trajectories (times, positions, angular positions) instead of parsed data')
+    parser.add_argument('--cache-dir', type=str, default=None, help='Directory of parsed input files cache')
+    args = parser.parse_args()
+
+    filepaths = find_input_files(args.inputs)
+    results = ingest_files(filepaths, args.output, args.workers, args.trajectory, args.cache_dir)
+    failed = sum(result is None for result in results)
+    print("Processed {} files, {} failed".format(len(results), failed))
+    sys.exit(1 if failed > 0 else 0)
@@ -31,8 +31,10 @@ Credits: Federico Bertani, Stefano Sinigardi, Alessandro Fabbri, Nico Curti
 
 """
 
+import warnings
+
 import numpy as np
-from quaternion import quaternion
+from quaternion import quaternion, as_rotation_matrix
 from scipy import constants
 from scipy import cross, dot, arccos, arctan2, cos, sin, pi
 from scipy.linalg import norm
@@ -52,51 +54,67 @@ def parse_input(df):
     return times, gps_speed, accelerations, angular_velocities
 
 
+def find_stationary_times(gps_speed, speed_threshold, min_stationary_time_length=10):
+    """ Returns list of contiguous index slices where the gps speed is inside a threshold
+
+    Runs of samples inside threshold are found from the changes of the boolean mask.
+
+    :param gps_speed: 1xn numpy array of gps speed in m/s
+    :param speed_threshold: float speed threshold in m/s
+    :param min_stationary_time_length: int slices with last - first index not greater than this are discarded
+    :return: list of tuples, each one with first and last index of a stationary time
+    """
+    # Find times where gps speed is inside threshold
+    boolean_vect = np.logical_and(gps_speed > -speed_threshold, gps_speed < speed_threshold)
+    # pad with False so every run has a beginning and an end
+    changes = np.flatnonzero(np.diff(np.concatenate(([False], boolean_vect, [False])).astype(np.int8)))
+    # a run begins at even changes and ends before odd ones
+    first_trues = changes[0::2]
+    last_trues = changes[1::2] - 1
+    long_enough = last_trues - first_trues > min_stationary_time_length
+    return list(zip(first_trues[long_enough].tolist(), last_trues[long_enough].tolist()))
+
+
 def get_stationary_times(gps_speed):
     """ Returns list of index where the gps speed is near zero
 
+    Speed threshold starts near zero and is increased by 0.1 m/s until at least a stationary time is found.
+    The smallest working threshold is found by bisection.
+
     :param gps_speed: 1xn numpy array of gps speed in m/s
     :return: list of tuples, each one with start and final timestamp of a stationary time index
+    :raises:
+        Exception if there are no stationary times with any threshold
     """
 
     speed_threshold = 1e-15  # 0.2 m/s
-    stationary_times = []
-    # repeat until at least a stationary time is found
-    while (len(stationary_times)==0):
-        min_stationary_time_length = 10
-        # Find times where gps speed is inside threshold
-        # Didn't use np.nonzero because i needed contiguous slices and also check on length of slice
-        boolean_vect = np.bitwise_and(gps_speed > -speed_threshold, gps_speed < speed_threshold)
-        import math
-        # set a value that can't exist as index
-        first_true = math.inf
-        last_true = math.inf
-        for i, x in enumerate(boolean_vect):
-            if first_true == math.inf and x is np.bool_(True):
-                # enter stationary time mode
-                first_true = i
-            if first_true != math.inf and x is np.bool_(True):
-                # add a timestamp to slice
-                last_true = i
-            if first_true != math.inf and last_true != math.inf and x is np.bool_(False):
-                # end slice
-                # if slice length is greater than a minimum length
-                if last_true - first_true > min_stationary_time_length:
-                    # add slice to stationary times list
-                    stationary_times.append((first_true, last_true))
-                # reset
-                first_true = math.inf
-                last_true = math.inf
-        # handle case where stationary times not ends before data ends
-        if first_true != math.inf and last_true != math.inf and (last_true - first_true) > min_stationary_time_length:
-            stationary_times.append((first_true, last_true))
-        # TODO raise exception if there are no stationary times
-        # increase speed threshold in case stationary times are not found
-        speed_threshold += 0.1
+    speed_threshold_step = 0.1
+    finite_speed = np.abs(gps_speed[np.isfinite(gps_speed)])
+    if finite_speed.shape[0] == 0:
+        raise Exception("No stationary times found")
+    # number of steps after which all finite speeds are inside threshold
+    max_steps = int(np.ceil(finite_speed.max() / speed_threshold_step)) + 1
+    # thresholds are accumulated as incremented one step at a time
+    speed_thresholds = np.cumsum(np.concatenate(([speed_threshold], np.full(max_steps, speed_threshold_step))))
+    # a greater threshold can only make stationary times longer so bisect on steps
+    low = -1
+    high = max_steps
+    stationary_times = find_stationary_times(gps_speed, speed_thresholds[high])
+    if len(stationary_times) == 0:
+        raise Exception("No stationary times found")
+    while high - low > 1:
+        middle = (low + high) // 2
+        middle_stationary_times = find_stationary_times(gps_speed, speed_thresholds[middle])
+        if len(middle_stationary_times) > 0:
+            high = middle
+            stationary_times = middle_stationary_times
+        else:
+            low = middle
     return stationary_times
 
 
-def converts_measurement_units(accelerations, angular_velocities, gps_speed=None, coordinates=None, heading=None):
+def converts_measurement_units(accelerations, angular_velocities, gps_speed=None, coordinates=None, heading=None,
+                               coordinate_rates=None):
     """ Convert physics quantity measurement unit
 
     Convert accelerations from g units to m/s^2
@@ -107,21 +125,27 @@ def converts_measurement_units(accelerations, angular_velocities, gps_speed=None
     Applies inplace
 
     :param gps_speed: 1xn array of gps speed in km/h
-    :param accelerations: 3xn array of acceleration in g unit
-    :param angular_velocities: 3xn array of angular velocities in degrees/s
+    :param accelerations: 3xn array of acceleration in g unit, None if converted elsewhere
+    :param angular_velocities: 3xn array of angular velocities in degrees/s, None if converted elsewhere
     :param coordinates: optional 2xn array of coordinates in geographic coordinate system
+    :param heading: optional 1xn array of heading in degrees
+    :param coordinate_rates: optional 2xn array of coordinates time derivatives in degrees/s
     """
-    accelerations *= constants.g
+    if accelerations is not None:
+        accelerations *= constants.g
     if coordinates is not None:
         # multiply to degree to radians constant
         coordinates *= constants.degree
-    # multiply to degree to radians constant
-    angular_velocities *= constants.degree
+    if angular_velocities is not None:
+        # multiply to degree to radians constant
+        angular_velocities *= constants.degree
     if gps_speed is not None:
         # multiply to km/h -> m/s constant
         gps_speed *= constants.kmh
     if heading is not None:
         heading *= constants.degree
+    if coordinate_rates is not None:
+        coordinate_rates *= constants.degree
 
 
 def normalize_timestamp(times):
@@ -148,50 +172,82 @@ def clear_gyro_drift(angular_velocities, stationary_times):
 
     This function assumes the car is stationary in the first 10000 measurements
 
+    Applies inplace
+
     :param angular_velocities: 3xn numpy array of angular velocities
-    :param stationary_times: list of tuples (start,end)
+    :param stationary_times: list of tuples (start,end) sorted by time and not overlapping
+    :return: 3xn numpy array, the same angular velocities array
     """
 
-    # get offset on first stationary time
-    main_offset = angular_velocities[:, stationary_times[0][0]:stationary_times[0][1]].mean(axis=1)
-    # remove on all data
-    angular_velocities = (angular_velocities.T - main_offset).T
-    # for remaining stationary times
-    for stationary_time in stationary_times[1:]:
-        start = stationary_time[0]
-        end = stationary_time[1]
-        # offset can now be changed by heat, remove only from start time of stationary time to end of data
-        offset = angular_velocities[:, start:end].mean(axis=1)
-        angular_velocities[:, start:] = (angular_velocities[:, start:].T - offset).T
+    # offset can be changed by heat, so each stationary time offset is removed from its start time
+    # until the next stationary time, first offset is removed also before the first stationary time
+    length = angular_velocities.shape[1]
+    # stationary times found on untrimmed data can start after the end of data, like clamping their start
+    # to the end of data (offset never applied) but without averaging empty slices
+    stationary_times = stationary_times[:1] + [stationary_time for stationary_time in stationary_times[1:]
+                                               if stationary_time[0] < length]
+    offsets = np.array([angular_velocities[:, start:end].mean(axis=1) for start, end in stationary_times]).T
+    starts = [stationary_time[0] for stationary_time in stationary_times[1:]]
+    segment_lengths = np.diff([0] + starts + [length])
+    # remove piecewise constant offsets in a single pass, inplace
+    angular_velocities -= np.repeat(offsets, segment_lengths, axis=1)
     return angular_velocities
 
 
-def reduce_disturbance(times, vectors, window_dimension):
-    """ Reduce data disturbance with a moving average
+def get_cumulative_sums(vectors):
+    """ Cumulative sums of each row, with a leading zero column
 
-    The length of the window is calculated internally in function of vector length
-    Some values at the beginning of the array will be dropped.
+    Mean of each row is subtracted first so cumulative sums stay small and don't lose precision on long arrays.
+
+    :param vectors: mxn numpy array of whatever numeric
+    :return: 2 numpy arrays: mx(n+1) cumulative sums, mx1 subtracted means
+    """
+    offsets = vectors.mean(axis=1, keepdims=True, dtype=np.float64)
+    cumulative_sums = np.zeros((vectors.shape[0], vectors.shape[1] + 1))
+    np.subtract(vectors, offsets, out=cumulative_sums[:, 1:])
+    np.cumsum(cumulative_sums[:, 1:], axis=1, out=cumulative_sums[:, 1:])
+    return cumulative_sums, offsets
+
+
+def reduce_disturbance(times, vectors, window_dimension=None, window_seconds=None):
+    """ Reduce data disturbance with a centered moving average
+
+    Accelerations and angular velocities can be stacked and processed in one call.
+    Values at the beginning and at the end of the array without a complete window will be dropped.
 
     :param times: 1xn numpy array of timestamps
-    :param vectors: 3xn numpy array of whatever numeric
-    :param window_dimension: int rolling average window dimension
+    :param vectors: mxn numpy array of whatever numeric
+    :param window_dimension: int rolling average window dimension in samples
+    :param window_seconds: float rolling average window length in seconds, alternative to window_dimension
+        for irregular timestamps
     :return 2 numpy vector: new times and new vector
+    :raises:
+        Exception if both or none of window_dimension and window_seconds are given
     """
 
-    # TODO dynamically find windows dimension for 0.5 s
-    window_dimension = window_dimension
-    # use pandas because it has built in function of moving average
-    # performance overhead is not much
-    import pandas as pd
-    df = pd.DataFrame(vectors.T)
-    # overwrite dataframe with its moving average
-    df = df.rolling(window=window_dimension, center=True).mean()
-    # now there ara 0:windows_dimension nan rows at the beginning
-    # drop these rows
-    new_low_range = round(window_dimension / 2)
-    new_upper_range = round(df.shape[0] - window_dimension / 2)
-    # TODO change drop offset
-    new_vector = df[new_low_range:new_upper_range].values.T
+    if (window_dimension is None) == (window_seconds is None):
+        raise Exception("Give one of window_dimension and window_seconds")
+    vectors = np.atleast_2d(vectors)
+    # sum of each window is the difference of two cumulative sums, whatever the window length
+    cumulative_sums, offsets = get_cumulative_sums(vectors)
+    if window_dimension is not None:
+        # drop the same rows of pandas centered rolling mean, window starting at j is centered in j + w // 2
+        new_low_range = round(window_dimension / 2)
+        new_upper_range = max(round(vectors.shape[1] - window_dimension / 2), new_low_range)
+        first_start = new_low_range - window_dimension // 2
+        last_start = new_upper_range - window_dimension // 2
+        new_vector = np.subtract(cumulative_sums[:, first_start + window_dimension:last_start + window_dimension],
+                                 cumulative_sums[:, first_start:last_start])
+        new_vector /= window_dimension
+    else:
+        half_window = window_seconds / 2
+        # keep only samples with window inside data
+        new_low_range = np.searchsorted(times, times[0] + half_window, side='left')
+        new_upper_range = max(np.searchsorted(times, times[-1] - half_window, side='right'), new_low_range)
+        starts = np.searchsorted(times, times[new_low_range:new_upper_range] - half_window, side='left')
+        ends = np.searchsorted(times, times[new_low_range:new_upper_range] + half_window, side='right')
+        new_vector = (cumulative_sums[:, ends] - cumulative_sums[:, starts]) / (ends - starts)
+    new_vector += offsets
     new_times = times[new_low_range:new_upper_range]
     return new_times, new_vector
 
@@ -234,27 +290,22 @@ def get_bad_alignment_vectors(accelerations, angular_velocities):
         :param conditions: list of boolean arrays with same length of vector
         :return vector: at least 100 long subset of vector where conditions apply
         """
-        import math
-        start = math.inf
-        end = math.inf
-        from functools import reduce
-        for i, _ in enumerate(vector.T):
-            conditions_on_i = map(lambda x: x[i], conditions)
-            # logical AND on all conditions list
-            condition_value = reduce(lambda acc, x: acc & x, conditions_on_i)
-            if start == math.inf and condition_value:
-                start = i
-            if start != math.inf and condition_value:
-                end = i
-            if start != math.inf and end != math.inf and not condition_value:
-                if end - start > 100:
-                    break
-                start = math.inf
-                end = math.inf
-        if start != math.inf and end != math.inf:
-            return vector[:, start:end]
+        # logical AND on all conditions list
+        condition_values = np.logical_and.reduce(conditions)
+        # pad with False so every contiguous slice has a beginning and an end
+        changes = np.flatnonzero(np.diff(np.concatenate(([False], condition_values, [False])).astype(np.int8)))
+        starts = changes[0::2]
+        ends = changes[1::2] - 1
+        long_enough = np.flatnonzero(ends - starts > 100)
+        if long_enough.shape[0] > 0:
+            # first slice long enough
+            start, end = starts[long_enough[0]], ends[long_enough[0]]
+        elif ends.shape[0] > 0 and ends[-1] == condition_values.shape[0] - 1:
+            # a slice of any length still open when data ends
+            start, end = starts[-1], ends[-1]
         else:
             return np.array([])
+        return vector[:, start:end]
 
     # operate logical AND element-wise to get elements
     x1 = filter_contiguous(accelerations, [ax_over_threshold, ay_over_threshold, gx_below_threshold])
@@ -270,42 +321,69 @@ def correct_xy_orientation(accelerations, angular_velocities):
     :param accelerations: 3xn numpy array angular velocities
     :param angular_velocities: 3xn numpy array angular velocities
 
-    :return accelerations: 3xn numpy array
+    :return accelerations: 3xn numpy array, the given one if no rotation is needed
     """
 
     def rotatexy(bad_align_proof):
         new_accelerations = accelerations.copy()
-        if len(bad_align_proof) > 0 and bad_align_proof.shape[1] > 0:
-            # get first vector
-            vec = bad_align_proof.mean(axis=1)
-            # get angle and negate it to remove rotation
-            angle = -arctan2(vec[1], vec[0])
-            if (vec[1] > 0 and vec[0] < 0):
-                # TODO check if this case is necessary (is out of coverage)
-                angle = pi + angle
-            elif (vec[1] < 0 and vec[0] < 0):
-                angle = -(pi + angle)
-            # use new var instead of inplace so when we rotate y we don't use the rotated x but the old one
-            new_accelerations[0] = cos(angle) * accelerations[0] - sin(angle) * accelerations[1]
-            new_accelerations[1] = sin(angle) * accelerations[0] + cos(angle) * accelerations[1]
+        # get first vector
+        vec = bad_align_proof.mean(axis=1)
+        # get angle and negate it to remove rotation
+        angle = -arctan2(vec[1], vec[0])
+        if (vec[1] > 0 and vec[0] < 0):
+            # TODO check if this case is necessary (is out of coverage)
+            angle = pi + angle
+        elif (vec[1] < 0 and vec[0] < 0):
+            angle = -(pi + angle)
+        # use new var instead of inplace so when we rotate y we don't use the rotated x but the old one
+        new_accelerations[0] = cos(angle) * accelerations[0] - sin(angle) * accelerations[1]
+        new_accelerations[1] = sin(angle) * accelerations[0] + cos(angle) * accelerations[1]
         # now set new arrays
         return get_xy_bad_align_count(new_accelerations, angular_velocities), new_accelerations
 
-    print("initial bad align sum {}".format(get_xy_bad_align_count(accelerations, angular_velocities)))
     # get bad align vector for all +- combinations
-    x1, x2, x3, x4 = get_bad_alignment_vectors(accelerations, angular_velocities)
-    # get best vector than minimize sum of bad align vectors after rotations
-    best_bad_vector = min([x1, x2, x3, x4], key=lambda x: rotatexy(x)[0])
-    # rotate accelerations
-    _, accelerations = rotatexy(best_bad_vector)
-    print("final bad align sum {}".format(get_xy_bad_align_count(accelerations, angular_velocities)))
-    return accelerations
+    bad_vectors = get_bad_alignment_vectors(accelerations, angular_velocities)
+    initial_bad_align_count = sum(x.shape[1] if len(x) > 0 else 0 for x in bad_vectors)
+    # rotate once for each candidate, empty candidates leave accelerations as they are
+    candidates = []
+    for bad_vector in bad_vectors:
+        if len(bad_vector) > 0 and bad_vector.shape[1] > 0:
+            candidates.append(rotatexy(bad_vector))
+        else:
+            candidates.append((initial_bad_align_count, accelerations))
+    # get rotation that minimize sum of bad align vectors, first one in case of tie
+    final_bad_align_count, new_accelerations = min(candidates, key=lambda candidate: candidate[0])
+    if new_accelerations is not accelerations:
+        warnings.warn("Found bad xy alignment, rotating vectors reduced bad align sum from {} to {}".format(
+            initial_bad_align_count, final_bad_align_count))
+    return new_accelerations
 
     # TODO find if there are others times where the condition returns
     # raise a warning/exception
     # rotate from that time above
 
 
+# misalignment of z-axis in later stationary times above which data are realigned
+z_realign_threshold = np.deg2rad(10)
+
+
+def get_z_alignment(g):
+    """ Get rotation that aligns the gravity vector to z-axis
+
+    :param g: 1x3 numpy array measured gravity vector
+    :return: float rotation angle in radians, 3x3 numpy array rotation matrix
+    """
+    g_norm = norm(g)
+    u = cross(g, (0, 0, 1))
+    # rotation axis
+    u_unit = u / norm(u)
+    # rotate angle
+    theta = arccos(dot(g, (0, 0, 1)) / g_norm)
+    rotator = np.exp(quaternion(*(theta * u_unit)) / 2)
+    # same rotation of rotator * v * ~rotator as a matrix applied to all vectors at once
+    return theta, as_rotation_matrix(rotator)
+
+
 def correct_z_orientation(accelerations, angular_velocities, stationary_times):
     """ Use gravity vector direction to align reference frame to correct z-axis
 
@@ -314,30 +392,19 @@ def correct_z_orientation(accelerations, angular_velocities, stationary_times):
     :param accelerations: 3xn numpy array angular velocities
     :param angular_velocities: 3xn numpy array angular velocities
     :param stationary_times: list of tuples (start,end)
-    :return: numpy arrays: rotated accelerations, rotated angular velocities
+    :return: numpy arrays: rotated accelerations, rotated angular velocities, same arrays given rotated in place
     """
 
     # get value of g in all stationary times
     g = np.mean(np.concatenate(
         [accelerations[:,stationary_time[0]:stationary_time[1]] for stationary_time in stationary_times],axis=1),axis=1)
-    def align_from_g_vector(accelerations, angular_velocities, g):
-        g_norm = norm(g)
-        u = cross(g, (0, 0, 1))
-        # rotation axis
-        u_unit = u / norm(u)
-        # rotate angle
-        theta = arccos(dot(g, (0, 0, 1)) / g_norm)
+    def align_from_g_vector(accelerations, angular_velocities, g, start=0):
+        theta, rotation_matrix = get_z_alignment(g)
         print("rotating vectors of "+str(np.rad2deg(theta))+" degrees align to z")
-        rotator = np.exp(quaternion(*(theta * u_unit)) / 2)
-        rotated_accelerations = np.array(
-            [(rotator * quaternion(*acceleration_vector) * ~rotator).components[1:]
-             for acceleration_vector in accelerations.T])
-        rotated_angular_velocities = np.array(
-            [(rotator * quaternion(*angular_velocity) * ~rotator).components[1:]
-             for angular_velocity in angular_velocities.T])
-        return rotated_accelerations.T, rotated_angular_velocities.T
+        accelerations[:, start:] = rotation_matrix @ accelerations[:, start:]
+        angular_velocities[:, start:] = rotation_matrix @ angular_velocities[:, start:]
 
-    accelerations, angular_velocities = align_from_g_vector(accelerations, angular_velocities, g)
+    align_from_g_vector(accelerations, angular_velocities, g)
 
     # for the remaining stationary times
     for stationary_time in stationary_times[1:]:
@@ -345,12 +412,11 @@ def correct_z_orientation(accelerations, angular_velocities, stationary_times):
         g = accelerations[:, stationary_time[0]:stationary_time[1]].mean(axis=1)
         bad_align_angle = arccos(dot(g, (0, 0, 1)) / norm(g))
         # if the bad align angle is greater than 2 degrees
-        if bad_align_angle > np.deg2rad(10):
+        if bad_align_angle > z_realign_threshold:
             # print a warning
-            import warnings
             message = " \n Found additional bad z axis of {} degrees alignment at time {} , " \
                       "realigning from now  \n".format(np.rad2deg(bad_align_angle), stationary_time[0])
             warnings.warn(message)
-            # re-align
-            accelerations, angular_velocities = align_from_g_vector(accelerations, angular_velocities, g)
+            # re-align vectors from this stationary time on
+            align_from_g_vector(accelerations, angular_velocities, g, stationary_time[0])
     return accelerations, angular_velocities
@@ -29,6 +29,7 @@ if __name__ == '__main__':
     # fix import path
     sys.path[0] = os.path.dirname(os.path.dirname(__file__))
     from src import get_trajectory_from_path
+    from src.dataset_cache import DatasetCache, default_cache_directory
     import numpy as np
     # for benchmarking
     import time
@@ -38,14 +39,21 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Inertia[+GNSS] data to trajectory')
     parser.add_argument('input', type=str, help='Input file')
     parser.add_argument('output', type=str, help='Output file')
+    parser.add_argument('--cache-dir', type=str, default=default_cache_directory,
+                        help='Directory of parsed input files cache')
+    parser.add_argument('--no-cache', action='store_true', help='Always parse input file')
+    parser.add_argument('--fused-preprocessing', action='store_true',
+                        help='Clean inertial data in fewer passes, equal up to rounding errors')
     args = parser.parse_args()
 
     # get absolute path of input file
     my_path = os.path.abspath(os.path.dirname(__file__))
     path = os.path.join(my_path, args.input)
 
+    cache = None if args.no_cache else DatasetCache(args.cache_dir)
+
     #integrate positions
-    positions, times, angular_positions = get_trajectory_from_path(path)
+    positions, times, angular_positions = get_trajectory_from_path(path, cache, args.fused_preprocessing)
     #reshape times to merge it with position
     times = np.reshape(times, (1, len(times)))
     # merge times and positions in one array
@@ -0,0 +1,179 @@
+"""
+On disk cache of parsed input files.
+
+Parsed vectors are saved as .npy files so following loads of the same input are a memory map
+instead of a full text parse.
+
+This file is part of inertial_to_blender project,
+a Blender simulation generator from inertial sensor data on cars.
+
+Copyright (C) 2018  Federico Bertani
+Author: Federico Bertani
+Credits: Federico Bertani, Stefano Sinigardi, Alessandro Fabbri, Nico Curti
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import hashlib
+import os
+import shutil
+
+import numpy as np
+
+default_cache_directory = os.path.join(os.path.expanduser("~"), ".cache", "inertial_to_blender")
+# 2 GB
+default_max_size = 2 * 1024 ** 3
+# bytes read at once when hashing input files
+hash_block_size = 1024 ** 2
+
+
+class DatasetCache:
+    """
+    Content addressed cache of vectors returned by input_manager.get_vectors
+
+    Each entry is a directory named after input file hash, modification time, input type and parse options
+    containing a .npy file for each vector.
+    When the cache grows over max_size the least recently used entries are removed.
+    """
+
+    def __init__(self, directory=default_cache_directory, max_size=default_max_size):
+        """
+        :param directory: string cache directory, created if it doesn't exist
+        :param max_size: int maximum cache size in bytes
+        """
+        self.directory = directory
+        self.max_size = max_size
+        # file digests already computed, keyed by path, modification time and size
+        self.digests = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def get_file_digest(self, filepath):
+        """
+        Get hash of file content
+
+        :param filepath: string
+        :return: string hex digest
+        """
+        stat = os.stat(filepath)
+        digest_key = (os.path.abspath(filepath), stat.st_mtime_ns, stat.st_size)
+        if digest_key not in self.digests:
+            file_hash = hashlib.sha1()
+            with open(filepath, mode='rb') as file:
+                for block in iter(lambda: file.read(hash_block_size), b''):
+                    file_hash.update(block)
+            self.digests[digest_key] = file_hash.hexdigest()
+        return self.digests[digest_key]
+
+    def get_key(self, filepath, input_type, **options):
+        """
+        Get cache key of a parsed input file
+
+        Options are sorted by name, so the key doesn't depend on the order they are passed in.
+
+        :param filepath: string
+        :param input_type: InputType enum
+        :param options: additional keyword parse options that change parse result
+        :return: string
+        """
+        stat = os.stat(filepath)
+        key = "{}-{}-{}".format(self.get_file_digest(filepath), stat.st_mtime_ns, input_type.name)
+        if len(options) > 0:
+            options_hash = hashlib.sha1(repr(sorted(options.items())).encode()).hexdigest()
+            key = "{}-{}".format(key, options_hash[:16])
+        return key
+
+    def load(self, filepath, input_type, **options):
+        """
+        Load vectors from cache as copy-on-write memory maps
+
+        In-place operations on returned vectors don't modify the cache.
+
+        :param filepath: string
+        :param input_type: InputType enum
+        :param options: additional keyword parse options that change parse result, see get_key()
+        :return: tuple of numpy arrays or None if not in cache
+        """
+        entry_path = os.path.join(self.directory, self.get_key(filepath, input_type, **options))
+        if not os.path.isdir(entry_path):
+            return None
+        # mark entry as recently used
+        os.utime(entry_path)
+        vector_count = len(os.listdir(entry_path))
+        vectors = []
+        for i in range(vector_count):
+            vector_path = os.path.join(entry_path, "{}.npy".format(i))
+            try:
+                vectors.append(np.load(vector_path, mmap_mode='c'))
+            except ValueError:
+                # empty arrays can't be memory mapped
+                vectors.append(np.load(vector_path))
+        return tuple(vectors)
+
+    def store(self, filepath, input_type, vectors, **options):
+        """
+        Save vectors to cache and evict old entries if necessary
+
+        :param filepath: string
+        :param input_type: InputType enum
+        :param vectors: tuple of numpy arrays
+        :param options: additional keyword parse options that change parse result, see get_key()
+        """
+        entry_path = os.path.join(self.directory, self.get_key(filepath, input_type, **options))
+        # write in a temporary directory so a partial entry is never loaded
+        temp_path = "{}.tmp{}".format(entry_path, os.getpid())
+        os.makedirs(temp_path, exist_ok=True)
+        for i, vector in enumerate(vectors):
+            np.save(os.path.join(temp_path, "{}.npy".format(i)), vector)
+        try:
+            os.rename(temp_path, entry_path)
+        except OSError:
+            # entry already stored by another process
+            shutil.rmtree(temp_path, ignore_errors=True)
+        self.evict()
+
+    def get_entries(self):
+        """
+        Get cache entries from least to most recently used
+
+        :return: list of 2-tuples: entry path, entry size in bytes
+        """
+        entries = []
+        for entry_name in os.listdir(self.directory):
+            entry_path = os.path.join(self.directory, entry_name)
+            if not os.path.isdir(entry_path) or ".tmp" in entry_name:
+                continue
+            size = sum(os.path.getsize(os.path.join(entry_path, file_name)) for file_name in os.listdir(entry_path))
+            entries.append((os.path.getmtime(entry_path), entry_path, size))
+        entries.sort()
+        return [(entry_path, size) for _, entry_path, size in entries]
+
+    def evict(self):
+        """
+        Remove least recently used entries until cache size is below max_size
+        """
+        entries = self.get_entries()
+        cache_size = sum(size for _, size in entries)
+        for entry_path, size in entries:
+            if cache_size <= self.max_size:
+                break
+            shutil.rmtree(entry_path, ignore_errors=True)
+            cache_size -= size
+
+    def clear(self):
+        """
+        Remove all entries
+        """
+        for entry_path, _ in self.get_entries():
+            shutil.rmtree(entry_path, ignore_errors=True)
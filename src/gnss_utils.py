@@ -23,51 +23,245 @@ Credits: Federico Bertani, Stefano Sinigardi, Alessandro Fabbri, Nico Curti
 
 """
 
-from math import cos
-from scipy import arctan2
-
 import numpy as np
 
+from src.backends import get_backend, compile_kernel
+
+# mean earth radius in meters
+earth_radius = 6371000
+# WGS84 ellipsoid semi-major axis in meters and first eccentricity squared
+wgs84_semi_major_axis = 6378137.0
+wgs84_flattening = 1 / 298.257223563
+wgs84_eccentricity_squared = wgs84_flattening * (2 - wgs84_flattening)
+
+
+def get_equirectangular_deltas(latitudes, longitudes):
+    """
+    Get east and north displacements between consecutive records approximating earth locally as a plane
+
+    :param latitudes: 1xn numpy array of latitudes in radians
+    :param longitudes: 1xn numpy array of longitudes in radians
+    :return: 2 numpy arrays: 1x(n-1) east displacements, 1x(n-1) north displacements
+    """
+    # use relationship between central angle and arc to calculate delta lat
+    delta_north = earth_radius * np.diff(latitudes)
+    # use same formula but with earth horizontal radius moved to latitude
+    delta_east = earth_radius * np.cos(latitudes[1:]) * np.diff(longitudes)
+    return delta_east, delta_north
+
+
+def equirectangular_positions_kernel(latitudes, longitudes, altitudes, positions, delta_east, delta_north):
+    """
+    Get equirectangular displacements and sum them in a single pass
+
+    :param latitudes: 1xn numpy array of latitudes in radians
+    :param longitudes: 1xn numpy array of longitudes in radians
+    :param altitudes: 1xn numpy array of altitudes
+    :param positions: 3xn numpy array with first column set to zero where positions are written
+    :param delta_east: 1x(n-1) numpy array where east displacements are written
+    :param delta_north: 1x(n-1) numpy array where north displacements are written
+    """
+    for i in range(1, latitudes.shape[0]):
+        delta_north[i - 1] = earth_radius * (latitudes[i] - latitudes[i - 1])
+        delta_east[i - 1] = earth_radius * np.cos(latitudes[i]) * (longitudes[i] - longitudes[i - 1])
+        positions[0, i] = positions[0, i - 1] + delta_east[i - 1]
+        positions[1, i] = positions[1, i - 1] + delta_north[i - 1]
+        positions[2, i] = positions[2, i - 1] + (altitudes[i] - altitudes[i - 1])
+
+
+compiled_equirectangular_positions_kernel = compile_kernel(equirectangular_positions_kernel)
+
+
+def get_haversine_deltas(latitudes, longitudes):
+    """
+    Get east and north displacements between consecutive records along great circles
+
+    Distance is calculated with haversine formula and split along initial bearing.
+
+    :param latitudes: 1xn numpy array of latitudes in radians
+    :param longitudes: 1xn numpy array of longitudes in radians
+    :return: 2 numpy arrays: 1x(n-1) east displacements, 1x(n-1) north displacements
+    """
+    previous_latitudes = latitudes[:-1]
+    next_latitudes = latitudes[1:]
+    delta_latitudes = np.diff(latitudes)
+    delta_longitudes = np.diff(longitudes)
+    haversine = np.sin(delta_latitudes / 2) ** 2 + \
+        np.cos(previous_latitudes) * np.cos(next_latitudes) * np.sin(delta_longitudes / 2) ** 2
+    distances = 2 * earth_radius * np.arcsin(np.sqrt(np.clip(haversine, 0, 1)))
+    # bearing clockwise from north
+    bearings = np.arctan2(np.sin(delta_longitudes) * np.cos(next_latitudes),
+                          np.cos(previous_latitudes) * np.sin(next_latitudes) -
+                          np.sin(previous_latitudes) * np.cos(next_latitudes) * np.cos(delta_longitudes))
+    return distances * np.sin(bearings), distances * np.cos(bearings)
+
 
-def get_positions(coordinates, altitudes):
+def get_enu_positions(latitudes, longitudes, altitudes):
+    """
+    Get east, north, up positions relative to the first record from WGS84 earth-centered earth-fixed positions
+
+    :param latitudes: 1xn numpy array of latitudes in radians
+    :param longitudes: 1xn numpy array of longitudes in radians
+    :param altitudes: 1xn numpy array of altitudes over the ellipsoid in meters
+    :return: 3xn numpy array of east, north, up positions
+    """
+    sin_latitudes = np.sin(latitudes)
+    cos_latitudes = np.cos(latitudes)
+    # prime vertical radius of curvature
+    normal_radii = wgs84_semi_major_axis / np.sqrt(1 - wgs84_eccentricity_squared * sin_latitudes ** 2)
+    ecef_positions = np.array([
+        (normal_radii + altitudes) * cos_latitudes * np.cos(longitudes),
+        (normal_radii + altitudes) * cos_latitudes * np.sin(longitudes),
+        (normal_radii * (1 - wgs84_eccentricity_squared) + altitudes) * sin_latitudes])
+    ecef_positions -= ecef_positions[:, :1]
+    # rotate to the local tangent plane of the first record
+    sin_lat, cos_lat = sin_latitudes[0], cos_latitudes[0]
+    sin_lon, cos_lon = np.sin(longitudes[0]), np.cos(longitudes[0])
+    ecef_to_enu = np.array([
+        [-sin_lon, cos_lon, 0],
+        [-sin_lat * cos_lon, -sin_lat * sin_lon, cos_lat],
+        [cos_lat * cos_lon, cos_lat * sin_lon, sin_lat]])
+    return ecef_to_enu @ ecef_positions
+
+
+def get_positions(coordinates, altitudes, model='equirectangular', backend=None):
     """
     Convert gss data from geographic coordinate system to cartesian
 
+    Available models are:
+    'equirectangular' earth approximated locally as a plane between consecutive records,
+    'haversine' displacements along great circles between consecutive records,
+    'enu' east, north, up coordinates on WGS84 ellipsoid tangent plane at the first record.
+
     :param coordinates: 2xn numpy array of coordinates (lat,lon)
     :param altitudes: 1xn numpy array of altitudes
+    :param model: string projection model
+    :param backend: 'numba', 'numpy' or None to use the selected one, see backends module.
+        Only the equirectangular model has a compiled kernel.
     :return: 2 numpy array: 3xn numpy array of position in cartesian system 1xn heading as array of angles
+    :raises:
+        Exception if model or backend is unknown
     """
-    earth_radius = 6371000
-    # create empty array for final positions
+    latitudes = coordinates[0]
+    longitudes = coordinates[1]
     positions = np.zeros((3, coordinates.shape[1]))
+    if model == 'equirectangular' and get_backend(backend) == 'numba':
+        delta_east = np.empty(max(coordinates.shape[1] - 1, 0))
+        delta_north = np.empty(delta_east.shape)
+        compiled_equirectangular_positions_kernel(np.asarray(latitudes, dtype=np.float64),
+                                                  np.asarray(longitudes, dtype=np.float64),
+                                                  np.asarray(altitudes, dtype=np.float64), positions,
+                                                  delta_east, delta_north)
+    elif model == 'enu':
+        positions[:] = get_enu_positions(latitudes, longitudes, altitudes)
+        delta_east = np.diff(positions[0])
+        delta_north = np.diff(positions[1])
+    elif model in ('equirectangular', 'haversine'):
+        if model == 'equirectangular':
+            delta_east, delta_north = get_equirectangular_deltas(latitudes, longitudes)
+        else:
+            delta_east, delta_north = get_haversine_deltas(latitudes, longitudes)
+        # first position is zero, following are the sum of previous displacements
+        np.cumsum(delta_east, out=positions[0, 1:])
+        np.cumsum(delta_north, out=positions[1, 1:])
+        np.cumsum(np.diff(altitudes), out=positions[2, 1:])
+    else:
+        raise Exception("Unknown positions model {}".format(model))
+    # heading of displacement from previous record, first one is zero
     headings = np.zeros(coordinates.shape[1])
-    # current position
-    current = np.array([coordinates[0, 0], coordinates[1, 0], altitudes[0]])
-    # iterate skipping first position that is zero
-    for i, gnss_data in enumerate(zip(coordinates[:, 1:].T, altitudes[1:]), start=1):
-        # get data from zipped tuple
-        lat = gnss_data[0][0]
-        lon = gnss_data[0][1]
-        alt = gnss_data[1]
-        # current is the previous record
-        # use relationship between central angle and arc to calculate delta lat
-        delta_lat = earth_radius * (lat - current[0])
-        # use same formula but with earth horizontal radius moved to latitude
-        delta_lon = earth_radius * cos(lat) * (lon - current[1])
-        delta_alt = alt - current[2]
-        headings[i] = arctan2(delta_lat, delta_lon)
-        # update current
-        current[0] = lat
-        current[1] = lon
-        current[2] = alt
-        # set position at step i
-        positions[0, i] = positions[0, i - 1] + delta_lon
-        positions[1, i] = positions[1, i - 1] + delta_lat
-        positions[2, i] = positions[2, i - 1] + delta_alt
+    headings[1:] = np.arctan2(delta_north, delta_east)
     return positions, headings
 
 
-def get_velocities(times, positions, win_size=1):
+def forward_differences_kernel(times, vectors, win_size, derivatives):
+    """
+    Write in derivatives forward differences of records win_size apart, repeated for the records in between
+
+    :param times: 1xn numpy array of timestamp
+    :param vectors: mxn numpy array
+    :param win_size: int window size in records
+    :param derivatives: mxn numpy array initialized to zero
+    """
+    for step in range((vectors.shape[1] - 1) // win_size):
+        start = step * win_size
+        end = start + win_size
+        dt = times[end] - times[start]
+        for row in range(vectors.shape[0]):
+            rate = (vectors[row, end] - vectors[row, start]) / dt
+            for i in range(start, end):
+                derivatives[row, i] = rate
+
+
+compiled_forward_differences_kernel = compile_kernel(forward_differences_kernel)
+
+
+def differentiate(times, vectors, win_size=1, method='forward', polyorder=2, backend=None):
+    """
+    Numerical derivative of vectors with respect to times
+
+    Available methods are:
+    'forward' derivative from records win_size apart, repeated for the win_size records in between,
+    records after the last complete step are left to zero,
+    'central' derivative from records win_size before and after, window is clipped at data ends,
+    'savgol' derivative of Savitzky-Golay polynomial fit over win_size records, which must be odd and greater
+    than polyorder. Assumes uniform sampling.
+
+    :param times: 1xn numpy array of timestamp
+    :param vectors: mxn numpy array
+    :param win_size: int window size in records
+    :param method: string differentiation method
+    :param polyorder: int order of Savitzky-Golay polynomials
+    :param backend: 'numba', 'numpy' or None to use the selected one, see backends module.
+        Only the forward method has a compiled kernel.
+    :return: mxn numpy array of derivatives
+    :raises:
+        Exception if method or backend is unknown or win_size isn't valid for savgol method
+    """
+    length = vectors.shape[1]
+    if method == 'forward' and get_backend(backend) == 'numba':
+        derivatives = np.zeros(vectors.shape)
+        compiled_forward_differences_kernel(np.asarray(times, dtype=np.float64), np.asarray(vectors, dtype=np.float64),
+                                            win_size, derivatives)
+    elif method == 'forward':
+        derivatives = np.zeros(vectors.shape)
+        ends = np.arange(win_size, length, win_size)
+        rates = (vectors[:, ends] - vectors[:, ends - win_size]) / (times[ends] - times[ends - win_size])
+        derivatives[:, :ends.shape[0] * win_size] = np.repeat(rates, win_size, axis=1)
+    elif method == 'central':
+        indices = np.arange(length)
+        lows = np.maximum(indices - win_size, 0)
+        highs = np.minimum(indices + win_size, length - 1)
+        derivatives = (vectors[:, highs] - vectors[:, lows]) / (times[highs] - times[lows])
+    elif method == 'savgol':
+        if win_size % 2 == 0 or win_size <= polyorder:
+            raise Exception("Savitzky-Golay window size {} must be odd and greater than polyorder {}".format(
+                win_size, polyorder))
+        if win_size > length:
+            raise Exception("Savitzky-Golay window size {} must not exceed records {}".format(win_size, length))
+        from scipy.signal import savgol_filter
+        time_step = (times[-1] - times[0]) / (length - 1)
+        derivatives = savgol_filter(vectors, win_size, polyorder, deriv=1, delta=time_step, axis=1)
+    else:
+        raise Exception("Unknown differentiation method {}".format(method))
+    return derivatives
+
+
+def get_velocities_from_rates(coordinates, coordinate_rates):
+    """
+    Get velocities in cartesian system from time derivatives of coordinates
+
+    Derivative of get_positions() equirectangular model, so no numerical differentiation is needed
+    when coordinates come from an interpolating spline.
+
+    :param coordinates: 2xn numpy array of coordinates (lat,lon) in radians
+    :param coordinate_rates: 2xn numpy array of coordinates time derivatives in radians/s
+    :return: 2xn velocities numpy array
+    """
+    return np.vstack((earth_radius * np.cos(coordinates[0]) * coordinate_rates[1],
+                      earth_radius * coordinate_rates[0]))
+
+
+def get_velocities(times, positions, win_size=1, method='forward', polyorder=2, backend=None):
     """
     Get array of speeds from position in cartesian system
 
@@ -75,70 +269,84 @@ def get_velocities(times, positions, win_size=1):
 
     :param times: 1xn numpy array of timestamp
     :param positions: 3xn numpy array of position in cartesian system
-    :param win_size: int how often calculate velocity
+    :param win_size: int how often calculate velocity, window size for other methods
+    :param method: string differentiation method, see differentiate()
+    :param polyorder: int order of Savitzky-Golay polynomials, see differentiate()
+    :param backend: 'numba', 'numpy' or None to use the selected one, see backends module
     :return: 2xn velocities numpy array
     """
-    # TODO this is very basic numerical differentiation, can be improved
     # remove altitude because it's unreliable
-    positions = np.delete(positions, 2, axis=0)
-    # create array
-    velocities = np.zeros((2, positions.shape[1]))
-    # iterate starting from win size until end of array, with win_size step
-    for i in range(win_size, positions.shape[1], win_size):
-        delta_x = positions[0, i] - positions[0, i - win_size]
-        delta_y = positions[1, i] - positions[1, i - win_size]
-        delta_t = times[i] - times[i - win_size]
-        velocities[0, i - win_size:i] = delta_x / delta_t
-        velocities[1, i - win_size:i] = delta_y / delta_t
-    return velocities
+    return differentiate(times, positions[:2], win_size, method, polyorder, backend)
 
 
-def get_accelerations(times, velocities, win_size=1):
+def get_accelerations(times, velocities, win_size=1, method='forward', polyorder=2, backend=None):
     """
     Get array of acceleration from velocities in cartesian system
 
     :param times: 1xn numpy array of timestamp
     :param velocities: 2xn numpy array of velocities in 2d cartesian system
-    :param win_size: int how often calculate acceleration
+    :param win_size: int how often calculate acceleration, window size for other methods
+    :param method: string differentiation method, see differentiate()
+    :param polyorder: int order of Savitzky-Golay polynomials, see differentiate()
+    :param backend: 'numba', 'numpy' or None to use the selected one, see backends module
     :return: 2xn numpy array of accelerations
     """
-
-    accelerations = np.zeros((2, velocities.shape[1]))
-    for i in range(win_size, velocities.shape[1], win_size):
-        delta_x = velocities[0, i] - velocities[0, i - win_size]
-        delta_y = velocities[1, i] - velocities[1, i - win_size]
-        delta_t = times[i] - times[i - win_size]
-        accelerations[0, i - win_size:i] = delta_x / delta_t
-        accelerations[1, i - win_size:i] = delta_y / delta_t
-    return accelerations
+    return differentiate(times, velocities[:2], win_size, method, polyorder, backend)
 
 
-def get_first_motion_time(stationary_times,positions):
+def first_motion_time_kernel(stationary_times, positions, min_distance):
     """
-    Get first motion time enough distant from start position
+    Walk records skipping stationary times until one is distant enough from start position
 
-    :param stationary_times: list of 2-tuples
-    :return: 2 int: start and end of first motion
+    :param stationary_times: kx2 numpy array of int start and end of stationary times
+    :param positions: 3xn numpy array of position in cartesian system
+    :param min_distance: float minimum distance in xy plane
+    :return: int index of first motion record, n if there isn't one
     """
-
-    # not in stationary time
-    # distance must be at least 10 meters
-    # iterate until a motion time (not stationary) is found
     stationary_time_index = 0
     i = 0
-    # find the first 100 records in motion times
     position_len = positions.shape[1]
     while i < position_len:
-        if i==stationary_times[stationary_time_index][0]:
+        if stationary_times.shape[0] > 0 and i == stationary_times[stationary_time_index, 0]:
             # jump to next motion time
-            i = stationary_times[stationary_time_index][1]
-            if (stationary_time_index<len(stationary_times)-1):
+            i = stationary_times[stationary_time_index, 1]
+            if stationary_time_index < stationary_times.shape[0] - 1:
                 stationary_time_index += 1
-        if np.linalg.norm(positions[:-1, i]) > 10:
+            if i >= position_len:
+                return position_len
+        if np.sqrt(positions[0, i] ** 2 + positions[1, i] ** 2) > min_distance:
             break
         i += 1
-    motion_time = i
-    return motion_time
+    return i
+
+
+compiled_first_motion_time_kernel = compile_kernel(first_motion_time_kernel)
+
+
+def get_first_motion_time(stationary_times, positions, backend=None):
+    """
+    Get first motion time enough distant from start position
+
+    Records are visited in order, from the start of a stationary time it jumps to its end.
+
+    :param stationary_times: list of 2-tuples sorted by time and not overlapping
+    :param positions: 3xn numpy array of position in cartesian system
+    :param backend: 'numba', 'numpy' or None to use the selected one, see backends module
+    :return: int index of first record out of stationary times (or at their end)
+        with distance in xy plane from start greater than 10 meters, n if there isn't one
+    """
+    # distance must be at least 10 meters
+    min_distance = 10
+    position_len = positions.shape[1]
+    if get_backend(backend) == 'numba':
+        return int(compiled_first_motion_time_kernel(np.array(stationary_times, dtype=np.int64).reshape(-1, 2),
+                                                     np.asarray(positions, dtype=np.float64), min_distance))
+    # not in stationary time, the end of a stationary time is checked
+    candidates = np.linalg.norm(positions[:-1], axis=0) > min_distance
+    for start, end in stationary_times:
+        candidates[start:end] = False
+    motion_times = np.flatnonzero(candidates)
+    return int(motion_times[0]) if motion_times.shape[0] > 0 else position_len
 
 
 def get_initial_angular_position(gnss_position, motion_time):
@@ -23,12 +23,20 @@ Credits: Federico Bertani, Stefano Sinigardi, Alessandro Fabbri, Nico Curti
 
 """
 
+import bz2
+import gzip
+import io
+import lzma
+import os
 from enum import Enum, unique
+from functools import partial
 from io import StringIO
 
 import numpy as np
 import pandas as pd
 
+from src.sensor_recording import SensorRecording, channel_columns, inertial_channels, recording_layout_version
+
 
 @unique
 class InputType(Enum):
@@ -42,13 +50,51 @@ class InputType(Enum):
     UNRECOGNIZED = 8
 
 
-def detect_input_type(df, filepath):
+# default number of rows parsed at once by streaming parser
+default_chunk_size = 100000
+# smaller chunks stop parsing sooner after the end of a time slice
+time_slicing_chunk_size = 10000
+# number of rows read to detect input type from file content
+default_sniff_rows = 500
+# bytes under which timestamp bisection stops
+seek_resolution = 64 * 1024
+
+# magic bytes at the beginning of compressed files and functions to open them
+compression_formats = {
+    b'\x1f\x8b': gzip.open,
+    b'\xfd7zXZ\x00': lzma.open,
+    # legacy .lzma files have no magic, their header starts with default properties and a dictionary size
+    # multiple of 64 KiB
+    b']\x00\x00': partial(lzma.open, format=lzma.FORMAT_ALONE),
+    b'BZh': bz2.open,
+}
+compression_suffixes = ('.gz', '.xz', '.lzma', '.bz2')
+
+# columns used by get_vectors for each input type, other columns are not parsed
+inertial_columns = ['timestamp', 'speed', 'ax', 'ay', 'az', 'gx', 'gy', 'gz']
+fullinertial_columns = ['timestamp', 'lat', 'lon', 'alt', 'speed', 'heading', 'ax', 'ay', 'az', 'gx', 'gy', 'gz']
+input_schemas = {
+    InputType.INERTIAL: inertial_columns,
+    InputType.UNMOD_INERTIAL: inertial_columns,
+    InputType.FULLINERTIAL: fullinertial_columns,
+    InputType.UNMOD_FULLINERTIAL: fullinertial_columns,
+}
+# accelerometer and gyroscope channels, can be parsed in single precision
+sensor_columns = ['ax', 'ay', 'az', 'gx', 'gy', 'gz']
+
+
+def detect_input_type_from_name(filepath):
     """
+    Detect input type from hints in file name
 
-    :param df:
-    :param filepath:
-    :return:
+    Compression suffix is ignored.
+
+    :param filepath: string
+    :return: InputType enum, UNRECOGNIZED if file name has no hint
     """
+    root, extension = os.path.splitext(filepath)
+    if extension in compression_suffixes:
+        filepath = root
     # default file type
     filetype = InputType.UNRECOGNIZED
     # analyze file name
@@ -66,8 +112,20 @@ def detect_input_type(df, filepath):
         filetype = InputType.FULLINERTIAL
     elif filepath.find("inertial") != -1:
         filetype = InputType.INERTIAL
+    return filetype
+
+
+def detect_input_type(df, filepath):
+    """
+    Detect input type from file name or, if it has no hint, from dataframe columns
+
+    :param df: pandas dataframe, can be only the first rows of input
+    :param filepath: string
+    :return: InputType enum
+    """
+    filetype = detect_input_type_from_name(filepath)
     # if no match are found try with column count
-    else:
+    if filetype == InputType.UNRECOGNIZED:
         column_count = df.shape[1]
         if column_count == 4:
             # TODO acc or gyr
@@ -85,12 +143,97 @@ def detect_input_type(df, filepath):
     return filetype
 
 
-def get_vectors(df, input_type):
+def sniff_input_type(filepath, sample_rows=default_sniff_rows):
+    """
+    Detect input type reading only header and first rows of input file
+
+    Unmodified inputs have gnss and inertial records mixed every few rows,
+    so missing values are expected to be found in the first rows.
+
+    :param filepath: string
+    :param sample_rows: int number of data rows read when file name has no hint
+    :return: InputType enum
+    """
+    filetype = detect_input_type_from_name(filepath)
+    if filetype == InputType.UNRECOGNIZED:
+        file, columns = open_input(filepath)
+        with file:
+            sample_df = pd.read_csv(file, sep='\t', index_col=False, header=None, names=columns, nrows=sample_rows)
+        filetype = detect_input_type(sample_df, filepath)
+    return filetype
+
+
+def get_schema(input_type, single_precision=False):
+    """
+    Get columns to parse and their types for an input type
+
+    Timestamps and gnss data are always double precision because single precision isn't enough for them.
+
+    :param input_type: InputType enum
+    :param single_precision: bool if True sensor channels are parsed as float32
+    :return: 2-tuple: list of columns or None to parse all columns, dict of column types
+    """
+    columns = input_schemas.get(input_type)
+    if columns is None:
+        return None, None
+    dtypes = {column: np.float64 for column in columns}
+    if single_precision:
+        dtypes.update({column: np.float32 for column in sensor_columns})
+    return columns, dtypes
+
+
+def select_rows(df, rows, columns):
+    """
+    Copy selected rows of some dataframe columns into a kxn numpy array
+
+    :param df: pandas dataframe
+    :param rows: boolean numpy array
+    :param columns: list of k column names
+    :return: kxn numpy array
+    """
+    dtype = np.result_type(*[df[column].dtype for column in columns])
+    selected = np.empty((len(columns), np.count_nonzero(rows)), dtype=dtype)
+    for i, column in enumerate(columns):
+        np.compress(rows, df[column].values, out=selected[i])
+    return selected
+
+
+def resample_gnss(times, gnss_times, gnss_data, kind='quadratic', derivative_rows=None):
+    """
+    Interpolate gnss data on inertial timestamps
+
+    The interpolating spline is evaluated on the whole time vector at once.
+
+    :param times: 1xn numpy array of inertial timestamps
+    :param gnss_times: 1xm numpy array of gnss timestamps
+    :param gnss_data: kxm numpy array of gnss data
+    :param kind: string interpolation kind: 'linear', 'quadratic' or 'cubic'
+    :param derivative_rows: optional slice of gnss data rows whose time derivatives are also returned
+    :return: kxn numpy array of gnss data on inertial timestamps,
+        if derivative_rows is given also numpy array of derivatives of the interpolating spline of those rows
+    """
+    spline_degrees = {'linear': 1, 'quadratic': 2, 'cubic': 3}
+    if kind not in spline_degrees:
+        raise Exception("Interpolation kind must be linear, quadratic or cubic")
+    from scipy.interpolate import make_interp_spline, BSpline
+    # spline is extrapolated outside gnss times
+    spline = make_interp_spline(gnss_times, gnss_data, k=spline_degrees[kind], axis=1)
+    if derivative_rows is None:
+        return spline(times)
+    # reuse coefficients of derivative rows, spline stores them with gnss times on first axis
+    rows_spline = BSpline(spline.t, np.moveaxis(spline.c[:, derivative_rows], 0, 1), spline.k,
+                          extrapolate=spline.extrapolate, axis=1)
+    return spline(times), rows_spline.derivative()(times)
+
+
+def get_vectors(df, input_type, interpolation_kind='quadratic'):
     """
     Get various numpy vectors based from dataframe columns based on input type
 
     :param df: pandas dataframe
     :param input_type: InputType enum
+    :param interpolation_kind: string kind of gnss interpolation for unmodified fullinertial input,
+        see resample_gnss()
     :return:
         times, gps_speed, accelerations, angular_velocities if input is inertial \n
         times, coordinates, altitudes, gps_speed, heading, accelerations, angular_velocities if input is fullinertial
@@ -113,40 +256,310 @@ def get_vectors(df, input_type):
     elif input_type == InputType.UNMOD_FULLINERTIAL:
         # TODO use DataFrame.interpolate
         # the input has gnss and inertial records mixed
-        # filter gnss records
-        clean_gnss_data = df.dropna(subset=['lat'])
-        # interpolate coordinates
-        from scipy.interpolate import interp1d
-        gnss_data = clean_gnss_data[['lat', 'lon', 'alt', 'heading', 'speed']].values
-        gnss_data_timestamp = clean_gnss_data['timestamp'].values
-        coord_func = interp1d(x=gnss_data_timestamp, y=gnss_data.T,kind='quadratic',
-                              fill_value='extrapolate', assume_sorted=True)
-        # filter inertial records from dataframe
-        df = df.dropna(subset=['ax'])
-        accelerations = df[['ax', 'ay', 'az']].values.T
-        angular_velocities = df[['gx', 'gy', 'gz']].values.T
-        times = df['timestamp'].values.T
+        # split gnss and inertial records with a single mask
+        gnss_rows = df['lat'].notna().values
+        inertial_rows = ~gnss_rows
+        # select rows and columns with a single copy
+        gnss_data = select_rows(df, gnss_rows, ['lat', 'lon', 'alt', 'heading', 'speed'])
+        gnss_data_timestamp = df['timestamp'].values[gnss_rows]
+        times = df['timestamp'].values[inertial_rows]
+        accelerations = select_rows(df, inertial_rows, ['ax', 'ay', 'az'])
+        angular_velocities = select_rows(df, inertial_rows, ['gx', 'gy', 'gz'])
         # create coordinates vectors on inertial timestamp
-        coordinatesX,coordinatesY,altitudes,heading,gps_speed = zip(*[coord_func(time) for time in times])
-        coordinates = np.array([x for x in zip(coordinatesX,coordinatesY)]).T
-        altitudes = np.array(altitudes).T
-        heading = np.array(heading).T
-        gps_speed = np.array(gps_speed).T
+        gnss_data = resample_gnss(times, gnss_data_timestamp, gnss_data, interpolation_kind)
+        coordinates = gnss_data[0:2]
+        altitudes = gnss_data[2]
         # correct heading
-        heading = 270 - heading
+        heading = 270 - gnss_data[3]
+        gps_speed = gnss_data[4]
         return times, coordinates, altitudes, gps_speed, heading, accelerations, angular_velocities
 
 
-def parse_input(filepath, accepted_types=[input_type for input_type in InputType], slice_start=None, slice_end=None):
+def get_recording(df, input_type, interpolation_kind='quadratic'):
+    """
+    Copy dataframe columns into a SensorRecording based on input type
+
+    :param df: pandas dataframe
+    :param input_type: InputType enum, inertial or fullinertial
+    :param interpolation_kind: string kind of gnss interpolation for unmodified fullinertial input,
+        see resample_gnss()
+    :return: SensorRecording
+    :raises:
+        Exception if input type has not inertial data
+    """
+    if input_type in (InputType.INERTIAL, InputType.UNMOD_INERTIAL, InputType.FULLINERTIAL):
+        recording = SensorRecording.empty(df.shape[0], has_gnss=input_type == InputType.FULLINERTIAL)
+        for row, column in enumerate(channel_columns[:recording.block.shape[0]]):
+            recording.block[row] = df[column].values
+        return recording
+    elif input_type == InputType.UNMOD_FULLINERTIAL:
+        # the input has gnss and inertial records mixed
+        gnss_rows = df['lat'].notna().values
+        inertial_rows = ~gnss_rows
+        recording = SensorRecording.empty(np.count_nonzero(inertial_rows), has_coordinate_rates=True)
+        # copy inertial records skipping speed row
+        for row, column in enumerate(channel_columns[:inertial_channels]):
+            if column != 'speed':
+                np.compress(inertial_rows, df[column].values, out=recording.block[row])
+        gnss_data = select_rows(df, gnss_rows, ['lat', 'lon', 'alt', 'heading', 'speed'])
+        gnss_data_timestamp = df['timestamp'].values[gnss_rows]
+        # create coordinates vectors on inertial timestamp, keep coordinates derivatives for gnss velocities
+        gnss_data, recording.coordinate_rates[:] = resample_gnss(recording.times, gnss_data_timestamp, gnss_data,
+                                                                 interpolation_kind, slice(0, 2))
+        recording.coordinates[:] = gnss_data[0:2]
+        recording.altitudes[:] = gnss_data[2]
+        # correct heading
+        np.subtract(270, gnss_data[3], out=recording.heading)
+        recording.gps_speed[:] = gnss_data[4]
+        return recording
+    else:
+        raise Exception("Input type has not inertial data")
+
+
+def detect_compression(filepath):
+    """ Detect file compression from its first bytes
+
+    :param filepath: string
+    :return: function to open the compressed file or None if file is not compressed
+    """
+    with open(filepath, mode='rb') as file:
+        magic = file.read(6)
+    for compression_magic, opener in compression_formats.items():
+        if magic.startswith(compression_magic):
+            return opener
+    return None
+
+
+def open_input(filepath):
+    """ Open input file and read its header
+
+    The header beginning hashtag and tab are removed without modifying input file.
+    File is opened in binary mode so it can be seeked, pandas decodes it while parsing.
+    Gzip, xz, lzma and bzip2 compressed files are detected from magic bytes and decompressed while reading.
+
+    :param filepath: string
+    :return: 2-tuple: binary file object positioned on the first data row, list of column names
+    """
+    opener = detect_compression(filepath)
+    # compressed files are decompressed on the fly while parsing
+    file = opener(filepath, mode='rb') if opener is not None else open(filepath, mode='rb')
+    # remove beginning hashtag and tab
+    header = file.readline().decode().lstrip("#\t")
+    # let pandas parse header so columns are named as in a full parse
+    columns = pd.read_csv(StringIO(header), sep='\t', index_col=False).columns.tolist()
+    return file, columns
+
+
+def seek_timestamp(file, columns, timestamp):
+    """ Move file position near the first row with a timestamp not lower than the given one
+
+    Rows are assumed sorted by timestamp. Bisection on byte offsets is used so only
+    a few rows are read. The file is left at the beginning of a row at or before the searched one.
+
+    :param file: binary file object positioned on the first data row
+    :param columns: list of column names
+    :param timestamp: float
+    """
+    timestamp_index = columns.index('timestamp')
+    first_row = file.tell()
+    low = first_row
+    file.seek(0, 2)
+    high = file.tell()
+    # stop when remaining bytes are few enough to be filtered while parsing
+    while high - low > seek_resolution:
+        middle = (low + high) // 2
+        file.seek(middle)
+        # skip partial row
+        file.readline()
+        try:
+            row_timestamp = float(file.readline().split(b'\t')[timestamp_index])
+        except (ValueError, IndexError):
+            # end of file or blank row
+            row_timestamp = np.inf
+        if row_timestamp < timestamp:
+            low = middle
+        else:
+            high = middle
+    file.seek(low)
+    if low != first_row:
+        # skip partial row, row after it is still before searched timestamp
+        file.readline()
+
+
+def iter_input_chunks(filepath, chunk_size=default_chunk_size, usecols=None):
+    """ Parse input file lazily, chunk_size rows at a time
+
+    Only a chunk of the file is kept in memory at once.
+
+    :param filepath: string
+    :param chunk_size: int number of rows of each chunk
+    :param usecols: optional list of columns to parse, default parse all columns
+    :return: generator of 2-tuple: list of column names,
+        (columns)x(rows) C-contiguous float64 numpy array with a row for each column
+    """
+    file, columns = open_input(filepath)
+    with file:
+        reader = pd.read_csv(file, sep='\t', index_col=False, header=None, names=columns, usecols=usecols,
+                             dtype=np.float64, chunksize=chunk_size)
+        for chunk in reader:
+            yield chunk.columns.tolist(), np.ascontiguousarray(chunk.values.T)
+
+
+def parse_header(columns, usecols=None, dtypes=None):
+    """ Get an empty dataframe with the columns and types of a full parse
+
+    :param columns: list of column names
+    :param usecols: optional list of columns to parse, default parse all columns
+    :param dtypes: optional dict of column types, default float64
+    :return: pandas dataframe without rows
+    """
+    return pd.read_csv(StringIO('\t'.join(columns)), sep='\t', index_col=False, usecols=usecols, dtype=dtypes)
+
+
+def read_input(filepath, usecols=None, dtypes=None, chunk_size=None, slice_start=None, slice_end=None,
+               time_start=None, time_end=None):
+    """ Parse input file into a dataframe tokenizing only requested rows
+
+    Row slicing is done by the parser skipping rows, time slicing by seeking
+    near the first requested timestamp and stopping after the last one.
+    Rows are assumed sorted by timestamp.
+
+    :param filepath: string
+    :param usecols: optional list of columns to parse, default parse all columns
+    :param dtypes: optional dict of column types, default float64
+    :param chunk_size: optional int. If given the file is parsed in chunks of chunk_size rows.
+        It limits only parser buffers: chunks are kept until they are concatenated into the returned dataframe,
+        so peak memory is still about twice the parsed data. Use iter_input_chunks to keep one chunk at a time
+    :param slice_start: optional non negative int, index of first row
+    :param slice_end: optional non negative int, index after last row
+    :param time_start: optional float, minimum timestamp
+    :param time_end: optional float, maximum timestamp
+    :return: pandas dataframe
+    :raises:
+        Exception if slice end exceeds file rows or time start is after time end
+    """
+    if time_start is not None and time_end is not None and time_start > time_end:
+        raise Exception("Time start must not be after time end")
+    file, columns = open_input(filepath)
+    with file:
+        time_slicing = time_start is not None or time_end is not None
+        # row indexes are unknown after seeking so seek only without row slicing
+        # seeking compressed files would decompress them so seek only plain ones
+        if time_start is not None and slice_start is None and slice_end is None and \
+                isinstance(file, io.BufferedReader):
+            seek_timestamp(file, columns, time_start)
+        nrows = None
+        if slice_end is not None:
+            nrows = max(slice_end - (slice_start or 0), 0)
+        if nrows == 0:
+            reader = [parse_header(columns, usecols, dtypes)]
+        elif chunk_size is None and not time_slicing:
+            reader = [pd.read_csv(file, sep='\t', index_col=False, header=None, names=columns, usecols=usecols,
+                                  dtype=dtypes, skiprows=slice_start, nrows=nrows)]
+        else:
+            reader = pd.read_csv(file, sep='\t', index_col=False, header=None, names=columns, usecols=usecols,
+                                 dtype=dtypes, skiprows=slice_start, nrows=nrows,
+                                 chunksize=chunk_size or time_slicing_chunk_size)
+        chunks = []
+        # rows read by parser, also the ones outside time window
+        read_rows = 0
+        stopped_early = False
+        for chunk in reader:
+            read_rows += chunk.shape[0]
+            if time_slicing and chunk.shape[0] > 0:
+                timestamps = chunk['timestamp'].values
+                if time_end is not None and timestamps[0] > time_end:
+                    # all following rows are after time window
+                    stopped_early = True
+                    break
+                in_window = np.ones(timestamps.shape[0], dtype=bool)
+                if time_start is not None:
+                    in_window &= timestamps >= time_start
+                if time_end is not None:
+                    in_window &= timestamps <= time_end
+                chunk = chunk[in_window]
+            chunks.append(chunk)
+    # rows after time window are not read, so slice end can be checked only if parsing wasn't stopped
+    if nrows is not None and read_rows < nrows and not stopped_early:
+        raise Exception("Slice end must not exceed dataframe rows")
+    if len(chunks) == 0:
+        # no rows in time window
+        return parse_header(columns, usecols, dtypes)
+    if len(chunks) == 1:
+        return chunks[0]
+    return pd.concat(chunks, ignore_index=True)
+
+
+def detect_accepted_input_type(filepath, accepted_types):
+    """ Detect file type before committing to a full parse
+
+    :param filepath: string
+    :param accepted_types: list of accepted input types from <InputType> enum
+    :return: InputType enum
+    :raises:
+        Exception if format is not accepted or recognized
+    """
+    input_type = sniff_input_type(filepath)
+    if input_type == InputType.UNRECOGNIZED:
+        raise Exception("Unrecognized input format")
+    if input_type not in accepted_types:
+        raise Exception("Not accepted format")
+    return input_type
+
+
+def read_sliced_input(filepath, usecols=None, dtypes=None, chunk_size=None, slice_start=None, slice_end=None,
+                      time_start=None, time_end=None):
+    """ Parse input file into a dataframe with row and time slicing
+
+    Same as read_input but also accept a negative slice end.
+
+    :return: pandas dataframe
+    :raises:
+        Exception if slice start is negative, slice end exceeds file rows or time start is after time end
+    """
+    if slice_start is not None and slice_start < 0:
+        raise Exception("Slice start must be positive")
+    if time_start is not None and time_end is not None and time_start > time_end:
+        raise Exception("Time start must not be after time end")
+    if slice_end is not None and slice_end < 0:
+        # negative slice end needs rows count, slice after parsing
+        df = read_input(filepath, usecols, dtypes, chunk_size)
+        if abs(slice_end) > df.shape[0]:
+            raise Exception("Slice end must not exceed dataframe rows")
+        df = df[slice_start:slice_end]
+        if time_start is not None:
+            df = df[df['timestamp'].values >= time_start]
+        if time_end is not None:
+            df = df[df['timestamp'].values <= time_end]
+        return df
+    return read_input(filepath, usecols, dtypes, chunk_size, slice_start, slice_end, time_start, time_end)
+
+
+def parse_input(filepath, accepted_types=[input_type for input_type in InputType], slice_start=None, slice_end=None,
+                chunk_size=None, cache=None, interpolation_kind='quadratic', single_precision=False,
+                time_start=None, time_end=None):
     """ Parse input file from filetype
 
-    If the input is not one of the specified accepted format raise Expection
-    Additional slicing can be specified with sliceStar and sliceEnd
+    If the input is not one of the specified accepted format raise Expection.
+    Input type is detected from file name or from header and first rows, so rejected inputs are never fully parsed.
+    Additional slicing can be specified with sliceStar and sliceEnd on rows and with time_start and time_end
+    on timestamps. Slicing is done while parsing so rows outside the slice are not tokenized.
+    When both are given time slicing applies to the rows selected by row slicing.
 
     :param filepath: string
     :param accepted_types: list of accepted input types from <InputType> enum. Default accept all types.
     :param slice_start: integer
     :param slice_end: integer
+    :param chunk_size: optional integer. If given the file is parsed in chunks of chunk_size rows,
+        this limits parser buffers but not peak memory, see read_input()
+    :param cache: optional DatasetCache. If given parsed vectors are loaded from it when available
+        and stored in it otherwise
+    :param interpolation_kind: string kind of gnss interpolation for unmodified fullinertial input,
+        see resample_gnss()
+    :param single_precision: bool if True accelerations and angular velocities are float32,
+        timestamps and gnss data are always float64
+    :param time_start: optional float, minimum timestamp in input time unit
+    :param time_end: optional float, maximum timestamp in input time unit
     :return:
         times, gps_speed, accelerations, angular_velocities if input is inertial \n
         times, coordinates, gps_speed, heading, accelerations, angular_velocities if input is fullinertial
@@ -154,31 +567,60 @@ def parse_input(filepath, accepted_types=[input_type for input_type in InputType
         Exception if format is not accepted or recognized
     """
 
-    # open file
-    with open(filepath, mode='r') as file:
-        # read all content into string
-        file_content = file.read()
-    # remove beginning hashtag and tab
-    file_content = file_content.strip("#\t")
-    # i used this technique to not modify input file
-    # use StringIO to simulate file read
-    string_io = StringIO(file_content)
-    # use pandas to parse tsv
-    # set to not use first column as index
-    df = pd.read_csv(string_io, sep='\t',index_col=False)
-    # detect file type
-    input_type = detect_input_type(df, filepath)
-
-    if input_type != InputType.UNRECOGNIZED:
-        # slice input
-        if slice_start is not None and slice_start < 0:
-            raise Exception("Slice start must be positive")
-        if slice_end is not None and abs(slice_end) > df.shape[0]:
-            raise Exception("Slice end must not exceed dataframe rows")
-        df = df[slice_start:slice_end]
-        if input_type not in accepted_types:
-            raise Exception("Not accepted format")
-        # extrapolate vectors from input
-        return get_vectors(df, input_type)
-    else:
-        raise Exception("Unrecognized input format")
+    input_type = detect_accepted_input_type(filepath, accepted_types)
+    # options that change parse result
+    parse_options = dict(slice_start=slice_start, slice_end=slice_end, interpolation_kind=interpolation_kind,
+                         single_precision=single_precision, time_start=time_start, time_end=time_end)
+    if cache is not None:
+        vectors = cache.load(filepath, input_type, **parse_options)
+        if vectors is not None:
+            return vectors
+
+    # parse only used columns with explicit types
+    usecols, dtypes = get_schema(input_type, single_precision)
+    df = read_sliced_input(filepath, usecols, dtypes, chunk_size, slice_start, slice_end, time_start, time_end)
+    # extrapolate vectors from input
+    vectors = get_vectors(df, input_type, interpolation_kind)
+    if cache is not None:
+        cache.store(filepath, input_type, vectors, **parse_options)
+    return vectors
+
+
+def parse_recording(filepath, accepted_types=[InputType.INERTIAL, InputType.UNMOD_INERTIAL, InputType.FULLINERTIAL,
+                                              InputType.UNMOD_FULLINERTIAL],
+                    slice_start=None, slice_end=None, chunk_size=None, cache=None, interpolation_kind='quadratic',
+                    time_start=None, time_end=None):
+    """ Parse input file into a SensorRecording
+
+    Same as parse_input but all vectors are views of a single array.
+    Accepted types can only be inertial or fullinertial ones.
+
+    :param filepath: string
+    :param accepted_types: list of accepted input types from <InputType> enum. Default accept all inertial types.
+    :param slice_start: integer
+    :param slice_end: integer
+    :param chunk_size: optional integer, see parse_input()
+    :param cache: optional DatasetCache, see parse_input()
+    :param interpolation_kind: string kind of gnss interpolation for unmodified fullinertial input,
+        see resample_gnss()
+    :param time_start: optional float, minimum timestamp in input time unit
+    :param time_end: optional float, maximum timestamp in input time unit
+    :return: SensorRecording
+    :raises:
+        Exception if format is not accepted or recognized
+    """
+    input_type = detect_accepted_input_type(filepath, accepted_types)
+    # options that change parse result, different from parse_input ones to not mix cache entries
+    parse_options = dict(slice_start=slice_start, slice_end=slice_end, interpolation_kind=interpolation_kind,
+                         time_start=time_start, time_end=time_end, recording_layout_version=recording_layout_version)
+    if cache is not None:
+        vectors = cache.load(filepath, input_type, **parse_options)
+        if vectors is not None:
+            return SensorRecording(vectors[0])
+
+    usecols, dtypes = get_schema(input_type)
+    df = read_sliced_input(filepath, usecols, dtypes, chunk_size, slice_start, slice_end, time_start, time_end)
+    recording = get_recording(df, input_type, interpolation_kind)
+    if cache is not None:
+        cache.store(filepath, input_type, (recording.block,), **parse_options)
+    return recording
@@ -27,35 +27,151 @@ Credits: Federico Bertani, Stefano Sinigardi, Alessandro Fabbri, Nico Curti
 
 import numpy as np
 
-def quad_integrate(times, vector, initial=np.zeros(3)):
-    current = initial
-    result_vector = np.zeros((3, vector.shape[1]))
-    result_vector[:, 0] = initial
-    for i in range(vector.shape[1] - 1):
-        dt = times[i + 1] - times[i]
-        dv = vector[:, i + 1] * dt
-        current = current + dv
-        result_vector[:, i + 1] = current
-    return result_vector
+from src.backends import get_backend, compile_kernel
+
+
+def integrate_kernel(times, vector, trapezoidal, out):
+    """
+    Sum integration steps sequentially, out[:, 0] must already contain initial value
+
+    :param times: 1xn numpy array of timestamps
+    :param vector: mxn numpy array to integrate
+    :param trapezoidal: bool if True steps are trapezoids, else rectangles on the right value
+    :param out: mxn numpy array where integrated vector is written
+    """
+    for row in range(out.shape[0]):
+        current = out[row, 0]
+        for i in range(vector.shape[1] - 1):
+            dt = times[i + 1] - times[i]
+            if trapezoidal:
+                current = current + ((vector[row, i] + vector[row, i + 1]) * dt) / 2
+            else:
+                current = current + vector[row, i + 1] * dt
+            out[row, i + 1] = current
+
+
+compiled_integrate_kernel = compile_kernel(integrate_kernel)
 
 
-def trapz_integrate(times, vector, initial=np.zeros(3)):
-    current = initial
-    result_vector = np.zeros((3, vector.shape[1]))
+def integrate_steps(times, vector, initial, trapezoidal, backend):
+    """
+    Integrate summing rectangles or trapezoids from initial value
+
+    :param times: 1xn numpy array of timestamps
+    :param vector: mxn numpy array to integrate
+    :param initial: mx1 numpy array integration initial value
+    :param trapezoidal: bool if True steps are trapezoids, else rectangles on the right value
+    :param backend: 'numba', 'numpy' or None to use the selected one, see backends module
+    :return: mxn numpy array integrated vector
+    """
+    result_vector = np.empty(vector.shape)
     result_vector[:, 0] = initial
-    for i in range(vector.shape[1] - 1):
-        dt = times[i + 1] - times[i]
-        dv = ((vector[:, i] + vector[:, i + 1]) * dt) / 2
-        current = current + dv
-        result_vector[:, i + 1] = current
-    return result_vector
+    if get_backend(backend) == 'numba':
+        compiled_integrate_kernel(np.asarray(times, dtype=np.float64), np.asarray(vector, dtype=np.float64),
+                                  trapezoidal, result_vector)
+        return result_vector
+    dt = np.diff(times)
+    if trapezoidal:
+        result_vector[:, 1:] = ((vector[:, :-1] + vector[:, 1:]) * dt) / 2
+    else:
+        result_vector[:, 1:] = vector[:, 1:] * dt
+    # cumulative sum is sequential so it's equal to adding steps one at a time
+    return np.cumsum(result_vector, axis=1, out=result_vector)
+
+
+def quad_integrate(times, vector, initial=np.zeros(3), backend=None):
+    """
+    Rectangle rule integration
+
+    :param times: 1xn numpy array of timestamps
+    :param vector: 3xn numpy array to integrate
+    :param initial: 3x1 numpy array integration initial value
+    :param backend: 'numba', 'numpy' or None to use the selected one, see backends module
+    :return: 3xn numpy array integrated vector
+    """
+    return integrate_steps(times, vector, initial, False, backend)
+
+
+def trapz_integrate(times, vector, initial=np.zeros(3), backend=None):
+    """
+    Trapezoidal rule integration
+
+    :param times: 1xn numpy array of timestamps
+    :param vector: 3xn numpy array to integrate
+    :param initial: 3x1 numpy array integration initial value
+    :param backend: 'numba', 'numpy' or None to use the selected one, see backends module
+    :return: 3xn numpy array integrated vector
+    """
+    return integrate_steps(times, vector, initial, True, backend)
 
 def trapz_integrate_delta(times, vector):
     # multiplying by 0.5 faster than dividing by two
     return ((vector[:,:-1] + vector[:,1:]) * (times[1:]-times[:-1])) * 0.5
 
 
-def simps_integrate_delta(times, vectors):
+def batch_trapz_integrate_delta(times, vectors):
+    """
+    Trapezoidal integration of many trips at once, equal to trapz_integrate_delta for each trip
+
+    :param times: batchxn or 1xn (shared by all trips) numpy array of timestamps
+    :param vectors: batchx3xn numpy array to integrate
+    :return: batchx3x(n-1) numpy array of deltas, one for each interval between samples
+    """
+    times = get_batch_times(times, vectors)
+    return ((vectors[..., :-1] + vectors[..., 1:]) * np.diff(times)[:, np.newaxis, :]) * 0.5
+
+
+def get_batch_times(times, vectors):
+    """
+    Get timestamps of each trip
+
+    :param times: batchxn or 1xn (shared by all trips) numpy array of timestamps
+    :param vectors: batchxmxn numpy array
+    :return: batchxn numpy array of timestamps
+    :raises:
+        Exception if vectors are not a 3 dimensional array or times shape doesn't match
+    """
+    if vectors.ndim != 3:
+        raise Exception("Batch vectors must have shape (batch, rows, n), found {}".format(vectors.shape))
+    batch, _, columns = vectors.shape
+    times = np.asarray(times)
+    if times.shape not in ((columns,), (batch, columns)):
+        raise Exception("Times shape {} doesn't match vectors shape {}".format(times.shape, vectors.shape))
+    return np.broadcast_to(times, (batch, columns))
+
+
+def simps_kernel(times, vectors, deltas):
+    """
+    Write in deltas Simpson integral of each interval, same formulas of batch_simps_integrate_delta
+
+    :param times: batchxn numpy array of timestamps, n >= 3
+    :param vectors: batchxmxn numpy array to integrate
+    :param deltas: batchxmxn numpy array with first column set to zero
+    """
+    columns = vectors.shape[2]
+    for trip in range(vectors.shape[0]):
+        for j in range(columns - 2):
+            h0 = times[trip, j + 1] - times[trip, j]
+            h1 = times[trip, j + 2] - times[trip, j + 1]
+            h = h0 + h1
+            for row in range(vectors.shape[1]):
+                deltas[trip, row, j + 1] = h0 / 6 * (vectors[trip, row, j] * (2 * h0 + 3 * h1) / h +
+                                                     vectors[trip, row, j + 1] * (h0 + 3 * h1) / h1 -
+                                                     vectors[trip, row, j + 2] * h0 ** 2 / (h1 * h))
+        # last part of the last parabola
+        h0 = times[trip, columns - 2] - times[trip, columns - 3]
+        h1 = times[trip, columns - 1] - times[trip, columns - 2]
+        h = h0 + h1
+        for row in range(vectors.shape[1]):
+            deltas[trip, row, columns - 1] = h1 / 6 * (vectors[trip, row, columns - 1] * (2 * h1 + 3 * h0) / h +
+                                                       vectors[trip, row, columns - 2] * (h1 + 3 * h0) / h0 -
+                                                       vectors[trip, row, columns - 3] * h1 ** 2 / (h0 * h))
+
+
+compiled_simps_kernel = compile_kernel(simps_kernel)
+
+
+def simps_integrate_delta(times, vectors, backend=None):
     """
     Simpson integration with irregularly-spaced data
     Returns delta vector
@@ -65,68 +181,208 @@ def simps_integrate_delta(times, vectors):
 
     :param times: 1xn np array of timestamps
     :param vectors: 3xn np vector to integrate
+    :param backend: 'numba', 'numpy' or None to use the selected one, see backends module
     :return: 3xn np array vector of deltas
     """
+    return batch_simps_integrate_delta(np.asarray(times)[np.newaxis], vectors[np.newaxis], backend)[0]
 
-    rows = vectors.shape[0]
-    columns = vectors.shape[1]
+
+def batch_simps_integrate_delta(times, vectors, backend=None):
+    """
+    Simpson integration of many trips at once, equal to simps_integrate_delta for each trip
+
+    :param times: batchxn or 1xn (shared by all trips) numpy array of timestamps
+    :param vectors: batchx3xn numpy array to integrate
+    :param backend: 'numba', 'numpy' or None to use the selected one, see backends module
+    :return: batchx3xn numpy array of deltas
+    """
+    times = get_batch_times(times, vectors)
+    columns = vectors.shape[2]
     # create vector to keep results
-    deltas = np.zeros((rows, columns))
-    # iterate through vector to integrate
-    for j in range(0, columns - 2):
-        # create (x_i,y_i) points
-        x = times[j:j + 3]
-        # 3x3 array
-        vector_locals = vectors[:, j:j + 3]
-        for i, y in enumerate(vector_locals):
-            # create matrix to solve linear system
-            matrix = np.array([
-                [x[0] ** 2, x[0], 1],
-                [x[1] ** 2, x[1], 1],
-                [x[2] ** 2, x[2], 1],
-            ])
-            # solve linear system
-            A, B, C = np.linalg.solve(matrix,y)
-            # get integral value only of the "first part" of the parabola
-            deltas[i, j + 1] = A / 3 * (x[1] ** 3 - x[0] ** 3) + B / 2 * (x[1] ** 2 - x[0] ** 2) + C * (x[1] - x[0])
-            if j == columns - 3:
-                # fill last element element with already calculated values
-                # get integral value of "last part" of the parabola
-                deltas[i, j + 2] = A / 3 * (x[2] ** 3 - x[1] ** 3) + B / 2 * (x[2] ** 2 - x[1] ** 2) + C * (x[2] - x[1])
+    deltas = np.zeros(vectors.shape)
+    if columns < 3:
+        return deltas
+    if get_backend(backend) == 'numba':
+        compiled_simps_kernel(np.asarray(times, dtype=np.float64), np.asarray(vectors, dtype=np.float64), deltas)
+        return deltas
+    # for each j, parabola through (x_j, y_j), (x_j+1, y_j+1), (x_j+2, y_j+2)
+    y0 = vectors[..., :-2]
+    y1 = vectors[..., 1:-1]
+    y2 = vectors[..., 2:]
+    # widths of first and second interval of each parabola, broadcast on rows
+    times = times[:, np.newaxis, :]
+    h0 = times[..., 1:-1] - times[..., :-2]
+    h1 = times[..., 2:] - times[..., 1:-1]
+    h = h0 + h1
+    # get integral value only of the "first part" of the parabola, in closed form of parabola coefficients
+    deltas[..., 1:-1] = h0 / 6 * (y0 * (2 * h0 + 3 * h1) / h + y1 * (h0 + 3 * h1) / h1 - y2 * h0 ** 2 / (h1 * h))
+    # fill last element with integral value of "last part" of the last parabola
+    h0, h1, h = h0[..., -1], h1[..., -1], h[..., -1]
+    deltas[..., -1] = h1 / 6 * (y2[..., -1] * (2 * h1 + 3 * h0) / h + y1[..., -1] * (h1 + 3 * h0) / h0 -
+                                y0[..., -1] * h1 ** 2 / (h0 * h))
     return deltas
 
-def cumulative_integrate(times, vectors, initial=None, delta_integrate_func = simps_integrate_delta, adjust_data=None, adjust_frequency=None):
+
+def blend_kernel(delta_vectors, adjusted_rows, adjust_rows, adjust_frequency, adjust_gain, out):
+    """
+    Sum deltas blending with adjust data on adjust steps, out[:, :, 0] must already contain initial values
+
+    :param delta_vectors: batchxmxn numpy array of deltas
+    :param adjusted_rows: int number of first rows blended with adjust data, other rows restart from zero
+        on adjust steps
+    :param adjust_rows: batchxkxn numpy array of adjust data, a single row is used for all adjusted rows
+    :param adjust_frequency: int frequency of adjust operations
+    :param adjust_gain: float weight of adjust data on adjust steps
+    :param out: batchxmxn numpy array where integrated vectors are written
+    """
+    decay = 1 - adjust_gain
+    for trip in range(out.shape[0]):
+        for row in range(out.shape[1]):
+            adjust_row = row if adjust_rows.shape[1] > 1 else 0
+            for i in range(1, out.shape[2]):
+                if i % adjust_frequency != 0:
+                    out[trip, row, i] = out[trip, row, i - 1] + delta_vectors[trip, row, i]
+                elif row < adjusted_rows:
+                    out[trip, row, i] = adjust_rows[trip, adjust_row, i] * adjust_gain + \
+                                        (out[trip, row, i - 1] + delta_vectors[trip, row, i]) * decay
+                else:
+                    out[trip, row, i] = 0.0
+
+
+compiled_blend_kernel = compile_kernel(blend_kernel)
+
+
+def accumulate_deltas(delta_vectors, columns, initial_values, adjust_data, adjust_frequency, adjust_gain, backend):
+    """
+    Sum deltas of many trips, blending with adjust data on adjust steps, see cumulative_integrate
+
+    :param delta_vectors: batchxmxn numpy array of deltas, or batchxmx(n-1) deltas of intervals
+        as batch_trapz_integrate_delta returns
+    :param columns: int number n of integrated samples
+    :param initial_values: batchxm numpy array of integration initial values
+    :param adjust_data: batchxkxn numpy array or None
+    :param adjust_frequency: int or None
+    :param adjust_gain: float
+    :param backend: 'numba', 'numpy' or None to use the selected one, see backends module
+    :return: batchxmxn numpy array integrated vectors
+    :raises:
+        Exception if adjust data rows can't be used for adjusted rows or adjust data is shorter than vectors
+    """
+    batch, rows = delta_vectors.shape[:2]
+    if delta_vectors.shape[2] == columns - 1:
+        # each interval delta is added to the sample at its end, like simpson deltas
+        delta_vectors = np.concatenate((np.zeros((batch, rows, 1)), delta_vectors), axis=2)
+    if adjust_data is None or adjust_frequency is None:
+        # cumulative sum, starting from initial
+        return np.cumsum(np.concatenate((initial_values[..., np.newaxis], delta_vectors[..., 1:]), axis=2), axis=2)
+    if rows == 3:
+        # do not adjust z-axis (altitude is not reliable)
+        adjusted_rows = slice(0, 2)
+        # all adjust data rows but the last one, a single row is used for both x and y
+        adjust_rows = adjust_data[:, :-1]
+    elif rows == 1:
+        adjusted_rows = slice(0, 1)
+        adjust_rows = adjust_data[:, :1]
+    else:
+        adjusted_rows = slice(0, 0)
+        adjust_rows = adjust_data[:, :1]
+    # same checks for both backends, compiled kernel doesn't check bounds
+    if adjusted_rows.stop > 0 and (adjust_rows.ndim != 3 or adjust_rows.shape[0] != batch or
+                                   adjust_rows.shape[1] not in (1, adjusted_rows.stop) or
+                                   adjust_rows.shape[2] < columns):
+        raise Exception("Adjust data shape {} doesn't match vectors shape {}".format(adjust_data.shape[1:],
+                                                                                    (rows, columns)))
+    if get_backend(backend) == 'numba':
+        result_vectors = np.empty((batch, rows, columns))
+        result_vectors[..., 0] = initial_values
+        compiled_blend_kernel(np.asarray(delta_vectors, dtype=np.float64), adjusted_rows.stop,
+                              np.asarray(adjust_rows, dtype=np.float64), adjust_frequency, float(adjust_gain),
+                              result_vectors)
+        return result_vectors
+    # split columns in blocks starting from an adjust step (first one from initial values)
+    blocks = (columns - 1) // adjust_frequency + 1
+    block_deltas = np.zeros((batch, rows, blocks * adjust_frequency))
+    block_deltas[..., 1:columns] = delta_vectors[..., 1:]
+    block_deltas = block_deltas.reshape((batch, rows, blocks, adjust_frequency))
+    # value on adjust steps, zero for not adjusted rows
+    block_starts = np.zeros((batch, rows, blocks))
+    block_starts[..., 0] = initial_values
+    if blocks > 1 and adjusted_rows.stop > 0:
+        adjust_columns = np.arange(adjust_frequency, columns, adjust_frequency)
+        adjust_values = np.broadcast_to(adjust_rows[..., adjust_columns], (batch, adjusted_rows.stop, blocks - 1))
+        # deltas from previous adjust step, included the one of the adjust step
+        increments = block_deltas[:, adjusted_rows, :-1, 1:].sum(axis=3) + block_deltas[:, adjusted_rows, 1:, 0]
+        # start_k = adjust_k * gain + (start_k-1 + increments_k) * (1 - gain)
+        decay = 1 - adjust_gain
+        from scipy.signal import lfilter
+        block_starts[:, adjusted_rows, 1:], _ = lfilter([1], [1, -decay],
+                                                        adjust_values * adjust_gain + increments * decay,
+                                                        axis=2, zi=block_starts[:, adjusted_rows, :1] * decay)
+    # cumulative sum of each block from its start
+    block_deltas[..., 0] = block_starts
+    return np.cumsum(block_deltas, axis=3).reshape((batch, rows, blocks * adjust_frequency))[..., :columns]
+
+
+def cumulative_integrate(times, vectors, initial=None, delta_integrate_func = simps_integrate_delta, adjust_data=None,
+                         adjust_frequency=None, adjust_gain=0.01, backend=None):
     """
     Optional initial data reset with custom frequency
 
+    Without adjust data integration is a cumulative sum of deltas.
+    On adjust steps the integrated value is blended with adjust data:
+    ``adjust_data * adjust_gain + (previous + delta) * (1 - adjust_gain)``.
+    This is a first order linear filter, applied with scipy lfilter on adjust steps
+    while steps in between are cumulative sums.
+    z-axis (last row of 3 rows vectors) is not adjusted because altitude is not reliable, it restarts from zero
+    on adjust steps. Vectors with other than 1 or 3 rows restart from zero on adjust steps.
+
     :param times: 1xn np array of timestamps
     :param vectors: 3xn np vector to integrate
     :param initial: 3x1 np array integration initial value
+    :param delta_integrate_func: callable ``f(times, vectors)``, simps_integrate_delta or trapz_integrate_delta
     :param adjust_data: 3xn numpy array. Data to reset to each adjust frequency times.
-    :param adjust_frequency: 3xn numpy array. Frequency of adjust operations.
+    :param adjust_frequency: int. Frequency of adjust operations.
+    :param adjust_gain: float. Weight of adjust data on adjust steps.
+    :param backend: 'numba', 'numpy' or None to use the selected one, see backends module.
+        The numba backend blends with adjust data in a single sequential pass instead of lfilter.
+        delta_integrate_func uses the selected backend.
     :return: 3xn numpy array integrated vectors
 
     """
     rows = vectors.shape[0]
-    columns = vectors.shape[1]
     delta_vectors = delta_integrate_func(times,vectors)
-    # create vector to keep results
-    result_vectors = np.zeros((rows,columns))
-    # save initial in first result position
-    result_vectors[:, 0] = np.zeros(rows) if (initial is None) else np.reshape(initial,(1,rows))
-    # iterate delta_vector skipping first position
-    for i,delta_vector in enumerate(delta_vectors[:,1:].T,1):
-        # if adjust is needed
-        if adjust_data is not None and adjust_frequency is not None and i % adjust_frequency == 0:
-            # reset result vectors
-            if rows == 3:
-                # do not adjust z-axis (altitude is not reliable)
-                result_vectors[:-1, i] = \
-                    adjust_data[:-1, i]*0.01 + (result_vectors[:-1, i - 1] + delta_vectors[:-1, i])*0.99
-            elif rows == 1:
-                result_vectors[0, i] = \
-                    adjust_data[0, i]*0.01 + (result_vectors[0, i - 1] + delta_vectors[0, i])*0.99
-        else:
-            # cumulative sum
-            result_vectors[:,i] = result_vectors[:,i-1] + delta_vectors[:,i]
-    return result_vectors
\ No newline at end of file
+    initial_values = np.zeros(rows) if (initial is None) else np.reshape(initial, rows)
+    if adjust_data is not None:
+        adjust_data = adjust_data[np.newaxis]
+    return accumulate_deltas(delta_vectors[np.newaxis], vectors.shape[1], initial_values[np.newaxis], adjust_data,
+                             adjust_frequency, adjust_gain, backend)[0]
+
+
+def batch_cumulative_integrate(times, vectors, initial=None, delta_integrate_func=batch_simps_integrate_delta,
+                               adjust_data=None, adjust_frequency=None, adjust_gain=0.01, backend=None):
+    """
+    Integrate many trips at once, equal to cumulative_integrate for each trip
+
+    :param times: batchxn or 1xn (shared by all trips) numpy array of timestamps
+    :param vectors: batchx3xn numpy array to integrate
+    :param initial: batchx3 numpy array of initial values of each trip, or 3x1 shared by all trips
+    :param delta_integrate_func: callable ``f(times, vectors)`` on batches,
+        batch_simps_integrate_delta or batch_trapz_integrate_delta (its interval deltas are padded to n samples)
+    :param adjust_data: batchx3xn numpy array. Data to reset to each adjust frequency times.
+    :param adjust_frequency: int. Frequency of adjust operations.
+    :param adjust_gain: float. Weight of adjust data on adjust steps.
+    :param backend: 'numba', 'numpy' or None to use the selected one, see backends module
+    :return: batchx3xn numpy array integrated vectors
+    :raises:
+        Exception if shapes of arguments don't match
+    """
+    times = get_batch_times(times, vectors)
+    batch, rows, columns = vectors.shape
+    delta_vectors = delta_integrate_func(times, vectors)
+    initial_values = np.zeros((batch, rows)) if (initial is None) else \
+        np.broadcast_to(np.reshape(initial, (-1, rows)), (batch, rows))
+    if adjust_data is not None and (adjust_data.ndim != 3 or adjust_data.shape[0] != batch):
+        raise Exception("Adjust data shape {} doesn't match vectors shape {}".format(adjust_data.shape,
+                                                                                    vectors.shape))
+    return accumulate_deltas(delta_vectors, columns, initial_values, adjust_data, adjust_frequency, adjust_gain,
+                             backend)
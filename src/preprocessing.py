@@ -0,0 +1,213 @@
+"""
+Fused preprocessing of inertial data.
+
+Does in two passes over a preallocated buffer the same cleaning of the separate functions of clean_data_utils:
+measurement units conversion, disturbance reduction, gyroscope drift removal, timestamps normalization,
+z-axis alignment and gravity removal.
+All these steps but the moving average are affine maps constant between two stationary times,
+so after the moving average only a few statistics on stationary times are needed to
+apply all of them at once.
+
+Results are equal to the separate functions up to rounding errors,
+differences are below 1e-9 on accelerations (m/s^2) and angular velocities (rad/s).
+
+This file is part of inertial_to_blender project,
+a Blender simulation generator from inertial sensor data on cars.
+
+Copyright (C) 2018  Federico Bertani
+Author: Federico Bertani
+Credits: Federico Bertani, Stefano Sinigardi, Alessandro Fabbri, Nico Curti
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import warnings
+
+import numpy as np
+from scipy import constants
+
+from src.backends import get_backend, compile_kernel
+from src.clean_data_utils import reduce_disturbance, get_z_alignment, z_realign_threshold
+
+# measurement unit conversion factors of accelerations (g -> m/s^2) and angular velocities (degrees/s -> rad/s)
+inertial_scales = np.array([constants.g] * 3 + [constants.degree] * 3)
+
+
+def moving_average_kernel(inertial, scales, window_dimension, first_start, out):
+    """
+    Scale and average rows of inertial over a sliding window
+
+    Sums are updated removing the oldest value and adding the newest one, with Kahan compensation
+    so rounding errors don't grow with the length of data.
+
+    :param inertial: 6xn numpy array
+    :param scales: 1x6 numpy array factors rows are multiplied by
+    :param window_dimension: int window dimension in samples
+    :param first_start: int index of first sample of the first window
+    :param out: 6xm numpy array where averages are written
+    """
+    for row in range(out.shape[0]):
+        scale = scales[row]
+        total = 0.0
+        compensation = 0.0
+        for i in range(first_start, first_start + window_dimension):
+            value = inertial[row, i] * scale - compensation
+            new_total = total + value
+            compensation = (new_total - total) - value
+            total = new_total
+        out[row, 0] = total / window_dimension
+        for j in range(1, out.shape[1]):
+            # remove value leaving the window
+            value = -inertial[row, first_start + j - 1] * scale - compensation
+            new_total = total + value
+            compensation = (new_total - total) - value
+            total = new_total
+            # add value entering the window
+            value = inertial[row, first_start + j - 1 + window_dimension] * scale - compensation
+            new_total = total + value
+            compensation = (new_total - total) - value
+            total = new_total
+            out[row, j] = total / window_dimension
+
+
+def affine_kernel(buffer, boundaries, rotation_matrices, offsets, gravity):
+    """
+    Remove gyroscope offsets, rotate and remove gravity in place
+
+    Between boundaries[k] and boundaries[k + 1] angular velocities have offsets[k] removed,
+    then accelerations and angular velocities are rotated by rotation_matrices[k].
+
+    :param buffer: 6xm numpy array of accelerations followed by angular velocities
+    :param boundaries: 1x(k+1) numpy array of int segments boundaries
+    :param rotation_matrices: kx3x3 numpy array
+    :param offsets: kx3 numpy array
+    :param gravity: float value removed from z accelerations after rotation
+    """
+    for k in range(boundaries.shape[0] - 1):
+        rotation = rotation_matrices[k]
+        for i in range(boundaries[k], boundaries[k + 1]):
+            ax = buffer[0, i]
+            ay = buffer[1, i]
+            az = buffer[2, i]
+            buffer[0, i] = rotation[0, 0] * ax + rotation[0, 1] * ay + rotation[0, 2] * az
+            buffer[1, i] = rotation[1, 0] * ax + rotation[1, 1] * ay + rotation[1, 2] * az
+            buffer[2, i] = rotation[2, 0] * ax + rotation[2, 1] * ay + rotation[2, 2] * az - gravity
+            gx = buffer[3, i] - offsets[k, 0]
+            gy = buffer[4, i] - offsets[k, 1]
+            gz = buffer[5, i] - offsets[k, 2]
+            buffer[3, i] = rotation[0, 0] * gx + rotation[0, 1] * gy + rotation[0, 2] * gz
+            buffer[4, i] = rotation[1, 0] * gx + rotation[1, 1] * gy + rotation[1, 2] * gz
+            buffer[5, i] = rotation[2, 0] * gx + rotation[2, 1] * gy + rotation[2, 2] * gz
+
+
+compiled_moving_average_kernel = compile_kernel(moving_average_kernel)
+compiled_affine_kernel = compile_kernel(affine_kernel)
+
+
+def get_trim_range(length, window_dimension):
+    """
+    Get range of samples with a complete moving average window, same of clean_data_utils.reduce_disturbance
+
+    :param length: int number of samples
+    :param window_dimension: int window dimension in samples
+    :return: 2 int: first sample index, index after the last sample
+    """
+    low = round(window_dimension / 2)
+    high = max(round(length - window_dimension / 2), low)
+    return low, high
+
+
+def get_segment_transforms(buffer, stationary_times):
+    """
+    Get gyroscope offsets and z alignment rotations from stationary times of smoothed data
+
+    Equal to clean_data_utils.clear_gyro_drift and clean_data_utils.correct_z_orientation,
+    but rotated data is never computed, only rotated means of stationary times.
+
+    :param buffer: 6xm numpy array of smoothed accelerations followed by angular velocities
+    :param stationary_times: list of tuples (start,end) sorted by time and not overlapping
+    :return: 4 numpy arrays: (k+1) segments boundaries, kx3x3 rotation matrices, kx3 offsets, float gravity
+    """
+    length = buffer.shape[1]
+    # stationary times starting after the end of smoothed data change nothing, as in clear_gyro_drift
+    stationary_times = stationary_times[:1] + [stationary_time for stationary_time in stationary_times[1:]
+                                               if stationary_time[0] < length]
+    starts = [stationary_time[0] for stationary_time in stationary_times[1:]]
+    boundaries = np.array([0] + starts + [length])
+    # gyroscope offset of each stationary time is removed until the next one
+    offsets = np.array([buffer[3:, start:end].mean(axis=1) for start, end in stationary_times])
+    # first alignment with g of all stationary times
+    g = np.mean(np.concatenate([buffer[:3, start:end] for start, end in stationary_times], axis=1), axis=1)
+    _, rotation = get_z_alignment(g)
+    rotation_matrices = [rotation]
+    for start, end in stationary_times[1:]:
+        # g as it would be after previous rotations
+        g = rotation @ buffer[:3, start:end].mean(axis=1)
+        bad_align_angle = np.arccos(g[2] / np.linalg.norm(g))
+        if bad_align_angle > z_realign_threshold:
+            message = " \n Found additional bad z axis of {} degrees alignment at time {} , " \
+                      "realigning from now  \n".format(np.rad2deg(bad_align_angle), start)
+            warnings.warn(message)
+            rotation = get_z_alignment(g)[1] @ rotation
+        rotation_matrices.append(rotation)
+    first_start, first_end = stationary_times[0][0], stationary_times[0][-1]
+    gravity = (rotation_matrices[0] @ buffer[:3, first_start:first_end].mean(axis=1))[2]
+    return boundaries, np.array(rotation_matrices), offsets, gravity
+
+
+def preprocess_inertial(times, inertial, stationary_times, window_dimension, out=None, backend=None):
+    """
+    Clean inertial data as the separate functions of clean_data_utils in get_trajectory_from_path
+
+    Equal to converts_measurement_units, reduce_disturbance, clear_gyro_drift, normalize_timestamp,
+    correct_z_orientation and removal of g mean in the first stationary time, in this order.
+    Input arrays are not modified.
+
+    :param times: 1xn numpy array of timestamps
+    :param inertial: 6xn numpy array of accelerations in g followed by angular velocities in degrees/s
+    :param stationary_times: list of tuples (start,end) from clean_data_utils.get_stationary_times
+    :param window_dimension: int moving average window dimension in samples
+    :param out: optional 6xm float64 numpy array where results are written,
+        m is the number of samples with a complete moving average window
+    :param backend: 'numba', 'numpy' or None to use the selected one, see backends module
+    :return: 3 numpy arrays: 1xm times starting from 0, 3xm accelerations and 3xm angular velocities
+        (views of out)
+    :raises:
+        Exception if backend is unknown or numba is not available
+    """
+    backend = get_backend(backend)
+    low, high = get_trim_range(inertial.shape[1], window_dimension)
+    if out is None:
+        out = np.empty((6, high - low))
+    # first pass: units conversion and moving average
+    if backend == 'numba':
+        if high > low:
+            compiled_moving_average_kernel(inertial, inertial_scales, window_dimension,
+                                           low - window_dimension // 2, out)
+    else:
+        _, out[:] = reduce_disturbance(times, inertial * inertial_scales[:, np.newaxis], window_dimension)
+    boundaries, rotation_matrices, offsets, gravity = get_segment_transforms(out, stationary_times)
+    # second pass: gyroscope drift, z alignment and gravity
+    if backend == 'numba':
+        compiled_affine_kernel(out, boundaries, rotation_matrices, offsets, gravity)
+    else:
+        for k in range(boundaries.shape[0] - 1):
+            segment = out[:, boundaries[k]:boundaries[k + 1]]
+            segment[3:] -= offsets[k][:, np.newaxis]
+            segment[:3] = rotation_matrices[k] @ segment[:3]
+            segment[3:] = rotation_matrices[k] @ segment[3:]
+        out[2] -= gravity
+    new_times = times[low:high] - times[low]
+    return new_times, out[:3], out[3:]
@@ -1,13 +1,143 @@
 import numpy as np
 # aliasing necessary for using quaternion name inside as local variable
 from quaternion import quaternion as Quaternion
-from quaternion import from_rotation_vector
+from quaternion import from_rotation_vector, as_float_array, as_quat_array, from_vector_part
 
+from src.backends import get_backend, compile_kernel, compile_function, prange
 from src.integrate import simps_integrate_delta
 
 
+@compile_function
+def multiply_rows(left, i, right, j, out, k):
+    """
+    Write in out[k] the Hamilton product left[i] * right[j], out can be left or right
+
+    :param left: nx4 numpy array of quaternions components (w, x, y, z)
+    :param i: int row of left
+    :param right: mx4 numpy array of quaternions components
+    :param j: int row of right
+    :param out: px4 numpy array of quaternions components
+    :param k: int row of out
+    """
+    aw, ax, ay, az = left[i, 0], left[i, 1], left[i, 2], left[i, 3]
+    bw, bx, by, bz = right[j, 0], right[j, 1], right[j, 2], right[j, 3]
+    # same operations order of numpy-quaternion
+    out[k, 0] = aw * bw - ax * bx - ay * by - az * bz
+    out[k, 1] = aw * bx + ax * bw + ay * bz - az * by
+    out[k, 2] = aw * by - ax * bz + ay * bw + az * bx
+    out[k, 3] = aw * bz + ax * by - ay * bx + az * bw
+
+
+@compile_function
+def normalize_row(quaternions, i):
+    """
+    Scale in place a quaternion to unit length
+
+    :param quaternions: nx4 numpy array of quaternions components
+    :param i: int row of quaternions
+    """
+    norm = np.sqrt(quaternions[i, 0] ** 2 + quaternions[i, 1] ** 2 + quaternions[i, 2] ** 2 + quaternions[i, 3] ** 2)
+    for component in range(4):
+        quaternions[i, component] /= norm
+
+
+def quaternion_chain_kernel(quaternions):
+    """
+    Compose rotations in place, each quaternion is left-multiplied to the previous result
+
+    :param quaternions: nx4 numpy array of quaternions components (w, x, y, z)
+    """
+    for i in range(1, quaternions.shape[0]):
+        multiply_rows(quaternions, i, quaternions, i - 1, quaternions, i)
+
+
+def blocked_quaternion_chain_kernel(quaternions, block_size, carries):
+    """
+    Compose rotations in place with a blocked prefix product, blocks run in parallel when compiled
+
+    Each block is chained from its first quaternion, then blocks are left-multiplied to the aggregated
+    rotation of previous blocks and results are normalized.
+
+    :param quaternions: nx4 numpy array of quaternions components (w, x, y, z)
+    :param block_size: int number of quaternions of each block
+    :param carries: kx4 numpy array, k number of blocks, where aggregated rotations of previous blocks are written
+    """
+    length = quaternions.shape[0]
+    blocks = carries.shape[0]
+    # chain of each block
+    for block in prange(blocks):
+        for i in range(block * block_size + 1, min((block + 1) * block_size, length)):
+            multiply_rows(quaternions, i, quaternions, i - 1, quaternions, i)
+    # aggregated rotation before each block, from last quaternion of previous block
+    carries[0, 0] = 1.0
+    carries[0, 1:] = 0.0
+    for block in range(1, blocks):
+        multiply_rows(quaternions, block * block_size - 1, carries, block - 1, carries, block)
+        normalize_row(carries, block)
+    # apply to all quaternions of the block
+    for block in prange(blocks):
+        for i in range(block * block_size, min((block + 1) * block_size, length)):
+            if block > 0:
+                multiply_rows(quaternions, i, carries, block, quaternions, i)
+            normalize_row(quaternions, i)
+
+
+compiled_quaternion_chain_kernel = compile_kernel(quaternion_chain_kernel)
+compiled_blocked_quaternion_chain_kernel = compile_kernel(blocked_quaternion_chain_kernel, parallel=True)
+
+
+def chain_quaternions(quaternions, backend=None, block_size=None):
+    """
+    Get aggregated rotations of a sequence of rotations
+
+    To rotate first by q1 then by q2 the aggregated quaternion is q2q1 not q1q2,
+    so result is [q0, q1q0, q2q1q0, ...]. Runs in linear time.
+
+    With block_size quaternion product associativity is used to chain blocks independently
+    and then combine them: with numba backend blocks run on multiple threads,
+    with numpy backend they are vectorized. Results are normalized to unit length,
+    so they differ from the sequential chain by rounding errors and for non unit input quaternions.
+    Useful for recordings with tens of millions of samples.
+
+    :param quaternions: 1xn numpy array of quaternions
+    :param backend: 'numba', 'numpy' or None to use the selected one, see backends module
+    :param block_size: optional int number of quaternions chained sequentially in each block,
+        square root of n is a good value with numpy backend
+    :return: 1xn numpy array of quaternions
+    """
+    length = quaternions.shape[0]
+    if block_size is not None:
+        blocks = max(-(-length // block_size), 1)
+    if get_backend(backend) == 'numba':
+        components = np.array(as_float_array(quaternions), dtype=np.float64)
+        if block_size is None:
+            compiled_quaternion_chain_kernel(components)
+        else:
+            compiled_blocked_quaternion_chain_kernel(components, block_size, np.empty((blocks, 4)))
+        return as_quat_array(components)
+    if block_size is None:
+        chain = quaternions.copy()
+        for i in range(1, length):
+            chain[i] = chain[i] * chain[i - 1]
+        return chain
+    # a row for each block, last one padded with identity quaternions
+    table = np.full(blocks * block_size, Quaternion(1, 0, 0, 0), dtype=np.quaternion)
+    table[:length] = quaternions
+    table = table.reshape((blocks, block_size))
+    # chain all blocks together, a column at a time
+    for i in range(1, block_size):
+        table[:, i] = table[:, i] * table[:, i - 1]
+    # aggregated rotation before each block
+    carries = np.full(blocks, Quaternion(1, 0, 0, 0), dtype=np.quaternion)
+    for block in range(1, blocks):
+        carries[block] = (table[block - 1, -1] * carries[block - 1]).normalized()
+    table = table * carries[:, np.newaxis]
+    return (table / np.abs(table)).reshape(-1)[:length]
+
+
 def rotate_accelerations(times, accelerations, angular_velocities, headings,
-                         initial_angular_position=np.array([0, 0, 0])):
+                         initial_angular_position=np.array([0, 0, 0]), backend=None, scan_block_size=None,
+                         world_alignment_angle=None):
     """
     Integrate angular velocities and rotate acceleration vector accordingly.
     Moves from local frame of reference to laboratory one.
@@ -17,6 +147,11 @@ def rotate_accelerations(times, accelerations, angular_velocities, headings,
     :param angular_velocities: 3xn numpy array of angular velocities in rad/s
     :param headings: 1xn angular potion around z from gnss data
     :param initial_angular_position: 1x3 numpy array containing initial angular position vector
+    :param backend: 'numba', 'numpy' or None to use the selected one, see backends module
+    :param scan_block_size: optional int, if set angular positions are chained with a blocked parallel scan
+        of this block size and normalized, see chain_quaternions()
+    :param world_alignment_angle: optional float angle in radians of rotation around z applied to accelerations
+        in the same rotation, equal to align_to_world() afterwards. Angular positions are not rotated.
     :return: 2 numpy array: 3xn acceleration vector and 4xn angular position as quaternion
     """
 
@@ -25,39 +160,55 @@ def rotate_accelerations(times, accelerations, angular_velocities, headings,
     delta_thetas = simps_integrate_delta(times, angular_velocities)
     initial_quaternion = np.exp(Quaternion(*initial_angular_position) / 2)
     # create quaternion representing angular position (angular position = rotation_versor * rotation_angle)
-    quaternions = from_rotation_vector(delta_thetas[:, 1:].T)
+    quaternions = np.empty(delta_thetas.shape[1], dtype=np.quaternion)
+    quaternions[0] = initial_quaternion
+    quaternions[1:] = from_rotation_vector(delta_thetas[:, 1:].T)
     # cant use np.cumprod because in quaternion to rotate first by q1 then by q2
     # the aggregated quaternion is q2q1 not q1q2
-    # so use reduce
-    from functools import reduce
-    quaternions = np.array(reduce(lambda array, element: [*array, element * array[-1]], quaternions, [initial_quaternion]))
-    accelerations = np.array(list(map(lambda x: (x[1] * Quaternion(*x[0]) * ~x[1]).components[1:], zip(accelerations.T, quaternions))))
-    angular_positions = np.array([quaternion.components for quaternion in quaternions])
+    quaternions = chain_quaternions(quaternions, backend, scan_block_size)
+    # rotate all accelerations at once as pure quaternions
+    rotated = quaternions * from_vector_part(accelerations.T)
+    inverse_rotations = ~quaternions
+    if world_alignment_angle is not None:
+        # rotate to world after rotating to laboratory frame, as (zq)v(zq)^-1 = zqvq^-1z^-1,
+        # constant z is multiplied in place so no other array of quaternions is allocated
+        world_rotation = np.exp(Quaternion(0, 0, world_alignment_angle) / 2)
+        np.multiply(world_rotation, rotated, out=rotated)
+        np.multiply(inverse_rotations, ~world_rotation, out=inverse_rotations)
+    np.multiply(rotated, inverse_rotations, out=rotated)
+    accelerations = as_float_array(rotated)[:, 1:]
+    angular_positions = as_float_array(quaternions)
     return accelerations.T, angular_positions.T
 
 
+def get_world_alignment_angle(gnss_position, motion_time):
+    """
+    Get rotation angle around z to align vectors to world system (x axis going to east, y to north)
+
+    :param gnss_position: 3xn numpy array. positions from gnss data
+    :param motion_time: int index of first motion record, see gnss_utils.get_first_motion_time()
+    :return: float angle in radians
+    """
+    # TODO pay attention using acceleration, angle of vectors at motion time could be subtracted
+    return np.arctan2(gnss_position[1, motion_time], gnss_position[0, motion_time])
+
+
 def align_to_world(gnss_position, vectors, motion_time):
     """
     Align accelerations to world system (x axis going to east, y to north)
 
+    rotate_accelerations() with world_alignment_angle does the same inside the rotation to laboratory frame.
+
     :param gnss_position: 3xn numpy array. positions from gnss data
     :param vectors: 3xn numpy array
-    :param stationary_times: list of tuples
-    :param angular_positions:
-    :return: 2 numpy array: 3xn numpy array of rotated accelerations and 4xn angular positions as quaternions
-    """
-
-    from scipy import sin, cos, arctan2
-    # get angle of rotation
-    angle_gnss = np.arctan2(gnss_position[1, motion_time], gnss_position[0, motion_time])
-    # TODO pay attention using acceleration
-    angle_vector = arctan2(vectors[1, motion_time], vectors[0, motion_time])
-    # rotation_angle = angle_gnss - angle_vector
-    rotation_angle = angle_gnss
-    message = "Rotation vector to {} degrees to align to world".format(np.rad2deg(rotation_angle))
-    print(message)
+    :param motion_time: int index of first motion record, see gnss_utils.get_first_motion_time()
+    :return: 3xn numpy array of rotated vectors
+    """
+    rotation_angle = get_world_alignment_angle(gnss_position, motion_time)
+    cos_angle = np.cos(rotation_angle)
+    sin_angle = np.sin(rotation_angle)
     new_vectors = vectors.copy()
     # rotate vector in xy plane
-    new_vectors[0] = cos(rotation_angle) * vectors[0] - sin(rotation_angle) * vectors[1]
-    new_vectors[1] = sin(rotation_angle) * vectors[0] + cos(rotation_angle) * vectors[1]
+    new_vectors[0] = cos_angle * vectors[0] - sin_angle * vectors[1]
+    new_vectors[1] = sin_angle * vectors[0] + cos_angle * vectors[1]
     return new_vectors
@@ -0,0 +1,154 @@
+"""
+Container of parsed sensor data backed by a single numpy array.
+
+This file is part of inertial_to_blender project,
+a Blender simulation generator from inertial sensor data on cars.
+
+Copyright (C) 2018  Federico Bertani
+Author: Federico Bertani
+Credits: Federico Bertani, Stefano Sinigardi, Alessandro Fabbri, Nico Curti
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import numpy as np
+
+# rows of recording block
+# accelerations and angular velocities are adjacent so they can be processed together
+times_row = 0
+gps_speed_row = 1
+accelerations_rows = slice(2, 5)
+angular_velocities_rows = slice(5, 8)
+inertial_rows = slice(2, 8)
+coordinates_rows = slice(8, 10)
+altitudes_row = 10
+heading_row = 11
+# time derivatives of coordinates from gnss interpolation
+coordinate_rates_rows = slice(12, 14)
+# input columns stored in each row
+channel_columns = ['timestamp', 'speed', 'ax', 'ay', 'az', 'gx', 'gy', 'gz', 'lat', 'lon', 'alt', 'heading']
+# number of channels of inertial and fullinertial recordings, and of fullinertial ones with coordinate rates
+inertial_channels = 8
+fullinertial_channels = 12
+coordinate_rates_channels = 14
+# changed when rows are added, stored recordings with another layout must not be loaded
+recording_layout_version = 2
+
+
+class SensorRecording:
+    """
+    Sensor data of a recording in a (channels)xn C-contiguous numpy array
+
+    Properties are views of the array so in-place operations on them modify the recording.
+    Iterating a recording gives the same vectors of input_manager.get_vectors,
+    so it can be unpacked like the tuple returned by input_manager.parse_input.
+    """
+
+    __slots__ = ('block', 'has_gnss', 'has_coordinate_rates')
+
+    def __init__(self, block):
+        """
+        :param block: 8xn numpy array for inertial recordings, 12xn numpy array for fullinertial ones,
+            14xn numpy array for fullinertial ones with coordinate rates
+        """
+        if block.shape[0] not in (inertial_channels, fullinertial_channels, coordinate_rates_channels):
+            raise Exception("Recording must have {}, {} or {} channels".format(inertial_channels, fullinertial_channels,
+                                                                            coordinate_rates_channels))
+        self.block = block
+        self.has_gnss = block.shape[0] >= fullinertial_channels
+        self.has_coordinate_rates = block.shape[0] == coordinate_rates_channels
+
+    @classmethod
+    def empty(cls, length, has_gnss=True, dtype=np.float64, has_coordinate_rates=False):
+        """
+        Allocate a recording to be filled
+
+        :param length: int number of samples
+        :param has_gnss: bool if True allocate also coordinates, altitudes and heading
+        :param dtype: numpy type
+        :param has_coordinate_rates: bool if True allocate also coordinate rates, implies has_gnss
+        :return: SensorRecording
+        """
+        if has_coordinate_rates:
+            channels = coordinate_rates_channels
+        else:
+            channels = fullinertial_channels if has_gnss else inertial_channels
+        return cls(np.empty((channels, length), dtype=dtype))
+
+    def __len__(self):
+        return self.block.shape[1]
+
+    def __iter__(self):
+        if self.has_gnss:
+            vectors = (self.times, self.coordinates, self.altitudes, self.gps_speed, self.heading,
+                       self.accelerations, self.angular_velocities)
+        else:
+            vectors = (self.times, self.gps_speed, self.accelerations, self.angular_velocities)
+        return iter(vectors)
+
+    def trim(self, start, end):
+        """
+        Get recording restricted to samples from start to end
+
+        :param start: int index of first sample
+        :param end: int index after last sample
+        :return: SensorRecording sharing memory with this one
+        """
+        return SensorRecording(self.block[:, start:end])
+
+    @property
+    def times(self):
+        """ 1xn numpy array of timestamps """
+        return self.block[times_row]
+
+    @property
+    def gps_speed(self):
+        """ 1xn numpy array of gps speed """
+        return self.block[gps_speed_row]
+
+    @property
+    def accelerations(self):
+        """ 3xn numpy array of accelerations """
+        return self.block[accelerations_rows]
+
+    @property
+    def angular_velocities(self):
+        """ 3xn numpy array of angular velocities """
+        return self.block[angular_velocities_rows]
+
+    @property
+    def inertial(self):
+        """ 6xn numpy array of accelerations followed by angular velocities """
+        return self.block[inertial_rows]
+
+    @property
+    def coordinates(self):
+        """ 2xn numpy array of coordinates (lat, lon), None if recording has no gnss data """
+        return self.block[coordinates_rows] if self.has_gnss else None
+
+    @property
+    def altitudes(self):
+        """ 1xn numpy array of altitudes, None if recording has no gnss data """
+        return self.block[altitudes_row] if self.has_gnss else None
+
+    @property
+    def heading(self):
+        """ 1xn numpy array of headings, None if recording has no gnss data """
+        return self.block[heading_row] if self.has_gnss else None
+
+    @property
+    def coordinate_rates(self):
+        """ 2xn numpy array of coordinates time derivatives, None if recording has no coordinate rates """
+        return self.block[coordinate_rates_rows] if self.has_coordinate_rates else None
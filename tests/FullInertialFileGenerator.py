@@ -0,0 +1,116 @@
+"""
+Generate synthetic FullInertial input files.
+Useful for testing input parsing without shipping big datasets.
+
+This file is part of inertial_to_blender project,
+a Blender simulation generator from inertial sensor data on cars.
+
+Copyright (C) 2018  Federico Bertani
+Author: Federico Bertani
+Credits: Federico Bertani, Stefano Sinigardi, Alessandro Fabbri, Nico Curti
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import numpy as np
+import pandas as pd
+
+gnss_columns = ['lat', 'lon', 'alt', 'speed', 'heading']
+inertial_columns = ['ax', 'ay', 'az', 'gx', 'gy', 'gz', '|a|']
+
+
+class FullInertialFileGenerator:
+
+    def __init__(self, max_time=60, time_step=1e-2, gnss_step=10, stationary_time=10, speed=10, seed=0, stops=()):
+        """
+        Car standing still for stationary_time seconds then moving straight to north-east
+
+        :param max_time: float length of the recording in seconds
+        :param time_step: float inertial sampling period in seconds
+        :param gnss_step: int number of inertial records between two gnss records
+        :param stationary_time: float seconds before the car starts moving
+        :param speed: float car speed in km/h once it moves
+        :param seed: int random generator seed for sensor noise
+        :param stops: list of 2-tuples, start and end seconds of other stationary times
+        """
+        random = np.random.RandomState(seed)
+        self.times = 555081678 + np.arange(0, max_time, time_step)
+        n = self.times.shape[0]
+        relative_times = self.times - self.times[0]
+        moving = relative_times > stationary_time
+        for stop_start, stop_end in stops:
+            moving &= np.logical_or(relative_times < stop_start, relative_times > stop_end)
+        self.speed = np.where(moving, speed, 0.0)
+        # travelled distance in meters
+        distance = np.cumsum(self.speed / 3.6 * time_step)
+        self.lat = 44.484372 + np.rad2deg(distance / np.sqrt(2) / 6371000)
+        self.lon = 11.355899 + np.rad2deg(distance / np.sqrt(2) / (6371000 * np.cos(np.deg2rad(44.484372))))
+        self.alt = 50 + random.normal(0, 0.5, n)
+        self.heading = np.full(n, 45.0)
+        # accelerations in g with sensor noise and slightly tilted sensor
+        self.ax = random.normal(0.02, 0.01, n)
+        self.ay = random.normal(0.15, 0.01, n)
+        self.az = random.normal(0.95, 0.01, n)
+        # angular velocities in deg/s with drift
+        self.gx = random.normal(0.8, 0.5, n)
+        self.gy = random.normal(0.7, 0.5, n)
+        self.gz = random.normal(0.2, 0.5, n)
+        self.gnss_step = gnss_step
+
+    def get_dataframe(self, unmodified=True):
+        """
+        Get data in fullinertial layout
+
+        :param unmodified: bool if True gnss and inertial records are kept in different rows
+        :return: pandas DataFrame
+        """
+        df = pd.DataFrame({
+            'timestamp': self.times,
+            'lat': self.lat,
+            'lon': self.lon,
+            'alt': self.alt,
+            'speed': self.speed,
+            'heading': self.heading,
+            'ax': self.ax,
+            'ay': self.ay,
+            'az': self.az,
+            'gx': self.gx,
+            'gy': self.gy,
+            'gz': self.gz,
+            '|a|': np.sqrt(self.ax ** 2 + self.ay ** 2 + self.az ** 2),
+            'timestamp_rel': self.times - self.times[0],
+        })
+        if unmodified:
+            gnss = df.iloc[::self.gnss_step].copy()
+            gnss[inertial_columns] = np.nan
+            # gnss records come a bit before the inertial record with same index
+            gnss['timestamp'] -= 1e-3
+            gnss['timestamp_rel'] -= 1e-3
+            inertial = df.copy()
+            inertial[gnss_columns] = np.nan
+            df = pd.concat([gnss, inertial]).sort_values('timestamp', kind='mergesort')
+        return df
+
+    def write(self, filepath, unmodified=True):
+        """
+        Write data to tsv file with the same header of real recordings
+
+        :param filepath: string output file path
+        :param unmodified: bool see get_dataframe()
+        """
+        df = self.get_dataframe(unmodified)
+        with open(filepath, mode='w') as file:
+            file.write("#\t")
+            df.to_csv(file, sep='\t', index=False, na_rep='', float_format='%.7f')
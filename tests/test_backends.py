@@ -0,0 +1,58 @@
+"""
+Tests for backends module.
+
+This file is part of inertial_to_blender project,
+a Blender simulation generator from inertial sensor data on cars.
+
+Copyright (C) 2018  Federico Bertani
+Author: Federico Bertani
+Credits: Federico Bertani, Stefano Sinigardi, Alessandro Fabbri, Nico Curti
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import os
+from unittest import TestCase, mock
+
+from src import backends
+from src.backends import get_backend, set_backend, use_backend, get_default_backend, available_backends, \
+    backend_variable
+
+
+class BackendsTest(TestCase):
+
+    def test_default_backend(self):
+        with mock.patch.dict(os.environ, {backend_variable: 'NumPy'}):
+            self.assertEqual(get_default_backend(), 'numpy')
+        with mock.patch.dict(os.environ, {backend_variable: ''}):
+            self.assertEqual(get_default_backend(), available_backends[0])
+        with mock.patch.dict(os.environ, {backend_variable: 'fortran'}):
+            with self.assertRaises(Exception):
+                get_default_backend()
+
+    def test_use_backend(self):
+        selected_backend = get_backend()
+        for backend in available_backends:
+            with use_backend(backend):
+                self.assertEqual(get_backend(), backend)
+                # argument wins over selected backend
+                self.assertEqual(get_backend('numpy'), 'numpy')
+            self.assertEqual(get_backend(), selected_backend)
+        with self.assertRaises(Exception):
+            set_backend('fortran')
+        self.assertEqual(get_backend(), selected_backend)
+        if backends.numba is None:
+            with self.assertRaises(Exception):
+                get_backend('numba')
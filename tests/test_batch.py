@@ -0,0 +1,68 @@
+"""
+Tests for batch ingestion module.
+
+This file is part of inertial_to_blender project,
+a Blender simulation generator from inertial sensor data on cars.
+
+Copyright (C) 2018  Federico Bertani
+Author: Federico Bertani
+Credits: Federico Bertani, Stefano Sinigardi, Alessandro Fabbri, Nico Curti
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import os
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from FullInertialFileGenerator import FullInertialFileGenerator
+from src.batch import ingest_files, find_input_files
+from src.input_manager import parse_recording
+
+inertial_filepath = 'tests/test_fixtures/crash_01.txt'
+
+
+class BatchTest(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.input_directory = os.path.join(self.temp_dir.name, 'input')
+        os.makedirs(self.input_directory)
+        for seed in range(3):
+            filepath = os.path.join(self.input_directory, 'trip{}_unmodified-fullinertial.txt'.format(seed))
+            FullInertialFileGenerator(max_time=20, seed=seed).write(filepath)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_ingest_files(self):
+        missing_filepath = os.path.join(self.temp_dir.name, 'missing_inertial.txt')
+        filepaths = find_input_files([self.input_directory, inertial_filepath, missing_filepath])
+        self.assertEqual(len(filepaths), 5)
+        progress_calls = []
+        results = ingest_files(filepaths, os.path.join(self.temp_dir.name, 'output'), workers=2,
+                               progress=lambda *args: progress_calls.append(args))
+        # progress is reported for each file
+        self.assertEqual(sorted(call[0] for call in progress_calls), list(range(1, 6)))
+        for filepath, recording in zip(filepaths[:-1], results[:-1]):
+            # results are memory maps of worker output
+            self.assertIsInstance(recording.block, np.memmap)
+            np.testing.assert_array_equal(recording.block, parse_recording(filepath).block)
+        # failed file has no result
+        self.assertIsNone(results[-1])
+        errors = {filepath: error for _, _, filepath, error in progress_calls}
+        self.assertIsNotNone(errors[missing_filepath])
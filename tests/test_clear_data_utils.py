@@ -28,8 +28,10 @@ import pandas as pd
 import numpy as np
 
 from src.clean_data_utils import reduce_disturbance, normalize_timestamp, converts_measurement_units, \
-    correct_z_orientation, clear_gyro_drift, get_stationary_times, get_xy_bad_align_count, correct_xy_orientation
+    correct_z_orientation, clear_gyro_drift, get_stationary_times, get_xy_bad_align_count, correct_xy_orientation, \
+    get_bad_alignment_vectors
 from src.input_manager import parse_input, InputType
+from FullInertialFileGenerator import FullInertialFileGenerator
 
 reduce_disturbance_window_size = 20
 
@@ -45,6 +47,36 @@ class ClearDataUtilsTest(unittest.TestCase):
         stationary_times = get_stationary_times(self.gps_speed)
         self.assertGreater(len(stationary_times),0)
 
+    def test_stationary_times_match_linear_search(self):
+        def linear_search(gps_speed):
+            # increment threshold until a stationary time at least 10 records long is found
+            speed_threshold = 1e-15
+            while True:
+                inside = np.logical_and(gps_speed > -speed_threshold, gps_speed < speed_threshold)
+                stationary_times = []
+                start = None
+                for i, value in enumerate(np.append(inside, False)):
+                    if value and start is None:
+                        start = i
+                    elif not value and start is not None:
+                        if i - 1 - start > 10:
+                            stationary_times.append((start, i - 1))
+                        start = None
+                if len(stationary_times) > 0:
+                    return stationary_times
+                speed_threshold += 0.1
+        random = np.random.RandomState(0)
+        for scale in [0.05, 0.5, 3]:
+            gps_speed = random.normal(0, scale, 2000)
+            gps_speed[500:600] = 0
+            gps_speed[1500:1505] = 0
+            self.assertEqual(get_stationary_times(gps_speed), linear_search(gps_speed))
+            self.assertEqual(get_stationary_times(gps_speed + 1.234), linear_search(gps_speed + 1.234))
+        self.assertEqual(get_stationary_times(self.gps_speed), linear_search(self.gps_speed))
+        # too short to contain a stationary time
+        with self.assertRaises(Exception):
+            get_stationary_times(np.zeros(5))
+
     def test_clearGyroDrift(self):
         drift_tolerance = 0.0002
         stationary_times = get_stationary_times(self.gps_speed)
@@ -131,4 +163,126 @@ class ClearDataUtilsTest(unittest.TestCase):
         # re-get number of records that means that there is is a bad xy alignment
         bad_align_count_len_after = get_xy_bad_align_count(self.accelerations, self.angular_velocities)
         # these records should be now less than before
-        assert bad_align_count_len_after <= bad_align_count_len_before
\ No newline at end of file
+        assert bad_align_count_len_after <= bad_align_count_len_before
+
+    def test_bad_alignment_vectors(self):
+        n = 1000
+        accelerations = np.zeros((3, n))
+        angular_velocities = np.zeros((3, n))
+        # short slice with x and y over threshold is skipped
+        accelerations[:2, 100:150] = 1
+        # first slice long at least 100 records
+        accelerations[:2, 300:500] = 1
+        # x over threshold and y below threshold until data ends
+        accelerations[0, 990:] = 1
+        accelerations[1, 990:] = -1
+        x1, x2, x3, x4 = get_bad_alignment_vectors(accelerations, angular_velocities)
+        # last record of the slice is excluded
+        np.testing.assert_array_equal(x1, accelerations[:, 300:499])
+        self.assertEqual(len(x2), 0)
+        # slice still open at the end is kept whatever its length
+        np.testing.assert_array_equal(x3, accelerations[:, 990:999])
+        self.assertEqual(len(x4), 0)
+        self.assertEqual(get_xy_bad_align_count(accelerations, angular_velocities), 199 + 9)
+        # rotating around z by 45 degrees moves accelerations on x axis only
+        with self.assertWarns(UserWarning):
+            corrected = correct_xy_orientation(accelerations, angular_velocities)
+        np.testing.assert_allclose(corrected[:, 300:500], [[np.sqrt(2)] * 200, [0] * 200, [0] * 200], atol=1e-12)
+
+    def test_correct_z_orientation_matches_quaternion_rotation(self):
+        import quaternion
+        random = np.random.RandomState(0)
+        n = 3000
+        # sensor tilted of 9 degrees around x axis
+        tilt = np.exp(quaternion.quaternion(np.deg2rad(9), 0, 0) / 2)
+        accelerations = quaternion.rotate_vectors(tilt, np.tile([0, 0, 9.81], (n, 1)) + random.normal(0, 0.1, (n, 3))).T
+        angular_velocities = random.normal(0, 0.1, (3, n))
+        # another tilt of 20 degrees from the second stationary time
+        second_tilt = np.exp(quaternion.quaternion(0, np.deg2rad(20), 0) / 2)
+        accelerations[:, 2000:] = quaternion.rotate_vectors(second_tilt, accelerations[:, 2000:].T).T
+        stationary_times = [(0, 1500), (2000, 2100)]
+        expected_accelerations = accelerations.copy()
+        expected_angular_velocities = angular_velocities.copy()
+        # first alignment uses g of all stationary times together
+        all_stationary = np.concatenate([expected_accelerations[:, start:end] for start, end in stationary_times], axis=1)
+        for i, (start, end) in enumerate(stationary_times):
+            g = all_stationary.mean(axis=1) if i == 0 else expected_accelerations[:, start:end].mean(axis=1)
+            start = 0 if i == 0 else start
+            # later stationary times realign only over 10 degrees
+            self.assertTrue(i == 0 or np.arccos(g[2] / np.linalg.norm(g)) > np.deg2rad(10))
+            axis = np.cross(g, (0, 0, 1))
+            theta = np.arccos(g[2] / np.linalg.norm(g))
+            rotator = np.exp(quaternion.quaternion(*(theta * axis / np.linalg.norm(axis))) / 2)
+            # rotate each vector with rotator * v * ~rotator
+            for vectors in [expected_accelerations, expected_angular_velocities]:
+                vectors[:, start:] = np.array([(rotator * quaternion.quaternion(*vector) * ~rotator).components[1:]
+                                               for vector in vectors[:, start:].T]).T
+        rotated_accelerations, rotated_angular_velocities = correct_z_orientation(accelerations, angular_velocities,
+                                                                                  stationary_times)
+        # rotation is in place
+        self.assertIs(rotated_accelerations, accelerations)
+        self.assertIs(rotated_angular_velocities, angular_velocities)
+        np.testing.assert_allclose(rotated_accelerations, expected_accelerations, atol=1e-12)
+        np.testing.assert_allclose(rotated_angular_velocities, expected_angular_velocities, atol=1e-12)
+        # realigned stationary time has now g along z
+        start, end = stationary_times[-1]
+        np.testing.assert_allclose(rotated_accelerations[:2, start:end].mean(axis=1), 0, atol=1e-10)
+
+    def test_reduce_disturbance_matches_pandas_rolling(self):
+        vectors = np.vstack((self.accelerations, self.angular_velocities))
+        for window_dimension in [reduce_disturbance_window_size, 7, 21]:
+            # previous implementation based on pandas centered rolling mean
+            df = pd.DataFrame(vectors.T).rolling(window=window_dimension, center=True).mean()
+            low, high = round(window_dimension / 2), round(df.shape[0] - window_dimension / 2)
+            times, reduced_vectors = reduce_disturbance(self.times, vectors, window_dimension)
+            np.testing.assert_array_equal(times, self.times[low:high])
+            np.testing.assert_allclose(reduced_vectors, df[low:high].values.T, rtol=1e-10, atol=1e-12)
+
+    def test_reduce_disturbance_time_window(self):
+        random = np.random.RandomState(0)
+        # irregular timestamps
+        times = np.cumsum(random.uniform(0.005, 0.015, 1000))
+        vectors = random.normal(0, 1, (6, 1000))
+        window_seconds = 0.5
+        new_times, reduced_vectors = reduce_disturbance(times, vectors, window_seconds=window_seconds)
+        # samples without a complete window are dropped
+        self.assertGreaterEqual(new_times[0] - window_seconds / 2, times[0])
+        self.assertLessEqual(new_times[-1] + window_seconds / 2, times[-1])
+        self.assertLess(times[np.searchsorted(times, new_times[0]) - 1] - window_seconds / 2, times[0])
+        for i in [0, 500, len(new_times) - 1]:
+            in_window = np.abs(times - new_times[i]) <= window_seconds / 2
+            np.testing.assert_allclose(reduced_vectors[:, i], vectors[:, in_window].mean(axis=1), atol=1e-12)
+        with self.assertRaises(Exception):
+            reduce_disturbance(times, vectors)
+
+    def test_clear_gyro_drift_matches_sequential_removal(self):
+        random = np.random.RandomState(0)
+        angular_velocities = random.normal(0.1, 1, (3, 20000))
+        # drift changing after every stop
+        stationary_times = [(100 + start, 150 + start) for start in range(0, 20000 - 200, 700)]
+        for start, _ in stationary_times:
+            angular_velocities[:, start:] += random.normal(0, 0.01, (3, 1))
+        expected = angular_velocities.copy()
+        # remove offset of each stationary time from its start to the end of data
+        expected -= expected[:, stationary_times[0][0]:stationary_times[0][1]].mean(axis=1)[:, np.newaxis]
+        for start, end in stationary_times[1:]:
+            expected[:, start:] -= expected[:, start:end].mean(axis=1)[:, np.newaxis]
+        result = clear_gyro_drift(angular_velocities, stationary_times)
+        self.assertIs(result, angular_velocities)
+        np.testing.assert_allclose(result, expected, atol=1e-12)
+        for start, end in stationary_times:
+            np.testing.assert_allclose(result[:, start:end].mean(axis=1), 0, atol=1e-12)
+
+    def test_clear_gyro_drift_stationary_time_after_end(self):
+        # short stop at the end of recording, found on untrimmed speed like in get_trajectory_from_path
+        generator = FullInertialFileGenerator(max_time=60, stops=[(30, 35), (59.85, 60)])
+        stationary_times = get_stationary_times(generator.speed.copy())
+        angular_velocities = np.vstack((generator.gx, generator.gy, generator.gz))
+        # trimmed as moving average does
+        angular_velocities = angular_velocities[:, 10:-10].copy()
+        self.assertGreater(stationary_times[-1][0], angular_velocities.shape[1])
+        expected = angular_velocities.copy()
+        expected -= expected[:, stationary_times[0][0]:stationary_times[0][1]].mean(axis=1)[:, np.newaxis]
+        start, end = stationary_times[1]
+        expected[:, start:] -= expected[:, start:end].mean(axis=1)[:, np.newaxis]
+        np.testing.assert_allclose(clear_gyro_drift(angular_velocities, stationary_times), expected, atol=1e-12)
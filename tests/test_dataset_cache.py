@@ -0,0 +1,104 @@
+"""
+Tests for dataset cache module.
+
+This file is part of inertial_to_blender project,
+a Blender simulation generator from inertial sensor data on cars.
+
+Copyright (C) 2018  Federico Bertani
+Author: Federico Bertani
+Credits: Federico Bertani, Stefano Sinigardi, Alessandro Fabbri, Nico Curti
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+import numpy as np
+
+from src.dataset_cache import DatasetCache
+from src.input_manager import parse_input, InputType
+
+inertial_filepath = 'tests/test_fixtures/crash_01.txt'
+
+
+class DatasetCacheTest(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache = DatasetCache(os.path.join(self.temp_dir.name, 'cache'))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_cached_parse(self):
+        # first parse fills the cache
+        expected = parse_input(inertial_filepath, [InputType.INERTIAL], cache=self.cache)
+        self.assertEqual(len(self.cache.get_entries()), 1)
+        # second parse is a memory map of cached vectors
+        vectors = parse_input(inertial_filepath, [InputType.INERTIAL], cache=self.cache)
+        for expected_vector, vector in zip(expected, vectors):
+            self.assertIsInstance(vector, np.memmap)
+            np.testing.assert_array_equal(expected_vector, vector)
+        # in-place operations must not modify cache
+        accelerations = vectors[2]
+        accelerations *= 2
+        np.testing.assert_array_equal(expected[2], parse_input(inertial_filepath, cache=self.cache)[2])
+        self.assertEqual(len(self.cache.get_entries()), 1)
+        # different slices are different entries
+        vectors = parse_input(inertial_filepath, slice_start=0, slice_end=100, cache=self.cache)
+        self.assertNotIsInstance(vectors[0], np.memmap)
+        np.testing.assert_array_equal(expected[0][:100], vectors[0])
+        self.assertEqual(len(self.cache.get_entries()), 2)
+        # parse options are keywords, their order doesn't change the key
+        self.assertEqual(self.cache.get_key(inertial_filepath, InputType.INERTIAL, slice_start=0, slice_end=100),
+                         self.cache.get_key(inertial_filepath, InputType.INERTIAL, slice_end=100, slice_start=0))
+
+    def test_modified_file_is_parsed_again(self):
+        filepath = os.path.join(self.temp_dir.name, 'crash_inertial.txt')
+        shutil.copy(inertial_filepath, filepath)
+        parse_input(filepath, cache=self.cache)
+        self.assertIsInstance(parse_input(filepath, cache=self.cache)[0], np.memmap)
+        # change modification time
+        stat = os.stat(filepath)
+        os.utime(filepath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertNotIsInstance(parse_input(filepath, cache=self.cache)[0], np.memmap)
+        self.assertEqual(len(self.cache.get_entries()), 2)
+
+    def test_lru_eviction(self):
+        filepaths = []
+        for i in range(3):
+            filepath = os.path.join(self.temp_dir.name, 'data{}.txt'.format(i))
+            with open(filepath, mode='w') as file:
+                file.write(str(i))
+            filepaths.append(filepath)
+        vectors = (np.zeros(1000), np.ones((3, 1000)))
+        self.cache.store(filepaths[0], InputType.INERTIAL, vectors)
+        time.sleep(0.01)
+        self.cache.store(filepaths[1], InputType.INERTIAL, vectors)
+        time.sleep(0.01)
+        # use first entry so the second one is the least recently used
+        self.assertIsNotNone(self.cache.load(filepaths[0], InputType.INERTIAL))
+        entry_size = self.cache.get_entries()[0][1]
+        # allow only two entries
+        self.cache.max_size = 2 * entry_size
+        time.sleep(0.01)
+        self.cache.store(filepaths[2], InputType.INERTIAL, vectors)
+        self.assertIsNotNone(self.cache.load(filepaths[0], InputType.INERTIAL))
+        self.assertIsNone(self.cache.load(filepaths[1], InputType.INERTIAL))
+        self.assertIsNotNone(self.cache.load(filepaths[2], InputType.INERTIAL))
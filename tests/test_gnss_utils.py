@@ -25,7 +25,9 @@ Credits: Federico Bertani, Stefano Sinigardi, Alessandro Fabbri, Nico Curti
 
 from unittest import TestCase
 import numpy as np
-from src.gnss_utils import get_positions, get_velocities, get_accelerations
+from src.backends import available_backends
+from src.gnss_utils import get_positions, get_velocities, get_accelerations, get_velocities_from_rates, \
+    get_first_motion_time
 from src import align_to_world
 from CircularTrajectoryGenerator import CircularTrajectoryGenerator
 
@@ -51,6 +53,37 @@ class GnssUtilsTests(TestCase):
         # ground truth is calculated online with a website that use haversine distance, while get_position doesn't
         # so limit equality to 2 decimal digit. it would be enough for small distances (gnss is 40hz)
         np.testing.assert_array_almost_equal(expected_distance, distance, decimal=2)
+        # haversine model is the one of the website
+        positions, _ = get_positions(coordinates.T, altitudes, model='haversine')
+        np.testing.assert_array_almost_equal(expected_distance, np.linalg.norm(positions, axis=0), decimal=2)
+        # ellipsoid differs from sphere less than 0.5%
+        positions, _ = get_positions(coordinates.T, altitudes, model='enu')
+        np.testing.assert_allclose(expected_distance, np.linalg.norm(positions, axis=0), rtol=5e-3)
+        with self.assertRaises(Exception):
+            get_positions(coordinates.T, altitudes, model='mercator')
+
+    def test_get_positions_matches_loop(self):
+        random = np.random.RandomState(0)
+        # random walk around Bologna
+        coordinates = np.deg2rad([[44.484372], [11.355899]]) + np.cumsum(random.normal(0, 1e-7, (2, 10000)), axis=1)
+        altitudes = 50 + random.normal(0, 1, 10000)
+        expected_positions = np.zeros((3, 10000))
+        expected_headings = np.zeros(10000)
+        # accumulate equirectangular displacements one record at a time
+        for i in range(1, 10000):
+            delta_lat = 6371000 * (coordinates[0, i] - coordinates[0, i - 1])
+            delta_lon = 6371000 * np.cos(coordinates[0, i]) * (coordinates[1, i] - coordinates[1, i - 1])
+            expected_headings[i] = np.arctan2(delta_lat, delta_lon)
+            expected_positions[:, i] = expected_positions[:, i - 1] + \
+                [delta_lon, delta_lat, altitudes[i] - altitudes[i - 1]]
+        for backend in available_backends:
+            positions, headings = get_positions(coordinates, altitudes, backend=backend)
+            np.testing.assert_allclose(positions, expected_positions, atol=1e-9)
+            np.testing.assert_allclose(headings, expected_headings, atol=1e-12)
+        # all models agree on short distances
+        for model in ['haversine', 'enu']:
+            model_positions, _ = get_positions(coordinates, altitudes, model)
+            np.testing.assert_allclose(model_positions[:2], positions[:2], atol=0.01 * np.abs(positions[:2]).max())
 
     def test_get_velocities(self):
         # decreasing step from default to allow more precise numerical differentiation (using basic technique for
@@ -82,6 +115,73 @@ class GnssUtilsTests(TestCase):
                                              accelerations[:, :-1],
                                              decimal=4)
 
+    def test_get_velocities_methods(self):
+        # central differences and polynomial fit are precise also with coarser sampling
+        trajectory_generator = CircularTrajectoryGenerator(max_time=1, time_step=1e-2)
+        times = trajectory_generator.times
+        analytical_velocities = trajectory_generator.get_analytical_velocities()[:-1]
+        velocities = get_velocities(times, trajectory_generator.trajectory, method='central')
+        # first and last velocity are one-sided
+        np.testing.assert_array_almost_equal(analytical_velocities[:, 1:-1], velocities[:, 1:-1], decimal=4)
+        velocities = get_velocities(times, trajectory_generator.trajectory, win_size=11, method='savgol')
+        # quadratic fit over 0.1 s of trajectory
+        np.testing.assert_array_almost_equal(analytical_velocities, velocities, decimal=3)
+        # polynomial fit smooths noise better than forward differences
+        noisy_trajectory = trajectory_generator.trajectory + np.random.RandomState(0).normal(0, 1e-4, (3, len(times)))
+        forward_error = np.abs(get_velocities(times, noisy_trajectory)[:, :-1] - analytical_velocities[:, :-1]).max()
+        savgol_error = np.abs(get_velocities(times, noisy_trajectory, 11, 'savgol') - analytical_velocities).max()
+        self.assertLess(savgol_error, forward_error)
+        accelerations = get_accelerations(times, analytical_velocities, method='central')
+        np.testing.assert_array_almost_equal(trajectory_generator.get_analytical_accelerations()[:-1, 1:-1],
+                                             accelerations[:, 1:-1], decimal=4)
+        with self.assertRaises(Exception):
+            get_velocities(times, trajectory_generator.trajectory, method='backward')
+        # cubic fit needs a wider window
+        velocities = get_velocities(times, trajectory_generator.trajectory, 11, 'savgol', polyorder=3)
+        np.testing.assert_array_almost_equal(analytical_velocities, velocities, decimal=3)
+        for win_size, polyorder in [(1, 2), (10, 2), (5, 5), (len(times) + 2, 2)]:
+            with self.assertRaises(Exception):
+                get_velocities(times, trajectory_generator.trajectory, win_size, 'savgol', polyorder)
+
+    def test_backends(self):
+        random = np.random.RandomState(0)
+        times = np.cumsum(random.uniform(0.008, 0.012, 1000))
+        positions = np.cumsum(random.normal(0, 1, (3, 1000)), axis=1)
+        for win_size in [1, 3, 10]:
+            expected = get_velocities(times, positions, win_size, backend='numpy')
+            for backend in available_backends:
+                np.testing.assert_array_equal(get_velocities(times, positions, win_size, backend=backend), expected)
+                np.testing.assert_array_equal(get_accelerations(times, positions, win_size, backend=backend),
+                                              expected)
+
+    def test_get_first_motion_time(self):
+        positions = np.zeros((3, 100))
+        # car moves away during first stationary time, then after it
+        positions[0, 20:] = 15
+        positions[1, 60:] = 30
+        for backend in available_backends:
+            with self.subTest(backend=backend):
+                # inside stationary time records are skipped, its end is checked
+                self.assertEqual(get_first_motion_time([(10, 40), (70, 80)], positions, backend), 40)
+                self.assertEqual(get_first_motion_time([(0, 10)], positions, backend), 20)
+                # altitude doesn't count
+                self.assertEqual(get_first_motion_time([(0, 10)], positions[[2, 2, 0]], backend), 100)
+                # stationary time until the end
+                self.assertEqual(get_first_motion_time([(0, 120)], positions, backend), 100)
+
+    def test_get_velocities_from_rates(self):
+        times = np.arange(0, 10, 1e-2)
+        # coordinates changing at constant rate
+        coordinate_rates = np.tile([[1e-6], [2e-6]], len(times))
+        coordinates = np.deg2rad([[44.484372], [11.355899]]) + coordinate_rates * times
+        velocities = get_velocities_from_rates(coordinates, coordinate_rates)
+        np.testing.assert_allclose(velocities[1], 6371000 * 1e-6)
+        np.testing.assert_allclose(velocities[0], 6371000 * np.cos(coordinates[0]) * 2e-6)
+        # equal to numerical differentiation of positions
+        positions, _ = get_positions(coordinates, np.zeros(len(times)))
+        np.testing.assert_allclose(velocities[:, 1:-1], get_velocities(times, positions, method='central')[:, 1:-1],
+                                   rtol=1e-6)
+
     def test_align_to_world(self):
         # create a basic trajectory of a point traveling on x axis
         trajectory = np.vstack((
@@ -0,0 +1,233 @@
+"""
+Tests for input manager module.
+
+This file is part of inertial_to_blender project,
+a Blender simulation generator from inertial sensor data on cars.
+
+Copyright (C) 2018  Federico Bertani
+Author: Federico Bertani
+Credits: Federico Bertani, Stefano Sinigardi, Alessandro Fabbri, Nico Curti
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import bz2
+import gzip
+import lzma
+import os
+import shutil
+import tempfile
+from functools import partial
+from unittest import TestCase
+
+import numpy as np
+
+from FullInertialFileGenerator import FullInertialFileGenerator
+from src.clean_data_utils import get_stationary_times
+from src.input_manager import parse_input, iter_input_chunks, InputType, resample_gnss, \
+    sniff_input_type, read_input, get_vectors, parse_recording
+
+inertial_filepath = 'tests/test_fixtures/crash_01.txt'
+
+
+class InputManagerTest(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        generator = FullInertialFileGenerator()
+        # file names without hints force detection from content
+        self.fullinertial_filepath = os.path.join(self.temp_dir.name, 'fi.txt')
+        generator.write(self.fullinertial_filepath, unmodified=False)
+        self.unmod_fullinertial_filepath = os.path.join(self.temp_dir.name, 'ufi.txt')
+        generator.write(self.unmod_fullinertial_filepath, unmodified=True)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def assert_vectors_equal(self, expected, actual):
+        self.assertEqual(len(expected), len(actual))
+        for expected_vector, actual_vector in zip(expected, actual):
+            np.testing.assert_array_equal(expected_vector, actual_vector)
+
+    def test_detect_fullinertial(self):
+        self.assertEqual(len(parse_input(self.fullinertial_filepath, [InputType.FULLINERTIAL])), 7)
+        self.assertEqual(len(parse_input(self.unmod_fullinertial_filepath, [InputType.UNMOD_FULLINERTIAL])), 7)
+
+    def test_sniff_input_type(self):
+        self.assertEqual(sniff_input_type(inertial_filepath), InputType.INERTIAL)
+        self.assertEqual(sniff_input_type(self.fullinertial_filepath), InputType.FULLINERTIAL)
+        self.assertEqual(sniff_input_type(self.unmod_fullinertial_filepath), InputType.UNMOD_FULLINERTIAL)
+        # file name hint wins over content
+        self.assertEqual(sniff_input_type('missing_gnss.txt'), InputType.GNSS)
+        # rejected before parsing
+        with self.assertRaises(Exception):
+            parse_input(self.unmod_fullinertial_filepath, [InputType.INERTIAL])
+
+    def test_iter_input_chunks(self):
+        chunk_size = 1000
+        rows = 0
+        for columns, block in iter_input_chunks(inertial_filepath, chunk_size):
+            # a row for each column
+            self.assertEqual(block.shape[0], len(columns))
+            self.assertLessEqual(block.shape[1], chunk_size)
+            self.assertTrue(block.flags['C_CONTIGUOUS'])
+            self.assertEqual(block.dtype, np.float64)
+            rows += block.shape[1]
+        self.assertEqual(columns[0], 'timestamp')
+        self.assertEqual(rows, parse_input(inertial_filepath)[0].shape[0])
+
+    def test_chunked_parse_matches_full_parse(self):
+        for filepath in [inertial_filepath, self.fullinertial_filepath, self.unmod_fullinertial_filepath]:
+            # chunk size not multiple of row count to test last partial chunk
+            self.assert_vectors_equal(parse_input(filepath), parse_input(filepath, chunk_size=777))
+            self.assert_vectors_equal(parse_input(filepath, slice_start=100, slice_end=5000),
+                                      parse_input(filepath, slice_start=100, slice_end=5000, chunk_size=777))
+
+    def test_resample_gnss(self):
+        df = FullInertialFileGenerator().get_dataframe(unmodified=True)
+        gnss_df = df.dropna(subset=['lat'])
+        gnss_data = gnss_df[['lat', 'lon', 'alt', 'heading', 'speed']].values.T
+        times = df.dropna(subset=['ax'])['timestamp'].values
+        from scipy.interpolate import interp1d
+        for kind in ['linear', 'quadratic', 'cubic']:
+            # evaluate interpolant one timestamp at a time
+            coord_func = interp1d(x=gnss_df['timestamp'].values, y=gnss_data, kind=kind,
+                                  fill_value='extrapolate', assume_sorted=True)
+            expected = np.array([coord_func(time) for time in times]).T
+            np.testing.assert_allclose(resample_gnss(times, gnss_df['timestamp'].values, gnss_data, kind), expected,
+                                       rtol=1e-12)
+            # derivatives of coordinates rows of the same spline
+            resampled, derivatives = resample_gnss(times, gnss_df['timestamp'].values, gnss_data, kind, slice(0, 2))
+            np.testing.assert_allclose(resampled, expected, rtol=1e-12)
+            coordinates_func = interp1d(x=gnss_df['timestamp'].values, y=gnss_data[0:2], kind=kind,
+                                        fill_value='extrapolate', assume_sorted=True)
+            # central differences of the interpolant
+            step = 1e-3
+            np.testing.assert_allclose(derivatives, (coordinates_func(times + step) - coordinates_func(times - step))
+                                       / (2 * step), rtol=1e-4, atol=1e-9)
+        with self.assertRaises(Exception):
+            resample_gnss(times, gnss_df['timestamp'].values, gnss_data, 'nearest')
+
+    def test_single_precision(self):
+        for filepath in [inertial_filepath, self.unmod_fullinertial_filepath]:
+            expected = parse_input(filepath)
+            vectors = parse_input(filepath, single_precision=True)
+            # timestamps are always double precision
+            self.assertEqual(vectors[0].dtype, np.float64)
+            np.testing.assert_array_equal(expected[0], vectors[0])
+            # accelerations and angular velocities are the last two vectors
+            for expected_vector, vector in zip(expected[-2:], vectors[-2:]):
+                self.assertEqual(vector.dtype, np.float32)
+                np.testing.assert_allclose(expected_vector, vector, rtol=1e-6, atol=1e-6)
+
+    def test_sliced_parse(self):
+        for filepath in [inertial_filepath, self.unmod_fullinertial_filepath]:
+            input_type = sniff_input_type(filepath)
+            df = read_input(filepath)
+            for slice_start, slice_end in [(None, 3000), (1000, None), (1000, 3000), (1000, -1000)]:
+                # slicing while parsing must be equal to slicing after parsing
+                self.assert_vectors_equal(get_vectors(df[slice_start:slice_end], input_type),
+                                          parse_input(filepath, slice_start=slice_start, slice_end=slice_end))
+            times = parse_input(filepath)[0]
+            # window in the middle of the recording
+            time_start = times[0] + 2.5
+            time_end = times[0] + 7.5
+            full_vectors = parse_input(filepath)
+            in_window = np.logical_and(full_vectors[0] >= time_start, full_vectors[0] <= time_end)
+            for chunk_size in [None, 100]:
+                vectors = parse_input(filepath, time_start=time_start, time_end=time_end, chunk_size=chunk_size)
+                np.testing.assert_array_equal(vectors[0], full_vectors[0][in_window])
+                # inertial vectors are not interpolated
+                np.testing.assert_array_equal(vectors[-1], full_vectors[-1][:, in_window])
+            # rows and time slicing together
+            sliced_times = get_vectors(df[100:-100], input_type)[0]
+            vectors = parse_input(filepath, slice_start=100, slice_end=-100, time_start=time_start)
+            np.testing.assert_array_equal(vectors[0], sliced_times[sliced_times >= time_start])
+        with self.assertRaises(Exception):
+            parse_input(inertial_filepath, slice_end=10 ** 9)
+        times = parse_input(inertial_filepath)[0]
+        # time window before first timestamp has no rows
+        for chunk_size in [None, 500]:
+            vectors = parse_input(inertial_filepath, time_end=times[0] - 1, chunk_size=chunk_size)
+            self.assertEqual(vectors[0].shape, (0,))
+            self.assertEqual(vectors[-1].shape, (3, 0))
+        with self.assertRaises(Exception):
+            parse_input(inertial_filepath, time_start=times[3000], time_end=times[500], chunk_size=500)
+        # slice end is checked also with time slicing
+        with self.assertRaises(Exception):
+            parse_input(inertial_filepath, slice_end=10 ** 9, time_start=times[100])
+        # but not when parsing stops at time end
+        vectors = parse_input(inertial_filepath, slice_end=10 ** 9, time_start=times[100], time_end=times[500])
+        np.testing.assert_array_equal(vectors[0], times[100:501])
+        # row slicing counts rows from the beginning also with time start
+        np.testing.assert_array_equal(parse_input(inertial_filepath, slice_end=3000, time_start=times[100])[0],
+                                      times[100:3000])
+
+    def test_parse_recording(self):
+        for filepath in [inertial_filepath, self.fullinertial_filepath, self.unmod_fullinertial_filepath]:
+            recording = parse_recording(filepath)
+            self.assertTrue(recording.block.flags['C_CONTIGUOUS'])
+            # recording unpacks like parse_input result
+            self.assert_vectors_equal(parse_input(filepath), tuple(recording))
+            # views share recording memory
+            for vector in recording:
+                self.assertTrue(np.shares_memory(vector, recording.block))
+            np.testing.assert_array_equal(recording.inertial, np.vstack((recording.accelerations,
+                                                                         recording.angular_velocities)))
+            trimmed = recording.trim(10, -10)
+            self.assertEqual(len(trimmed), len(recording) - 20)
+            trimmed.accelerations[:] = 0
+            self.assertTrue(np.all(recording.accelerations[:, 10:-10] == 0))
+
+    def test_coordinate_rates(self):
+        recording = parse_recording(self.unmod_fullinertial_filepath)
+        self.assertTrue(recording.has_coordinate_rates)
+        # derivative of the interpolating spline is close to numerical derivative of interpolated coordinates,
+        # apart from spline ringing when the car starts moving
+        numerical_rates = np.gradient(recording.coordinates, recording.times, axis=1)
+        np.testing.assert_allclose(recording.coordinate_rates[:, 1:-1], numerical_rates[:, 1:-1],
+                                   atol=5e-2 * np.abs(numerical_rates).max())
+        np.testing.assert_allclose(recording.coordinate_rates[:, 1500:-1], numerical_rates[:, 1500:-1],
+                                   atol=5e-3 * np.abs(numerical_rates).max())
+        # car is stationary for the first 10 seconds
+        np.testing.assert_allclose(recording.coordinate_rates[:, :900], 0, atol=1e-9)
+        # only interpolated gnss data has coordinate rates
+        self.assertIsNone(parse_recording(self.fullinertial_filepath).coordinate_rates)
+        self.assertIsNone(parse_recording(inertial_filepath).coordinate_rates)
+
+    def test_generated_stops(self):
+        filepath = os.path.join(self.temp_dir.name, 'stops_ufi.txt')
+        FullInertialFileGenerator(max_time=60, stops=[(30, 35)]).write(filepath, unmodified=True)
+        recording = parse_recording(filepath)
+        # car stands still at the start and during the stop, edges are smoothed by gnss interpolation
+        (first_start, first_end), (stop_start, stop_end) = get_stationary_times(recording.gps_speed.copy())
+        self.assertEqual(first_start, 0)
+        self.assertLessEqual(first_end, 1000)
+        self.assertTrue(3000 <= stop_start < stop_end <= 3500)
+
+    def test_compressed_input(self):
+        for opener, suffix in [(gzip.open, '.gz'), (lzma.open, '.xz'), (bz2.open, '.bz2'),
+                               (partial(lzma.open, format=lzma.FORMAT_ALONE), '.lzma')]:
+            for filepath in [inertial_filepath, self.unmod_fullinertial_filepath]:
+                compressed_filepath = os.path.join(self.temp_dir.name, os.path.basename(filepath) + suffix)
+                with open(filepath, mode='rb') as file, opener(compressed_filepath, mode='wb') as compressed_file:
+                    shutil.copyfileobj(file, compressed_file)
+                self.assertEqual(sniff_input_type(compressed_filepath), sniff_input_type(filepath))
+                self.assert_vectors_equal(parse_input(filepath), parse_input(compressed_filepath, chunk_size=1000))
+                times = parse_input(filepath)[0]
+                self.assert_vectors_equal(parse_input(filepath, time_start=times[100], time_end=times[-100]),
+                                          parse_input(compressed_filepath, time_start=times[100], time_end=times[-100]))
+        # compression suffix is ignored when detecting type from name
+        self.assertEqual(sniff_input_type('trip_unmodified-fullinertial.txt.gz'), InputType.UNMOD_FULLINERTIAL)
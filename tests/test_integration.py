@@ -27,8 +27,11 @@ from unittest import TestCase
 import numpy as np
 from SpringTrajectoryGenerator import SpringTrajectoryGenerator
 from CircularTrajectoryGenerator import CircularTrajectoryGenerator
-from src.integrate import cumulative_integrate, quad_integrate, trapz_integrate
-from src import rotate_accelerations
+from src.backends import available_backends, use_backend
+from src.integrate import cumulative_integrate, quad_integrate, trapz_integrate, simps_integrate_delta, \
+    trapz_integrate_delta, batch_cumulative_integrate, batch_simps_integrate_delta, batch_trapz_integrate_delta
+from src import rotate_accelerations, align_to_world
+from src.rotations import chain_quaternions, get_world_alignment_angle
 
 
 def integrate_and_test(method):
@@ -94,6 +97,154 @@ class IntegrationTest(TestCase):
             # check error is below a threshold
             self.assertTrue(error.mean() < 0.005)
 
+    def test_simps_integrate_delta(self):
+        random = np.random.RandomState(0)
+        # irregular sampling
+        times = np.cumsum(random.uniform(0.008, 0.012, 1000))
+        vectors = random.normal(0, 1, (3, 1000))
+        expected = np.zeros((3, 1000))
+        for j in range(1000 - 2):
+            # fit parabola on each 3 records, in local time to avoid cancellation
+            x = times[j:j + 3] - times[j]
+            matrix = np.array([x ** 2, x, np.ones(3)]).T
+            for i in range(3):
+                A, B, C = np.linalg.solve(matrix, vectors[i, j:j + 3])
+                expected[i, j + 1] = A / 3 * x[1] ** 3 + B / 2 * x[1] ** 2 + C * x[1]
+                if j == 1000 - 3:
+                    # last element is the integral of last part of last parabola
+                    expected[i, j + 2] = A / 3 * (x[2] ** 3 - x[1] ** 3) + B / 2 * (x[2] ** 2 - x[1] ** 2) + \
+                                         C * (x[2] - x[1])
+        deltas = simps_integrate_delta(times, vectors)
+        np.testing.assert_allclose(deltas, expected, rtol=0, atol=1e-12)
+        # exact on parabolas
+        parabola = np.tile(0.3 * times ** 2 - 2 * times + 5, (3, 1))
+        primitive = 0.1 * times ** 3 - times ** 2 + 5 * times
+        np.testing.assert_allclose(np.cumsum(simps_integrate_delta(times, parabola), axis=1),
+                                   np.tile(primitive - primitive[0], (3, 1)), atol=1e-9)
+        # nothing to integrate with less than 3 records
+        np.testing.assert_array_equal(simps_integrate_delta(times[:2], vectors[:, :2]), np.zeros((3, 2)))
+
+    def test_cumulative_integrate_adjust(self):
+        random = np.random.RandomState(0)
+        times = np.cumsum(random.uniform(0.008, 0.012, 500))
+        for rows, adjust_frequency in [(3, 1), (3, 7), (1, 1), (1, 4), (2, 3)]:
+            vectors = random.normal(0, 1, (rows, 500))
+            adjust_data = random.normal(0, 5, (rows, 500))
+            initial = random.normal(0, 1, rows)
+            deltas = simps_integrate_delta(times, vectors)
+            # blend with adjust data one step at a time
+            expected = np.zeros((rows, 500))
+            expected[:, 0] = initial
+            for i in range(1, 500):
+                if i % adjust_frequency != 0:
+                    expected[:, i] = expected[:, i - 1] + deltas[:, i]
+                elif rows in (1, 3):
+                    # z-axis is not adjusted and restarts from zero
+                    adjusted = 1 if rows == 1 else 2
+                    expected[:adjusted, i] = adjust_data[:adjusted, i] * 0.02 + \
+                        (expected[:adjusted, i - 1] + deltas[:adjusted, i]) * 0.98
+            for backend in available_backends:
+                integrated = cumulative_integrate(times, vectors, initial, adjust_data=adjust_data,
+                                                  adjust_frequency=adjust_frequency, adjust_gain=0.02, backend=backend)
+                np.testing.assert_allclose(integrated, expected, rtol=1e-12, atol=1e-12)
+        # with full gain x and y are reset to adjust data
+        integrated = cumulative_integrate(times, vectors[:1].repeat(3, axis=0), adjust_data=adjust_data[:1].repeat(3, 0),
+                                          adjust_frequency=5, adjust_gain=1)
+        np.testing.assert_allclose(integrated[:2, 5::5], adjust_data[:1].repeat(2, 0)[:, 5::5])
+
+    def test_cumulative_integrate_adjust_shape(self):
+        random = np.random.RandomState(0)
+        times = np.cumsum(random.uniform(0.008, 0.012, 50))
+        vectors = random.normal(0, 1, (3, 50))
+        for backend in available_backends:
+            # no rows left for x and y, no rows at all, shorter than vectors
+            for adjust_data in [vectors[:1], vectors[:0], vectors[:, :40]]:
+                with self.assertRaises(Exception):
+                    cumulative_integrate(times, vectors, adjust_data=adjust_data, adjust_frequency=1, backend=backend)
+                with self.assertRaises(Exception):
+                    cumulative_integrate(times, vectors[:1], adjust_data=adjust_data[:0], adjust_frequency=1,
+                                         backend=backend)
+
+    def test_cumulative_integrate_trapz(self):
+        random = np.random.RandomState(0)
+        times = np.cumsum(random.uniform(0.008, 0.012, 50))
+        vectors = random.normal(0, 1, (3, 50))
+        initial = random.normal(0, 1, 3)
+        for backend in available_backends:
+            integrated = cumulative_integrate(times, vectors, initial, trapz_integrate_delta, backend=backend)
+            # a value for each sample, equal to trapezoidal rule integration
+            self.assertEqual(integrated.shape, (3, 50))
+            np.testing.assert_array_equal(integrated, trapz_integrate(times, vectors, initial))
+            # integrated vectors can be integrated again, also with adjust data
+            twice_integrated = cumulative_integrate(times, integrated, initial, trapz_integrate_delta,
+                                                    adjust_data=vectors, adjust_frequency=3, backend=backend)
+            self.assertEqual(twice_integrated.shape, (3, 50))
+            self.assertTrue(np.all(np.isfinite(twice_integrated)))
+
+    def test_backends(self):
+        random = np.random.RandomState(0)
+        times = np.cumsum(random.uniform(0.008, 0.012, 1000))
+        vectors = random.normal(0, 1, (3, 1000))
+        initial = random.normal(0, 1, 3)
+        # add rectangles and trapezoids one at a time
+        expected_quad = np.zeros((3, 1000))
+        expected_trapz = np.zeros((3, 1000))
+        expected_quad[:, 0] = expected_trapz[:, 0] = initial
+        for i in range(999):
+            dt = times[i + 1] - times[i]
+            expected_quad[:, i + 1] = expected_quad[:, i] + vectors[:, i + 1] * dt
+            expected_trapz[:, i + 1] = expected_trapz[:, i] + ((vectors[:, i] + vectors[:, i + 1]) * dt) / 2
+        simps_deltas = simps_integrate_delta(times, vectors, backend='numpy')
+        for backend in available_backends:
+            with self.subTest(backend=backend):
+                # sums are in the same order
+                np.testing.assert_array_equal(quad_integrate(times, vectors, initial, backend), expected_quad)
+                np.testing.assert_array_equal(trapz_integrate(times, vectors, initial, backend), expected_trapz)
+                np.testing.assert_allclose(simps_integrate_delta(times, vectors, backend), simps_deltas,
+                                           rtol=1e-14, atol=1e-15)
+                with use_backend(backend):
+                    # whole trajectory integration with the selected backend
+                    self.assertLess(integrate_and_test(cumulative_integrate).mean(), 0.05)
+        with self.assertRaises(Exception):
+            quad_integrate(times, vectors, initial, backend='fortran')
+
+    def test_batch_integrate(self):
+        random = np.random.RandomState(0)
+        batch = 5
+        times = np.cumsum(random.uniform(0.008, 0.012, (batch, 300)), axis=1)
+        vectors = random.normal(0, 1, (batch, 3, 300))
+        initial = random.normal(0, 1, (batch, 3))
+        adjust_data = random.normal(0, 5, (batch, 3, 300))
+        for backend in available_backends:
+            with self.subTest(backend=backend), use_backend(backend):
+                # each trip is equal to single trip integration
+                integrated = batch_cumulative_integrate(times, vectors, initial, adjust_data=adjust_data,
+                                                        adjust_frequency=3)
+                simps_deltas = batch_simps_integrate_delta(times, vectors)
+                trapz_deltas = batch_trapz_integrate_delta(times, vectors)
+                for trip in range(batch):
+                    np.testing.assert_array_equal(integrated[trip], cumulative_integrate(
+                        times[trip], vectors[trip], initial[trip], adjust_data=adjust_data[trip], adjust_frequency=3))
+                    np.testing.assert_array_equal(simps_deltas[trip], simps_integrate_delta(times[trip], vectors[trip]))
+                    np.testing.assert_array_equal(trapz_deltas[trip], trapz_integrate_delta(times[trip], vectors[trip]))
+                # times and initial values shared by all trips
+                integrated = batch_cumulative_integrate(times[0], vectors, initial[0])
+                for trip in range(batch):
+                    np.testing.assert_array_equal(integrated[trip],
+                                                  cumulative_integrate(times[0], vectors[trip], initial[0]))
+                # trapezoidal rule gives a value for each sample too
+                integrated = batch_cumulative_integrate(times, vectors, initial, batch_trapz_integrate_delta,
+                                                        adjust_data=adjust_data, adjust_frequency=3)
+                self.assertEqual(integrated.shape, vectors.shape)
+                for trip in range(batch):
+                    np.testing.assert_array_equal(integrated[trip], cumulative_integrate(
+                        times[trip], vectors[trip], initial[trip], trapz_integrate_delta, adjust_data=adjust_data[trip],
+                        adjust_frequency=3))
+        with self.assertRaises(Exception):
+            batch_cumulative_integrate(times[:, :-1], vectors)
+        with self.assertRaises(Exception):
+            batch_cumulative_integrate(times[0], vectors[0])
+
 
 class RotationTest(TestCase):
 
@@ -143,3 +294,56 @@ class RotationTest(TestCase):
         positions = cumulative_integrate(times, velocities, initial_position)
         # if the integrated trajectory and the analytical one are equal thant both the integrator and the rotator works
         np.testing.assert_array_almost_equal(positions, circular_tra.trajectory, decimal=3)
+
+    def test_chain_quaternions(self):
+        import quaternion
+        from functools import reduce
+        random = np.random.RandomState(0)
+        quaternions = quaternion.from_rotation_vector(random.normal(0, 0.1, (1000, 3)))
+        original_quaternions = quaternions.copy()
+        # aggregate one rotation at a time, last rotation on the left
+        expected = np.array(reduce(lambda array, element: [*array, element * array[-1]], quaternions[1:],
+                                   [quaternions[0]]))
+        for backend in available_backends:
+            chain = chain_quaternions(quaternions, backend)
+            np.testing.assert_array_equal(quaternion.as_float_array(chain), quaternion.as_float_array(expected))
+        # input is not modified
+        np.testing.assert_array_equal(quaternion.as_float_array(quaternions),
+                                      quaternion.as_float_array(original_quaternions))
+
+    def test_blocked_chain_quaternions(self):
+        import quaternion
+        random = np.random.RandomState(1)
+        quaternions = quaternion.from_rotation_vector(random.normal(0, 0.1, (1001, 3)))
+        expected = quaternion.as_float_array(chain_quaternions(quaternions, 'numpy'))
+        for backend in available_backends:
+            # blocks of one quaternion, not dividing n and bigger than n
+            for block_size in [1, 32, 2000]:
+                chain = quaternion.as_float_array(chain_quaternions(quaternions, backend, block_size))
+                np.testing.assert_allclose(chain, expected, rtol=0, atol=1e-13)
+                np.testing.assert_allclose(np.linalg.norm(chain, axis=1), 1, rtol=0, atol=1e-15)
+        # rotation of accelerations with blocked scan
+        times = np.arange(1001) * 1e-2
+        accelerations = random.normal(0, 1, (3, 1001))
+        angular_velocities = random.normal(0, 1, (3, 1001))
+        expected = rotate_accelerations(times, accelerations, angular_velocities, None)
+        for vector, expected_vector in zip(rotate_accelerations(times, accelerations, angular_velocities, None,
+                                                                scan_block_size=100), expected):
+            np.testing.assert_allclose(vector, expected_vector, rtol=0, atol=1e-12)
+
+    def test_world_alignment_angle(self):
+        random = np.random.RandomState(2)
+        times = np.arange(500) * 1e-2
+        accelerations = random.normal(0, 1, (3, 500))
+        angular_velocities = random.normal(0, 1, (3, 500))
+        gnss_positions = np.cumsum(random.normal(0, 1, (3, 500)), axis=1)
+        lab_accelerations, lab_angular_positions = rotate_accelerations(times, accelerations, angular_velocities,
+                                                                        None, [0, 0, 0.5])
+        world_accelerations, world_angular_positions = rotate_accelerations(
+            times, accelerations, angular_velocities, None, [0, 0, 0.5],
+            world_alignment_angle=get_world_alignment_angle(gnss_positions, 100))
+        # same of aligning in another pass
+        np.testing.assert_allclose(world_accelerations, align_to_world(gnss_positions, lab_accelerations, 100),
+                                   rtol=0, atol=1e-12)
+        # angular positions are not aligned
+        np.testing.assert_array_equal(world_angular_positions, lab_angular_positions)
@@ -0,0 +1,130 @@
+"""
+Tests for fused preprocessing module.
+
+This file is part of inertial_to_blender project,
+a Blender simulation generator from inertial sensor data on cars.
+
+Copyright (C) 2018  Federico Bertani
+Author: Federico Bertani
+Credits: Federico Bertani, Stefano Sinigardi, Alessandro Fabbri, Nico Curti
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import contextlib
+import io
+import warnings
+from unittest import TestCase
+
+import numpy as np
+import quaternion
+
+from src.clean_data_utils import converts_measurement_units, reduce_disturbance, clear_gyro_drift, \
+    normalize_timestamp, correct_z_orientation, get_stationary_times
+from src.input_manager import parse_input, InputType
+from src.backends import available_backends
+from src.preprocessing import preprocess_inertial
+
+window_size = 20
+# documented tolerance of fused preprocessing
+tolerance = 1e-9
+
+
+def preprocess_separately(times, inertial, stationary_times):
+    """ Chain of clean_data_utils functions as in get_trajectory_from_path """
+    inertial = inertial.copy()
+    converts_measurement_units(inertial[:3], inertial[3:])
+    times, inertial = reduce_disturbance(times.copy(), inertial, window_size)
+    accelerations = inertial[:3]
+    angular_velocities = clear_gyro_drift(inertial[3:], stationary_times)
+    normalize_timestamp(times)
+    with contextlib.redirect_stdout(io.StringIO()):
+        accelerations, angular_velocities = correct_z_orientation(accelerations, angular_velocities, stationary_times)
+    accelerations[2] -= accelerations[2, stationary_times[0][0]:stationary_times[0][-1]].mean()
+    return times, accelerations, angular_velocities
+
+
+class PreprocessingTest(TestCase):
+
+    def setUp(self):
+        self.backends = available_backends
+
+    def assert_preprocessing_equal(self, times, inertial, stationary_times):
+        expected = preprocess_separately(times, inertial, stationary_times)
+        original_inertial = inertial.copy()
+        for backend in self.backends:
+            result = preprocess_inertial(times, inertial, stationary_times, window_size, backend=backend)
+            for expected_vector, vector in zip(expected, result):
+                self.assertEqual(expected_vector.shape, vector.shape)
+                np.testing.assert_allclose(vector, expected_vector, rtol=0, atol=tolerance)
+        # input is not modified
+        np.testing.assert_array_equal(inertial, original_inertial)
+
+    def test_matches_separate_functions(self):
+        times, gps_speed, accelerations, angular_velocities = parse_input('tests/test_fixtures/crash_01.txt',
+                                                                          [InputType.INERTIAL])
+        converts_measurement_units(None, None, gps_speed)
+        stationary_times = get_stationary_times(gps_speed)
+        self.assert_preprocessing_equal(times, np.vstack((accelerations, angular_velocities)), stationary_times)
+
+    def test_realignment(self):
+        random = np.random.RandomState(0)
+        n = 20000
+        times = 555081678 + np.arange(n) * 1e-2
+        # sensor tilted of 9 degrees, then of 25 degrees more after the third stop
+        tilt = np.exp(quaternion.quaternion(np.deg2rad(9), 0, 0) / 2)
+        accelerations = np.tile([0.0, 0.0, 1.0], (n, 1)) + random.normal(0, 0.01, (n, 3))
+        accelerations = quaternion.rotate_vectors(tilt, accelerations).T
+        second_tilt = np.exp(quaternion.quaternion(0, np.deg2rad(25), 0) / 2)
+        accelerations[:, 12000:] = quaternion.rotate_vectors(second_tilt, accelerations[:, 12000:].T).T
+        # gyroscope drift changing at every stop
+        angular_velocities = random.normal(0, 0.5, (3, n)) + np.repeat(random.normal(0, 1, (3, 4)), n // 4, axis=1)
+        stationary_times = [(0, 3000), (5000, 5200), (12000, 12300), (15000, 15100)]
+        with warnings.catch_warnings(record=True) as caught_warnings:
+            warnings.simplefilter('always')
+            self.assert_preprocessing_equal(times, np.vstack((accelerations, angular_velocities)), stationary_times)
+        self.assertGreater(len(caught_warnings), 0)
+
+    def test_stationary_time_after_end(self):
+        random = np.random.RandomState(2)
+        n = 2000
+        times = np.arange(n) * 1e-2
+        inertial = random.normal(0, 0.01, (6, n))
+        inertial[2] += 1
+        # last stop starts after the end of smoothed data
+        stationary_times = [(0, 500), (1000, 1200), (n - 5, n)]
+        expected = preprocess_separately(times, inertial, stationary_times[:2])
+        for backend in self.backends:
+            with warnings.catch_warnings():
+                # mean of empty slice
+                warnings.simplefilter('error', RuntimeWarning)
+                result = preprocess_inertial(times, inertial, stationary_times, window_size, backend=backend)
+            for expected_vector, vector in zip(expected, result):
+                np.testing.assert_allclose(vector, expected_vector, rtol=0, atol=tolerance)
+
+    def test_output_buffer(self):
+        random = np.random.RandomState(1)
+        times = np.arange(1000) * 1e-2
+        inertial = random.normal(0, 1, (6, 1000))
+        inertial[2] += 1
+        out = np.empty((6, 1000 - window_size))
+        for backend in self.backends:
+            new_times, accelerations, angular_velocities = preprocess_inertial(times, inertial, [(0, 100)],
+                                                                               window_size, out, backend)
+            self.assertTrue(np.shares_memory(accelerations, out))
+            self.assertTrue(np.shares_memory(angular_velocities, out))
+            self.assertEqual(new_times[0], 0)
+        with self.assertRaises(Exception):
+            preprocess_inertial(times, inertial, [(0, 100)], window_size, backend='fortran')